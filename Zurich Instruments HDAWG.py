@@ -16,10 +16,15 @@
 # Python rudimentaries
 from __future__ import print_function
 from BaseDriver import LabberDriver, Error, IdError
+from concurrent.futures import ThreadPoolExecutor
 from datetime   import datetime
 
+import contextlib
+import functools
 import glob
+import hashlib
 import inspect
+import json
 import numpy as np
 import os
 import psutil
@@ -47,14 +52,37 @@ class Driver(LabberDriver):
     Zurich Instruments devices connected to the Instrument server PC.
     '''
     
+    # The phases of a sweep point whose durations are recorded, see
+    # PhaseTimer. The order matches the 'Timing phase' combo box.
+    timed_phases = [ \
+        'Waveform assembly', \
+        'Waveform diffing', \
+        'Sequencer generation', \
+        'Compile', \
+        'ELF upload', \
+        'Waveform upload', \
+        'Enable', \
+        ]
+    
     def performOpen(self, options={}):
         '''Perform the action of opening the instrument.
         '''
         
+        # Record the durations of the phases of every sweep point.
+        self.phase_timer = PhaseTimer(self.timed_phases)
+        
+        # Waveforms are transferred to one AWG core on a separate thread,
+        # while the waveforms of the next core are being encoded.
+        # See writeWaveformToMemory.
+        self.upload_pool = ThreadPoolExecutor(max_workers = 1)
+        
         # Instantiate the instrument connection, the ZI API, AWG module,
         # and more.
         self.instantiateInstrumentConnection()
         
+        # Prepare the set functions of the 'other' datatype quantities.
+        self.buildOtherCommandDispatch()
+        
         # Create an initial configuration of stored waveforms.
         # These will constitute a local set used to track what waveforms are
         # used / changed etc.
@@ -76,25 +104,29 @@ class Driver(LabberDriver):
         # A try-exception is done since the API session might not have
         # been instantiated.
         try:
-            self.daq.setInt('/'+str(self.dev)+'/awgs/0/enable', 0)
+            self.setNode('/'+str(self.dev)+'/awgs/0/enable', 0, volatile = True)
             
             # If configured to, turn off all outputs when closing the device
             if self.getValue('Disable outputs on close'):
                 for i in range(0, self.n_ch):
 
-                    self.daq.setInt('/'+str(self.dev)+'/sigouts/'+str(i)+'/direct',0)
+                    self.setNode('/'+str(self.dev)+'/sigouts/'+str(i)+'/direct',0)
                     self.setValue('Channel '+str(i+1)+' - Bypass DAC to port', False)
                     
-                    self.daq.setInt('/'+str(self.dev)+'/sigouts/'+str(i)+'/on',0)
+                    self.setNode('/'+str(self.dev)+'/sigouts/'+str(i)+'/on',0)
                     self.setValue('Channel '+str(i+1)+' - Output', False)
                     
-                    self.daq.setInt('/'+str(self.dev)+'/sigouts/'+str(i)+'/filter', 0)
+                    self.setNode('/'+str(self.dev)+'/sigouts/'+str(i)+'/filter', 0)
                     self.setValue('Channel '+str(i+1)+' - Filter', False)
                     
                 
             # If configured to, signal LEDs when disconnecting
             if self.getValue('Signal LEDs on close'):
-                self.daq.setInt('/' + self.dev + '/system/identify', 1)
+                self.setNode('/' + self.dev + '/system/identify', 1, \
+                    volatile = True)
+            
+            # Send all of the above as a single transaction.
+            self.flushNodeWrites()
         
         except:
             # TODO So ZIAPINotFoundException is generated. How will we define a suitable exception to be thrown at this instance?
@@ -103,6 +135,12 @@ class Driver(LabberDriver):
             self.log( \
                 "Could not close the device; " + \
                 "there is likely no connection to the ZI API.",level=30)
+        
+        # Close the timing trace file, if any.
+        self.phase_timer.setTraceFile(None)
+        
+        # Let any waveform transfer finish, and stop the upload thread.
+        self.upload_pool.shutdown(wait = True)
             
 
     def performSetValue(self, quant, value, sweepRate=0.0, options={}):
@@ -127,14 +165,36 @@ class Driver(LabberDriver):
         # the measurement setup is pointing at the top.
         if self.isFirstCall(options):
             pass
-            
+        
+        # In a hardware loop, only the waveforms may differ between the
+        # points of the loop. See checkHardwareLoopValue.
+        if self.isHardwareLoop(options):
+            self.checkHardwareLoopValue(quant, value, options)
+        
+        # Clear the durations recorded so far.
+        if quant.name == 'Reset timing':
+            self.phase_timer.reset()
+        
+        # Plain node writes are parsed once into a command descriptor, see
+        # parseSetCommand. They are buffered by setNode, and sent to the
+        # instrument as a single transaction at the final call.
+        try:
+            set_descriptor = self.set_descriptors[quant.name]
+        except KeyError:
+            set_descriptor = self.parseSetCommand(quant)
+        
+        if set_descriptor is not None:
+            self.setNode(set_descriptor[0], set_descriptor[1](quant, value))
+        
         # Is performSetValue attempting to execute a standard ZI API call?
         # (or a command based on the string / other datatype?)
-        if '/%s/' in quant.set_cmd:
+        # These commands may depend on the state of the instrument, and will
+        # thus flush the buffered writes first.
+        elif '/%s/' in quant.set_cmd:
         
             if 'double /' in quant.set_cmd:
             
-                self.daq.setDouble( \
+                self.setNode( \
                     quant.set_cmd.replace('double ','') % self.dev, \
                     value if not (quant.datatype > 1) \
                         else float(quant.getCmdStringFromValue(value)) \
@@ -142,7 +202,7 @@ class Driver(LabberDriver):
             
             elif 'int /' in quant.set_cmd:
             
-                self.daq.setInt( \
+                self.setNode( \
                     quant.set_cmd.replace('int ','') % self.dev, \
                     value if not (quant.datatype > 1) \
                         else int(quant.getCmdStringFromValue(value)) \
@@ -151,7 +211,7 @@ class Driver(LabberDriver):
             elif 'boolean /' in quant.set_cmd:
                     
                 if quant.datatype == 1:
-                    self.daq.setInt( \
+                    self.setNode( \
                         quant.set_cmd.replace('boolean ','') % self.dev, \
                         (1 if value else 0) \
                     )
@@ -171,14 +231,14 @@ class Driver(LabberDriver):
 
                     if (fetch_bool == 'false') or (fetch_bool == '0'):
                         # Do False-case
-                        self.daq.setInt( \
+                        self.setNode( \
                             quant.set_cmd.replace(\
                                 'boolean ','') % self.dev \
                             , 0 \
                         )
                     elif (fetch_bool == 'true') or (fetch_bool == '1'):
                         # Do True-case
-                        self.daq.setInt( \
+                        self.setNode( \
                             quant.set_cmd.replace(\
                                 'boolean ','') % self.dev \
                             , 1 \
@@ -198,783 +258,21 @@ class Driver(LabberDriver):
                             
             elif 'other /' in quant.set_cmd:
             
-                # Due to the nature of the 'other' datatype, this driver
-                # constructs a 'Python switch-case' where every entry spells
-                # out a prepared version of the quant.name string.
-            
-                def Minimise_inter_device_asynchronous_jitter(self, value):
-                    ''' TODO missing text
-                    '''
-                    
-                    # If this command is run (and value is True),
-                    # we must update the sequencer.
-                    self.sequencer_demands_updating = True
-                    
-                    # Prep. the sequencer generation stage 3:
-                    # 'SYNCHRONISE_TO_BEATING_FREQUENCY'
-                    self.update_local_awg_program[3] = True
-                        
-                    # The sequencer program generation in turn checks the
-                    # 'Minimise inter-device asynchronous jitter' flag which
-                    # at this time may be False, since value is returned
-                    # *after* isFinalCall has run. Thus, we must force-set
-                    # the flag from here.
-                    self.setValue( \
-                        'Minimise inter-device asynchronous jitter', \
-                        value \
-                    )
-                    
-                    # Modifications may be done to the internal trigger period
-                    self.perform_repetition_check = True
-                    
-                    # Setting this value to true, since it involves the
-                    # usage of oscillators, may change the channel grouping
-                    # type.
-                    if value or \
-                        self.getValue('Use oscillator-based repetition delay'):
-                        
-                        # A channel grouping of 4x2 is required.
-                        self.daq.setInt( \
-                            '/'+self.dev+'/system/awg/channelgrouping', 0)
-                            
-                    else:
-                        
-                        # A channel grouping of 1x8 is sufficient.
-                        if self.daq.getInt( \
-                            '/'+self.dev+'/system/awg/channelgrouping') != 2:
-                            
-                            # The grouping should be changed.
-                            self.daq.setInt( \
-                                '/'+self.dev+'/system/awg/channelgrouping', 2)
-                    
-                    
-                def Beat_frequency(self, value):
-                    ''' TODO missing text
-                    '''
-                    
-                    # Set oscillator 1 to the beat frequency of the sequencers.
-                    beat_frequency = abs(value)
-                    
-                    previous_osc_freq = \
-                        self.daq.getDouble('/'+str(self.dev)+'/oscs/0/freq')
-
-                    iterfreq = 2
-                    while(iterfreq <= 32):
-
-                        setval = beat_frequency / iterfreq
-                        
-                        if setval < 299000000:
-                            
-                            self.daq.setDouble( \
-                                '/'+str(self.dev)+'/oscs/0/freq', \
-                                setval)
-                            self.daq.sync()
-                            
-                            if self.daq.getDouble( \
-                                '/'+str(self.dev)+'/oscs/0/freq') == setval:
-                                
-                                # All is fine. Update value and break.
-                                self.setValue('Beat frequency', setval)
-                                break
-                
-                        iterfreq *= 2
-                    
-                    # Check whether the set was successfull
-                    if iterfreq > 32:
-
-                        # Not fine, reset and raise error.
-                        self.daq.setDouble( \
-                            '/'+str(self.dev)+'/oscs/0/freq',\
-                            previous_osc_freq )
-                        
-                        raise ArithmeticError( \
-                            "Cannot set oscillator 1 to an even dividend " + \
-                            "of "+str(beat_frequency)+" Sa/s)" )
-                
-                    # TODO This may be solvable by moving commands around in the 'other' datatype category right here.
-                    self.log('WARNING: Changing the beat frequency was fine and all but we must now also change the internal repetition rate if that was set to match the beat frequency.',level=30)
-                    
-                    
-                def Internal_trigger_period(self, value):
-                    '''TODO missing text
-                    '''
-                    # Is the user changing the internal trigger period,
-                    # while the system is set to use an oscillator as the
-                    # internal repetition delay source?
-                    
-                    # Is the system set to use oscillator 2 as the internal
-                    # repetition source trigger?
-                    if self.getValue( \
-                        'Use oscillator-based repetition delay'):
-                        
-                        # TODO The first thing which should happen, is to
-                        # check whether the new requested period is reasonable.
-                        # This check includes for instance checking whether
-                        # it is too small or large to represent by the
-                        # oscillator. If yes, modify the period.
-                        
-                        # Parry for infinite frequencies, check limits.
-                        # This part has been somewhat optimised, see if-cases.
-                        # For instance the >= 0 or not check is flag-checkable.
-                        
-                        if value >= 0:
-                        
-                            # Value is positive
-                            if value < 8.333333333333333e-10:
-                                
-                                # Value is an issue, the oscillator cannot
-                                # go any faster. Limit the requested period.
-                                value = 8.333333333333333e-10
-                        
-                        else:
-                        
-                            # Value is negative
-                            if value > -8.333333333333333e-10:
-                                
-                                # Value is an issue, the oscillator cannot
-                                # go any faster. Limit the requested period.
-                                value = -8.333333333333333e-10
-                        
-                        ''' # See triple-apostrophe comment at while loop below
-                        
-                        # Fetch the current set value for the repetition
-                        # oscillator.
-                        previous_osc_freq = self.daq.getDouble( \
-                            '/'+str(self.dev)+'/oscs/1/freq')'''
-                        
-                        # Must we synchronise to the jitter-free clause?
-                        if self.getValue( \
-                            'Minimise inter-device asynchronous jitter'):
-                            
-                            # Fetch the beat frequency (oscillator) and its
-                            # period for repeated usage later.
-                            beat_oscill = self.daq.getDouble( \
-                                '/'+str(self.dev)+'/oscs/0/freq')
-                                
-                            beat_peri = abs(1 / beat_oscill)
-                            
-                            ''' # The below while-segment has been commented,
-                            # fetching a perfectly representable value for
-                            # the next 'guess' of the while loop is pretty
-                            # complicated.
-                            attempts = 0
-                            while (attempts <= 30):'''
-                            
-                            # Are the devices *not* in sync?
-                            if beat_oscill != 0:
-
-                                # A beat frequency exists. The oscillator
-                                # must be set to a whole multiple of the
-                                # beat-frequency oscillator.
-                                
-                                # Is the requested value *not* a legal
-                                # and valid multiple of the beat period?
-                                if not (value % beat_peri == 0):
-                                
-                                    # The requested repetition frequency is
-                                    # not a multiple of the beat frequency,
-                                    # and has to be modified.
-                                    
-                                    # Is value even smaller than the beat
-                                    # period?
-                                    #                           TODO is this check still valid after adding 'sense checks?'
-                                    if value > beat_peri:
-                                
-                                        # value mod. beat_peri != 0
-                                        nearest_int = \
-                                            round(value / beat_peri)
-                                        
-                                        value = nearest_int * beat_peri
-                                    
-                                    else:
-                                    
-                                        # Value is smaller than (or equal
-                                        # to) the beat period. Set the
-                                        # value to the lowest feasible.
-                                        value = beat_peri
-                                
-                            # Get the corresponding frequency
-                            rep_frequency = abs(1 / value)
-                            
-                            # Try to set rep_frequency.
-                            # if success - report and break
-                            # else: attempt += 1, value = TODO
-                            
-                            self.daq.setDouble( \
-                                '/'+str(self.dev)+'/oscs/1/freq', \
-                                rep_frequency)
-                            
-                            self.daq.sync()
-                        
-                            value = 1 / self.daq.getDouble( \
-                                '/'+str(self.dev)+'/oscs/1/freq')
-                        
-                            '''# See triple-apostrophe comment at the while-
-                            # loop above.
-                            
-                            received_rpf = self.daq.getDouble( \
-                                '/'+str(self.dev)+'/oscs/1/freq')
-                            
-                            if received_rpf == rep_frequency:
-                            
-                                # All is fine, the value was set and legal.
-                                break
-                                
-                            else:
-                            
-                                # Failure. Increment attempts.
-                                attempts += 1
-                                
-                                # Update value.
-                                # TODO Getting this next guess is pretty
-                                # much a PhD in itself to get right.
-                                # Hence the commented code.
-                                value = value * attempts / 30'''
-                            
-                        else:
-                        
-                            # The user has not requested to synchronise the
-                            # delay to the beat frequency oscillator.
-                        
-                            # No jitter-free clause needed.
-                            rep_frequency = abs(1 / value)
-                            
-                            self.daq.setDouble( \
-                                '/'+str(self.dev)+'/oscs/1/freq', \
-                                rep_frequency)
-                            
-                            self.daq.sync()
-                        
-                            value = 1 / self.daq.getDouble( \
-                                '/'+str(self.dev)+'/oscs/1/freq')
-                            
-                                    
-                        ''' # See triple-apostrophe comment above.
-                        # Check whether the set was successfull
-                        if attempts > 30:
-
-                            # Not fine, reset and raise error.
-                            self.daq.setDouble( \
-                                '/'+str(self.dev)+'/oscs/1/freq',\
-                                    previous_osc_freq)
-                                    
-                            raise ArithmeticError( \
-                                "Could not modify the requested repetition "+ \
-                                "rate to an exact oscillator value given "  + \
-                                "the currently set beat frequency." )'''
-                    
-                    else:
-                    
-                        # The user has requested not to use an oscillator
-                        # for the internal trigger period. This implies
-                        # a change of the sequencer program.
-                        self.sequencer_demands_updating = True
-                    
-                    # The internal repetition rate value has to be
-                    # set already at this stage, as the value
-                    # returns after the isFinalCall check which
-                    # might depend on this value.
-                    self.setValue('Internal trigger period', value)
-                    
-                    # Sanity check for validness of internal repetition rate
-                    self.perform_repetition_check = True
-                
-                
-                def Use_oscillator_based_repetition_delay(self, value):
-                    '''TODO
-                    '''
-                    # If this command is run (and value is True),
-                    # we must update the sequencer.
-                    self.sequencer_demands_updating = True
-                    
-                    # Prep. the sequencer generation stage 2:
-                    # WAIT_FOR_INITIAL_TRIGGER, DELAY_BEFORE_LOOP_END,
-                    # WAIT_FOR_TRIGGER_TO_REPEAT
-                    self.update_local_awg_program[2] = True
-                    
-                    # The sequencer program generation in turn checks the
-                    # 'Use oscillator-based repetition delay' flag which
-                    # at this time may be False, since value is returned
-                    # *after* isFinalCall has run. Thus, we must force-set
-                    # the flag from here.
-                    self.setValue( \
-                        'Use oscillator-based repetition delay', \
-                        value \
-                    )
-                    
-                    # Setting this value to true, since it involves the
-                    # usage of oscillators, may change the channel grouping
-                    # type.
-                    if value or self.getValue( \
-                        'Minimise inter-device asynchronous jitter'):
-                        
-                        # A channel grouping of 4x2 is required.
-                        self.daq.setInt( \
-                            '/'+self.dev+'/system/awg/channelgrouping', 0)
-                            
-                    else:
-                        
-                        # A channel grouping of 1x8 is sufficient.
-                        if self.daq.getInt( \
-                            '/'+self.dev+'/system/awg/channelgrouping') != 2:
-                            
-                            # The grouping should be changed.
-                            self.daq.setInt( \
-                                '/'+self.dev+'/system/awg/channelgrouping', 2)
-                
-                
-                def Reference_clock(self, value):
-                    '''TODO write text
-                    '''
-                    # Is the user changing the reference clock?
-                    
-                    # As the clock will revert to the 'Internal' mode in case
-                    # of failure, more complex behaviour is required than a
-                    # simple ZI API call.
-                    
-                    # To save on the waiting time: if the system is running
-                    # in external mode, and we're trying to set it to external
-                    # at bootup, simply ignore the set.
-                    
-                    req_value = int(quant.getCmdStringFromValue(value))
-                    rfclk = str( \
-                        '/'+self.dev+'/system/clocks/referenceclock/source' )
-                    
-                    if not (self.daq.getInt( rfclk ) == req_value):
-                    
-                        # Set the new value
-                        self.daq.setInt( rfclk, req_value )
-                        
-                        # Wait for the 'Reference clock' value to eventually
-                        # rebounce. Half of a second is a typical good value.
-                        time.sleep(0.5)
-                        
-                        # Fetch the new value and compare differences.
-                        value = self.daq.getInt( rfclk )
-                        
-                        # Did we fail to change the value?
-                        # TODO This if-case together with the if
-                        # requested_value below can likely be algorithmically
-                        # optimised.
-                        if value != req_value:
-
-                            if req_value == 1:
-                                
-                                # Has the user requested to halt the system in
-                                # case this happens?
-                                if self.getValue( \
-                                    'Halt on external clock failure'):
-                                    
-                                    raise RuntimeError( \
-                                        "Halted: Could not lock the "     + \
-                                        "reference clock to an external " + \
-                                        "signal.")
-                                    
-                                else:
-                                
-                                    # Send a lock failure warning.
-                                    self.log( \
-                                        "Warning: Could not lock the "    + \
-                                        "reference clock to an external " + \
-                                        "signal.")
-                            
-                            else:
-                            
-                                # Send an unlock failure warning.
-                                self.log( \
-                                    "Warning: Could not unlock the "      + \
-                                    "reference clock from the external "  + \
-                                    "signal.")
+                # Send any buffered node writes.
+                self.flushNodeWrites()
                 
-                
-                def Output_sample_rate(self, value):
-                    '''TODO
-                    '''
-                    # Is the user changing a ZIAPI double which may invalidate
-                    # the current internal repetition delay value?
-                    
-                    # Modify the sample rate clock
-                    self.daq.setDouble( \
-                        quant.set_cmd.replace('other ','') % self.dev, \
-                        value \
-                    )
-                    
-                    # This operation is delicate, thus we monitor a status
-                    # string for its current status.
-                    upload_timeout_ms = 2950
-                    clock_status = 2 # 2 = 'Busy' acc. to ZI HDAWG doc.
-                    
-                    # Give it a tiny wait
-                    time.sleep(0.050) # TODO This value should be minimised
-                    
-                    # elf/status provides information whether the upload is
-                    # succeeding.
-                    while (clock_status != 0) and (upload_timeout_ms >= 0):
-
-                        # Fetch progress
-                        clock_status = \
-                            self.daq.getInt( \
-                                '/%s/system/clocks/sampleclock/status' \
-                                % self.dev)
-                        
-                        # Shortcut ending
-                        if clock_status == 0:
-                            break
-                        
-                        # Waiting sequence
-                        time.sleep(0.050)
-                        upload_timeout_ms -= 50
-                    
-                    # Check for sample clock change timeout
-                    if upload_timeout_ms <= 0:
-                        raise RuntimeError( \
-                            "Failed to set \'Output sample rate\' due " + \
-                            "to command timeout.")
-                    
-                    # Sample clock change reported failure
-                    elif clock_status == 1:
-                        raise RuntimeError( \
-                            "Failed to set \'Output sample rate\' due " + \
-                            "to some unknown device error.")
-                    
-                    # This command may change the validness of the internal
-                    # repetition delay.
-                    self.perform_repetition_check = True
-                    
-                
-                def Output_sample_rate_divisor(self, value):
-                    '''TODO
-                    '''
-                    
-                    # Is the user changing the sampling rate combo?
-                    
-                    self.daq.setInt( \
-                        quant.set_cmd.replace('other ','') % self.dev, \
-                        int(quant.getCmdStringFromValue(value)) \
-                    )
-                
-                    # This command may change the validness of the internal
-                    # repetition delay.
-                    self.perform_repetition_check = True
-                    
-                
-                def Sequencer_triggers(self, value):
-                    '''TODO
-                    '''
-                    
-                    # This command may change the validness of the internal
-                    # repetition delay.
-                    self.perform_repetition_check = True
-                    
-                    # Prep. the sequencer generation stage 4:
-                    # START_TRIGGER_PULSE, END_TRIGGER_PULSE
-                    self.update_local_awg_program[4] = True
-                    
-                    # Prep. the sequencer generation stage 5:
-                    # DELAY_BEFORE_END_TRIGGER
-                    self.update_local_awg_program[5] = True
-
-
-                def Delay_before_end_trigger_changes(self, value):
-                    '''TODO
-                    '''
-                    
-                    # Is the user changing a value which should trigger the
-                    # internal repetition check?
-                    
-                    # This command may change the validness of the internal
-                    # repetition delay.
-                    self.perform_repetition_check = True
-                    
-                    # Prep. the sequencer generation stage 5:
-                    # DELAY_BEFORE_END_TRIGGER
-                    self.update_local_awg_program[5] = True
-                    
-                    
-                def Run_mode(self, value):
-                    '''TODO
-                    '''
-                    
-                    # Is the user changing the Run mode?
-                    
-                    # This command will require a change in the
-                    # sequencer program.
-                    self.sequencer_demands_updating = True
-                    
-                    # If changing back to 'Internal trigger' -> we may need
-                    # to double-check that the internal repetition rate is
-                    # valid. All previous calls during other Run modes
-                    # have been ignored.
-                    self.perform_repetition_check = True
-                    
-                    # We now make a note to the generateSequencerProgram
-                    # that the run mode has changed.
-                    
-                    # Prep. the sequencer generation stage 2:
-                    # WAIT_FOR_INITIAL_TRIGGER, DELAY_BEFORE_LOOP_END,
-                    # WAIT_FOR_TRIGGER_TO_REPEAT
-                    self.update_local_awg_program[2] = True
-                    
-                    # The Labber-stored value for 'Run mode' must be updated
-                    # at this location as the generateSequencerProgram function
-                    # will run before the setValue default after isFinalCall.
-                    self.setValue('Run mode', value)
-                
-                
-                def Range(self, value):
-                    '''TODO
-                    '''
-                    
-                    # Get the channel in question
-                    channel = int( \
-                        ( \
-                            quant.name.replace(' - Range','') \
-                        ).replace('Channel ',''))
-                    
-                    # Alter the output range, make sure to update the
-                    # self-object list of ranges. This list is used when
-                    # resetting the output range after disabling the direct
-                    # output.
-                    
-                    val = float(quant.getCmdStringFromValue(value))
-                    
-                    # Execute command
-                    self.daq.setDouble( \
-                        '/%s/sigouts/%s/range' % (self.dev, channel-1), val \
-                    )
-                    
-                    # Update list
-                    self.previous_ranges[channel-1] = val
-                
-                
-                def Bypass_DAC_to_port(self, value):
-                    ''' TODO
-                    
-                        For your information, the DAC bypass to port function
-                        is known as 'Direct output' in ZI LabOne.
-                    '''
-                    # Get the channel in question
-                    channel = int( \
-                        ( \
-                            quant.name.replace(' - Bypass DAC to port','') \
-                        ).replace('Channel ',''))
-                    
-                    # Disable and restore if false, merely enable if true
-                    if not value:
-                        
-                        # Execute disablement
-                        self.daq.setInt( \
-                            '/%s/sigouts/%s/direct' % (self.dev,channel-1), 0 \
-                        )
-                        
-                        # Note to reader: this clause usually changes the
-                        # measurement range in such a way that a relay
-                        # will toggle the instrument into said range.
-                        # Meaning that a weird double-klicking is expected.
-                        self.daq.setDouble( \
-                            '/%s/sigouts/%s/range' % (self.dev,channel-1), \
-                            float(self.previous_ranges[channel-1]) \
-                        )
-                    
-                    else:
-                    
-                        # Merely execute the enablement
-                        self.daq.setInt( \
-                            '/%s/sigouts/%s/direct' % (self.dev,channel-1), 1 \
-                        )
-                        
-                
-                def Output_Marker_config(self, value):
-                    '''TODO
-                    '''
-                    
-                    # The config can change three major topics:
-                    # 1. Start time for marker 1/2
-                    # 2. Duration of marker 1/2
-                    # 3. Whether there are any markers left to be played.
-                    
-                    # Which channel was it and what channel are we talking?
-                    split   = (quant.name).split(' Marker ', 1)
-                    channel = int(split[0].replace('Output '    ,'')) -1
-                    marker  = int((split[1].replace(' start time','')).replace(' duration','')) -1
-                    
-                    # Get the current sample rate (per divisor)
-                    sample_rate =                                            \
-                        self.getValue('Output sample rate') /                \
-                        2**self.getValueIndex('Output sample rate divisor')
-                    
-                    # Change marker start or duration?
-                    if('st' in quant.name):
-                        
-                        # Start it is. Convert value to samples.
-                        start = int(round(value * sample_rate))
-                        
-                        # Fetch the current duration.
-                        duration = int(self.marker_configuration[channel,marker,1])
-                        
-                        # Update the marker configuration.
-                        self.configureMarker(channel,marker,start,duration)
-                        
-                    else:
-                    
-                        # So it's duration then.
-                        duration = int(round(value * sample_rate))
-                        
-                        # Fetch the current start.
-                        start = int(self.marker_configuration[channel,marker,0])
-                        
-                        # Update the marker configuration.
-                        self.configureMarker(channel,marker,start,duration)
-                    
-
-                # Setup and fetch a 'switch/case' clause
-                quant_name_swicas = \
-                    ((quant.name).replace(' ','_')).replace('-','_')
-                
-                switch_case = {
-                    'Trigger_out_delay':\
-                        Delay_before_end_trigger_changes,
-                    'Dynamic_repetition_rate':\
-                        Delay_before_end_trigger_changes,
-                    'Calibrate_trigger_out_delay':\
-                        Delay_before_end_trigger_changes,
-                    'Halt_on_illegal_repetition_rate':\
-                        Delay_before_end_trigger_changes,
-                    'Calibrate_internal_trigger_period':\
-                        Delay_before_end_trigger_changes,
-                        
-                    'Channel_1___Bypass_DAC_to_port':\
-                        Bypass_DAC_to_port,
-                    'Channel_2___Bypass_DAC_to_port':\
-                        Bypass_DAC_to_port,
-                    'Channel_3___Bypass_DAC_to_port':\
-                        Bypass_DAC_to_port,
-                    'Channel_4___Bypass_DAC_to_port':\
-                        Bypass_DAC_to_port,
-                    'Channel_5___Bypass_DAC_to_port':\
-                        Bypass_DAC_to_port,
-                    'Channel_6___Bypass_DAC_to_port':\
-                        Bypass_DAC_to_port,
-                    'Channel_7___Bypass_DAC_to_port':\
-                        Bypass_DAC_to_port,
-                    'Channel_8___Bypass_DAC_to_port':\
-                        Bypass_DAC_to_port,
-                    
-                    'Channel_1___Range':\
-                        Range,
-                    'Channel_2___Range':\
-                        Range,
-                    'Channel_3___Range':\
-                        Range,
-                    'Channel_4___Range':\
-                        Range,
-                    'Channel_5___Range':\
-                        Range,
-                    'Channel_6___Range':\
-                        Range,
-                    'Channel_7___Range':\
-                        Range,
-                    'Channel_8___Range':\
-                        Range,
-                    
-                    'Output_1_Marker_1_start_time':\
-                        Output_Marker_config,
-                    'Output_1_Marker_2_start_time':\
-                        Output_Marker_config,
-                    'Output_2_Marker_1_start_time':\
-                        Output_Marker_config,
-                    'Output_2_Marker_2_start_time':\
-                        Output_Marker_config,
-                    'Output_3_Marker_1_start_time':\
-                        Output_Marker_config,
-                    'Output_3_Marker_2_start_time':\
-                        Output_Marker_config,
-                    'Output_4_Marker_1_start_time':\
-                        Output_Marker_config,
-                    'Output_4_Marker_2_start_time':\
-                        Output_Marker_config,
-                    'Output_5_Marker_1_start_time':\
-                        Output_Marker_config,
-                    'Output_5_Marker_2_start_time':\
-                        Output_Marker_config,
-                    'Output_6_Marker_1_start_time':\
-                        Output_Marker_config,
-                    'Output_6_Marker_2_start_time':\
-                        Output_Marker_config,
-                    'Output_7_Marker_1_start_time':\
-                        Output_Marker_config,
-                    'Output_7_Marker_2_start_time':\
-                        Output_Marker_config,
-                    'Output_8_Marker_1_start_time':\
-                        Output_Marker_config,
-                    'Output_8_Marker_2_start_time':\
-                        Output_Marker_config,
-                        
-                    'Output_1_Marker_1_duration':\
-                        Output_Marker_config,
-                    'Output_1_Marker_2_duration':\
-                        Output_Marker_config,
-                    'Output_2_Marker_1_duration':\
-                        Output_Marker_config,
-                    'Output_2_Marker_2_duration':\
-                        Output_Marker_config,
-                    'Output_3_Marker_1_duration':\
-                        Output_Marker_config,
-                    'Output_3_Marker_2_duration':\
-                        Output_Marker_config,
-                    'Output_4_Marker_1_duration':\
-                        Output_Marker_config,
-                    'Output_4_Marker_2_duration':\
-                        Output_Marker_config,
-                    'Output_5_Marker_1_duration':\
-                        Output_Marker_config,
-                    'Output_5_Marker_2_duration':\
-                        Output_Marker_config,
-                    'Output_6_Marker_1_duration':\
-                        Output_Marker_config,
-                    'Output_6_Marker_2_duration':\
-                        Output_Marker_config,
-                    'Output_7_Marker_1_duration':\
-                        Output_Marker_config,
-                    'Output_7_Marker_2_duration':\
-                        Output_Marker_config,
-                    'Output_8_Marker_1_duration':\
-                        Output_Marker_config,
-                    'Output_8_Marker_2_duration':\
-                        Output_Marker_config,
-                
-                    'Run_mode':\
-                        Run_mode,
-                    'Beat_frequency':\
-                        Beat_frequency,
-                    'Reference_clock':\
-                        Reference_clock,
-                    'Output_sample_rate':\
-                        Output_sample_rate,
-                    'Sequencer_triggers':\
-                        Sequencer_triggers,
-                    'Internal_trigger_period':\
-                        Internal_trigger_period,
-                    'Output_sample_rate_divisor':\
-                        Output_sample_rate_divisor,
-                    'Use_oscillator_based_repetition_delay':\
-                        Use_oscillator_based_repetition_delay,
-                    'Minimise_inter_device_asynchronous_jitter':\
-                        Minimise_inter_device_asynchronous_jitter
-                }
-                
-                # Execute
-                switch_case.get(quant_name_swicas)(self, value)
-                
-                # TODO  Is it even necessary to pass on the value parameter?
-                #       Because, quant seems to work just fine.
-                
-                # TODO  This switch-case setup can likely be moved elsewhere.
-                #       For instance to defaultWaveformConfiguration or similar.
+                # The 'other' datatype commands are dispatched by their
+                # quantity name, see buildOtherCommandDispatch.
+                self.other_set_commands[quant.name](quant, value)
           
             
             elif 'string /' in quant.set_cmd:
             
+                # Send any buffered node writes. The command line may alter
+                # any node, which invalidates the node shadow.
+                self.flushNodeWrites()
+                self.node_shadow.clear()
+                
                 # The quant name if-case is commented as there is currently
                 # only one command in the instruction file which uses the
                 # string datatype.
@@ -1127,6 +425,9 @@ class Driver(LabberDriver):
         # Is the setValue attempting to set an awgModule value?
         elif 'awgModule' in quant.set_cmd:
             
+            # Send any buffered node writes.
+            self.flushNodeWrites()
+            
             self.awgModule.set( \
                 quant.set_cmd, \
                     value if not (quant.datatype > 1) \
@@ -1140,6 +441,31 @@ class Driver(LabberDriver):
         # the measurement setup is pointing at the bottom.
 
         if self.isFinalCall(options):
+            
+            # Send the node writes buffered during this sweep point.
+            self.flushNodeWrites()
+            
+            # Number the sweep point in the timing trace, if requested.
+            self.phase_timer.setTraceFile( \
+                self.getValue('Timing trace file') \
+                    if self.getValue('Write timing trace') else None)
+            self.phase_timer.beginPoint()
+            
+            # In a hardware loop, Labber sets the values of every point of
+            # the loop in advance. The waveforms of every point are stored,
+            # and played by a single program once the last point is set.
+            if self.isHardwareLoop(options):
+                self.storeHardwareLoopPoint(options)
+                return value
+            
+            # Leaving a hardware loop, the regular sequencer program must be
+            # restored, along with every waveform.
+            if self.hardware_loop_length > 0:
+                self.hardware_loop_length = 0
+                self.hardware_loop_key = None
+                self.loaded_waveform_digests = [None] * self.n_ch
+                self.sequencer_demands_updating = True
+                self.update_local_awg_program[0] = True
         
             # Prepare for adjusting the buffer length.
             ''' Two variables keep track of said length:
@@ -1163,12 +489,21 @@ class Driver(LabberDriver):
             # use total, playing on output 1.
             self.highest_waveform_in_use = 0
             
+            # Waveform primitives are fetched at most once per final call,
+            # see fetchWaveformPrimitive.
+            self.fetched_primitives = {}
+            
+            # Reset the waveform upload counters of this sweep point.
+            self.uploaded_waveform_bytes = 0
+            self.changed_waveform_samples = 0
+            
             # Figure out whether we require waveform uploading
             for wave in range(0, self.n_ch):
             
                 # Fetch the current waveform. It may either have been
                 # declared directly, or by using waveform primitives.
-                current_waveform = self.fetchAndAssembleWaveform(wave)
+                with self.phase_timer.span('Waveform assembly'):
+                    current_waveform = self.fetchAndAssembleWaveform(wave)
                 
                 # Counteract Labber randomly returning [None].
                 if np.array_equal(current_waveform,[None]):
@@ -1204,12 +539,21 @@ class Driver(LabberDriver):
                 elif not len(current_waveform) == 0:
                     self.highest_waveform_in_use = wave +1
                 
-                # Acquire the previous waveform for future comparisons
-                previous_waveform = self.loaded_waveforms[wave]
+                # Acquire the digest of the current waveform for comparison
+                # against the previously loaded one. Comparing digests rather
+                # than the waveforms themselves means that no full copy of the
+                # previous waveform is required for detecting changes.
+                with self.phase_timer.span('Waveform diffing'):
+                    current_digest = \
+                        self.fetchWaveformDigest(wave, current_waveform)
                 
                 # Has something happened?
-                # TODO This comparison should be hashed in the future.
-                if not np.array_equal(current_waveform, previous_waveform):
+                if current_digest != self.loaded_waveform_digests[wave]:
+                    
+                    # Update the digest and length records.
+                    previous_length = self.loaded_waveform_lengths[wave]
+                    self.loaded_waveform_digests[wave] = current_digest
+                    self.loaded_waveform_lengths[wave] = len(current_waveform)
                     
                     # Is the loaded waveform None?
                     if len(current_waveform) == 0:
@@ -1234,7 +578,7 @@ class Driver(LabberDriver):
                         self.waveform_changed[wave] = True
                         
                         # Is this an entirely new waveform?
-                        if len(previous_waveform) == 0:
+                        if previous_length == 0:
                             
                             # A new waveform was added, update the sequencer.
                             self.sequencer_demands_updating = True
@@ -1270,34 +614,62 @@ class Driver(LabberDriver):
 
             # The next task on the agenda is to carry out a potential
             # sequencer update and / or upload new waveforms.
+            recompile_digest = None
             if self.sequencer_demands_updating:
-            
-                # Halt the sequencer. # TODO look at the compile-code.
-                self.awgModule.set('awgModule/awg/enable', 0)
-            
-                # Recompile the sequencer, this requires re-uploading all
-                # waveforms anew. This is mainly due to the most common
-                # triggering condition for sequencer re-compilation, being
-                # buffer length discrepancy versus the old sequencer code.
-                
-                self.updateSequencer()
                 self.sequencer_demands_updating = False
-
-                # The writeWaveform function will inject and reset the
-                # changed-status of the waveform(s) to False.
-                self.writeWaveformToMemory()
-                    
-                # Enable playback again. # TODO look at the compile-code.
-                self.awgModule.set('awgModule/awg/enable', 1)
                 
-            elif np.any(self.waveform_changed):
+                # Generate the new sequencer program. Its TIMESTAMP aside,
+                # the program may very well be identical to the one running
+                # on the instrument, for instance when a setting is toggled
+                # back and forth. Then, there is no need to halt, recompile
+                # and restart the sequencer.
+                with self.phase_timer.span('Sequencer generation'):
+                    self.generateSequencerProgram()
+                    program_digest = self.fetchSequencerProgramDigest()
                 
-                # The sequencer can remain the same. However, there were
-                # changes done to the loaded waveforms.
+                if program_digest == self.loaded_program_digest:
+                    self.skipped_sequencer_recompilations += 1
+                    self.setValue('Skipped sequencer recompilations', \
+                        self.skipped_sequencer_recompilations)
                 
-                # The writeWaveform function will reset the changed-status
-                # of the waveform(s) to False.
-                self.writeWaveformToMemory()
+                else:
+                    # Recompile the sequencer, this requires re-uploading all
+                    # waveforms anew. This is mainly due to the most common
+                    # triggering condition for sequencer re-compilation, being
+                    # buffer length discrepancy versus the old sequencer code.
+                    recompile_digest = program_digest
+            
+            # In waveform library mode, a set of waveforms held by a slot of
+            # the library is played by selecting that slot. Then, nothing is
+            # uploaded at all.
+            slot_selected = False
+            if self.library_active and (recompile_digest is None) and \
+                np.any(self.waveform_changed):
+                slot_selected = self.selectLibrarySlot()
+            
+            # Upload the new sequencer program, if any, and the changed
+            # waveforms as a single transaction. The sequencer is halted and
+            # restarted once, regardless of the amount of cores updated.
+            if (not slot_selected) and ((recompile_digest is not None) or \
+                np.any(self.waveform_changed)):
+                self.runUploadTransaction(recompile_digest)
+            
+            # Release the retained waveform copies if the user has requested
+            # the driver not to keep them. Change detection only relies on
+            # the waveform digests, which are kept.
+            if not self.getValue('Retain loaded waveforms'):
+                for wave in range(0, self.n_ch):
+                    if self.loaded_waveform_lengths[wave] > 0:
+                        self.loaded_waveforms[wave] = None
+                    
+                    # The assembly cache would otherwise retain a copy.
+                    self.assembly_cache[wave] = None
+            
+            # Report the amount of waveform data actually transferred.
+            self.setValue('Waveform bytes uploaded', \
+                self.uploaded_waveform_bytes)
+            self.setValue('Waveform samples changed', \
+                self.changed_waveform_samples)
 
         return value
     
@@ -1307,19 +679,33 @@ class Driver(LabberDriver):
         TODO not written.
         '''
         
+        # Plain node reads are parsed once into a command descriptor, see
+        # parseGetCommand.
+        try:
+            get_descriptor = self.get_descriptors[quant.name]
+        except KeyError:
+            get_descriptor = self.parseGetCommand(quant)
+        
+        if get_descriptor is not None:
+            return get_descriptor[2](quant, \
+                get_descriptor[1](get_descriptor[0]))
+        
+        # Reads must reflect any buffered node writes.
+        self.flushNodeWrites()
+        
         # Is performGetValue attempting to execute a standard ZI API call?
         if '/%s/' in quant.get_cmd:
 
             if 'double /' in quant.get_cmd:
 
                 if quant.datatype == 0:
-                    return self.daq.getDouble(\
+                    return self.getNodeDouble(\
                         quant.get_cmd.replace('double ','') % self.dev \
                     )
                     
                 elif quant.datatype == 2:
                     return quant.getValueFromCmdString( \
-                        self.daq.getDouble( \
+                        self.getNodeDouble( \
                             quant.get_cmd.replace('double ','') % self.dev\
                         ) \
                     )
@@ -1332,7 +718,7 @@ class Driver(LabberDriver):
             elif 'int /' in quant.get_cmd:
                 if quant.datatype == 2:
                     return quant.getValueFromCmdString( \
-                        self.daq.getInt( \
+                        self.getNodeInt( \
                             quant.get_cmd.replace('int ','') % self.dev \
                         ) \
                     )
@@ -1340,7 +726,7 @@ class Driver(LabberDriver):
                 # Thus a get_cmd of datatype int would correspond exclusively
                 # to a combinational list.                
                 # elif quant.datatype < 2:
-                #     return self.daq.getInt(\
+                #     return self.getNodeInt(\
                 #         quant.get_cmd.replace('int ','') % self.dev \
                 #    )
                 else:
@@ -1350,7 +736,7 @@ class Driver(LabberDriver):
             
             elif 'boolean /' in quant.get_cmd:
                 if quant.datatype == 1: \
-                    return self.daq.getInt( \
+                    return self.getNodeInt( \
                         quant.get_cmd.replace('boolean ','') % self.dev \
                     ) > 0
                 
@@ -1366,7 +752,7 @@ class Driver(LabberDriver):
                 
                     # Fetch True or False, and try to return it.
                     # Due to string ambiguity, several try-exceptions are made.
-                    fetched_bool = self.daq.getInt( \
+                    fetched_bool = self.getNodeInt( \
                         quant.get_cmd.replace('boolean ','') % self.dev \
                     ) > 0
                 
@@ -1421,7 +807,7 @@ class Driver(LabberDriver):
                     # Round the return.
                     return quant.getValueFromCmdString( \
                         round(
-                            self.daq.getDouble( \
+                            self.getNodeDouble( \
                                 quant.get_cmd.replace('other ','') % self.dev \
                             ) \
                         , 1) \
@@ -1490,7 +876,7 @@ class Driver(LabberDriver):
                 if not 'awgModule/awg/enable' in quant.get_cmd:
                     return self.awgModule.get(quant.get_cmd)
                 else:
-                    self.daq.sync()
+                    self.syncNodes()
                     return ((( \
                         self.awgModule.get('awgModule/awg/enable') \
                             ).get('awg')).get('enable')[0] > 0)
@@ -1499,12 +885,823 @@ class Driver(LabberDriver):
                     self.awgModule.get(quant.get_cmd) \
                 )
 
-        return quant.getValue()
-
+        # Durations recorded by the phase timer.
+        elif quant.name.startswith('Timing '):
+            return self.fetchPhaseTiming(quant)
 
-    ################################
-    """ Marker configuration """
-    ################################
+        return quant.getValue()
+    
+    
+    def performArm(self, quant_names, options={}):
+        '''Perform the instrument arm operation. A sequencer playing a
+        hardware loop is restarted, such that the next trigger plays the
+        first point of the loop. See runHardwareLoop.
+        '''
+        
+        if self.hardware_loop_length > 0:
+            self.daq.setInt('/'+str(self.dev)+'/awgs/0/enable', 0)
+            self.daq.sync()
+            self.daq.setInt('/'+str(self.dev)+'/awgs/0/enable', 1)
+    
+    
+    def fetchPhaseTiming(self, quant):
+        '''Return the timing quantity quant, describing the recorded
+        durations of the phase selected by 'Timing phase'.
+        '''
+        
+        phase = self.getValue('Timing phase')
+        
+        if quant.name == 'Timing histogram':
+            return quant.getTraceDict( \
+                self.phase_timer.histograms[phase], \
+                t0 = PhaseTimer.histogram_start, \
+                dt = PhaseTimer.histogram_step)
+        
+        elif quant.name == 'Timing last duration':
+            return self.phase_timer.last_durations[phase]
+        
+        elif quant.name == 'Timing mean duration':
+            return self.phase_timer.total_durations[phase] / \
+                max(self.phase_timer.counts[phase], 1)
+        
+        elif quant.name == 'Timing count':
+            return self.phase_timer.counts[phase]
+        
+        return quant.getValue()
+
+
+    #########################################
+    """ Parsing of set and get commands """
+    #########################################
+    
+    def parseSetCommand(self, quant):
+        '''Parse the set command of quant into a command descriptor, and
+        keep it for subsequent calls. A descriptor consists of the fully
+        resolved node path, and a function converting the set value into
+        the value written to the node.
+        
+        Commands that are not plain node writes, such as those of the
+        'other' datatype, have no descriptor. None is returned for these.
+        '''
+        
+        descriptor = None
+        
+        if '/%s/' in quant.set_cmd:
+            
+            node_type, node_path = quant.set_cmd.split(' ', 1)
+            node_path = node_path % self.dev
+            
+            if node_type == 'double':
+                if quant.datatype > 1:
+                    descriptor = (node_path, lambda quant, value: \
+                        float(quant.getCmdStringFromValue(value)))
+                else:
+                    descriptor = (node_path, lambda quant, value: value)
+            
+            elif node_type == 'int':
+                if quant.datatype > 1:
+                    descriptor = (node_path, lambda quant, value: \
+                        int(quant.getCmdStringFromValue(value)))
+                else:
+                    descriptor = (node_path, lambda quant, value: value)
+            
+            # Booleans set using combinational lists are ambiguous, and
+            # are left to performSetValue.
+            elif (node_type == 'boolean') and (quant.datatype == 1):
+                descriptor = (node_path, lambda quant, value: \
+                    (1 if value else 0))
+        
+        self.set_descriptors[quant.name] = descriptor
+        return descriptor
+    
+    
+    def parseGetCommand(self, quant):
+        '''Parse the get command of quant into a command descriptor, and
+        keep it for subsequent calls. A descriptor consists of the fully
+        resolved node path, the function reading the node, and a function
+        converting the node value into the value returned to Labber.
+        
+        None is returned for commands that are not plain node reads.
+        '''
+        
+        descriptor = None
+        
+        if '/%s/' in quant.get_cmd:
+            
+            node_type, node_path = quant.get_cmd.split(' ', 1)
+            node_path = node_path % self.dev
+            
+            if (node_type == 'double') and (quant.datatype == 0):
+                descriptor = (node_path, self.getNodeDouble, \
+                    lambda quant, value: value)
+            
+            elif (node_type == 'double') and (quant.datatype == 2):
+                descriptor = (node_path, self.getNodeDouble, \
+                    lambda quant, value: quant.getValueFromCmdString(value))
+            
+            elif (node_type == 'int') and (quant.datatype == 2):
+                descriptor = (node_path, self.getNodeInt, \
+                    lambda quant, value: quant.getValueFromCmdString(value))
+            
+            elif (node_type == 'boolean') and (quant.datatype == 1):
+                descriptor = (node_path, self.getNodeInt, \
+                    lambda quant, value: value > 0)
+            
+            # Unfortunately, '/range' does not return a number which
+            # may be passed through straight. Round the return.
+            elif (node_type == 'other') and (' - Range' in quant.name):
+                descriptor = (node_path, self.getNodeDouble, \
+                    lambda quant, value: \
+                        quant.getValueFromCmdString(round(value, 1)))
+        
+        self.get_descriptors[quant.name] = descriptor
+        return descriptor
+    
+    
+    ##########################################
+    """ Set commands of the 'other' datatype """
+    ##########################################
+    
+    def buildOtherCommandDispatch(self):
+        '''Build the table of set functions for the quantities using the
+        'other' datatype, keyed by quantity name. Channel and marker indices
+        are parsed from the quantity names once, here, and bound to the
+        set functions.
+        '''
+        
+        self.other_set_commands = {
+            'Trigger out delay':                 self.setDelayBeforeEndTrigger,
+            'Dynamic repetition rate':           self.setDelayBeforeEndTrigger,
+            'Calibrate trigger out delay':       self.setDelayBeforeEndTrigger,
+            'Halt on illegal repetition rate':   self.setDelayBeforeEndTrigger,
+            'Calibrate internal trigger period': self.setDelayBeforeEndTrigger,
+            
+            'Run mode':                          self.setRunMode,
+            'Beat frequency':                    self.setBeatFrequency,
+            'Reference clock':                   self.setReferenceClock,
+            'Output sample rate':                self.setOutputSampleRate,
+            'Sequencer triggers':                self.setSequencerTriggers,
+            'Internal trigger period':           self.setInternalTriggerPeriod,
+            'Output sample rate divisor':        self.setOutputSampleRateDivisor,
+            'Use oscillator-based repetition delay': \
+                self.setOscillatorBasedRepetitionDelay,
+            'Minimise inter-device asynchronous jitter': \
+                self.setMinimiseInterDeviceJitter,
+            'Waveform library':                  self.setWaveformLibrary,
+            'Waveform library slots':            self.setWaveformLibrary,
+            'Waveform library register':         self.setWaveformLibrary,
+        }
+        
+        # The instruction file declares eight channels.
+        for channel in range(1, 9):
+            
+            self.other_set_commands['Channel '+str(channel)+' - Range'] = \
+                functools.partial(self.setOutputRange, channel)
+            self.other_set_commands[ \
+                'Channel '+str(channel)+' - Bypass DAC to port'] = \
+                functools.partial(self.setBypassDacToPort, channel)
+            
+            for marker in range(1, 3):
+                for setting in [' start time', ' duration']:
+                    marker_quantity = \
+                        'Output '+str(channel)+' Marker '+str(marker)+setting
+                    self.other_set_commands[marker_quantity] = \
+                        functools.partial(self.setMarkerConfiguration, \
+                            channel-1, marker-1)
+    
+    
+    def setWaveformLibrary(self, quant, value):
+        '''Changing the waveform library settings requires a new sequencer
+        program, see fetchLibrarySlot.
+        '''
+        
+        # The sequencer program generation checks the library settings,
+        # which are stored *after* isFinalCall has run. Thus, force-set the
+        # setting from here.
+        self.setValue(quant.name, value)
+        
+        self.sequencer_demands_updating = True
+        
+        # Prep. the sequencer generation stage 0:
+        # MARKER_DECLARATION, WAVEFORM_DECLARATION, PLAYWAVE, WAITWAVE
+        self.update_local_awg_program[0] = True
+    
+    
+    def setMinimiseInterDeviceJitter(self, quant, value):
+        ''' TODO missing text
+        '''
+        
+        # If this command is run (and value is True),
+        # we must update the sequencer.
+        self.sequencer_demands_updating = True
+        
+        # Prep. the sequencer generation stage 3:
+        # 'SYNCHRONISE_TO_BEATING_FREQUENCY'
+        self.update_local_awg_program[3] = True
+            
+        # The sequencer program generation in turn checks the
+        # 'Minimise inter-device asynchronous jitter' flag which
+        # at this time may be False, since value is returned
+        # *after* isFinalCall has run. Thus, we must force-set
+        # the flag from here.
+        self.setValue( \
+            'Minimise inter-device asynchronous jitter', \
+            value \
+        )
+        
+        # Modifications may be done to the internal trigger period
+        self.perform_repetition_check = True
+        
+        # Setting this value to true, since it involves the
+        # usage of oscillators, may change the channel grouping
+        # type.
+        if value or \
+            self.getValue('Use oscillator-based repetition delay'):
+            
+            # A channel grouping of 4x2 is required.
+            self.setNode( \
+                '/'+self.dev+'/system/awg/channelgrouping', 0)
+                
+        else:
+            
+            # A channel grouping of 1x8 is sufficient.
+            if self.getNodeInt( \
+                '/'+self.dev+'/system/awg/channelgrouping') != 2:
+                
+                # The grouping should be changed.
+                self.setNode( \
+                    '/'+self.dev+'/system/awg/channelgrouping', 2)
+    
+    
+    def setBeatFrequency(self, quant, value):
+        ''' TODO missing text
+        '''
+        
+        # Set oscillator 1 to the beat frequency of the sequencers.
+        beat_frequency = abs(value)
+        
+        previous_osc_freq = \
+            self.getNodeDouble('/'+str(self.dev)+'/oscs/0/freq')
+
+        iterfreq = 2
+        while(iterfreq <= 32):
+
+            setval = beat_frequency / iterfreq
+            
+            if setval < 299000000:
+                
+                self.setNode( \
+                    '/'+str(self.dev)+'/oscs/0/freq', \
+                    setval)
+                self.syncNodes()
+                
+                if self.getNodeDouble( \
+                    '/'+str(self.dev)+'/oscs/0/freq') == setval:
+                    
+                    # All is fine. Update value and break.
+                    self.setValue('Beat frequency', setval)
+                    break
+    
+            iterfreq *= 2
+        
+        # Check whether the set was successfull
+        if iterfreq > 32:
+
+            # Not fine, reset and raise error.
+            self.setNode( \
+                '/'+str(self.dev)+'/oscs/0/freq',\
+                previous_osc_freq )
+            
+            raise ArithmeticError( \
+                "Cannot set oscillator 1 to an even dividend " + \
+                "of "+str(beat_frequency)+" Sa/s)" )
+    
+        # TODO This may be solvable by moving commands around in the 'other' datatype category right here.
+        self.log('WARNING: Changing the beat frequency was fine and all but we must now also change the internal repetition rate if that was set to match the beat frequency.',level=30)
+    
+    
+    def setInternalTriggerPeriod(self, quant, value):
+        '''TODO missing text
+        '''
+        # Is the user changing the internal trigger period,
+        # while the system is set to use an oscillator as the
+        # internal repetition delay source?
+        
+        # Is the system set to use oscillator 2 as the internal
+        # repetition source trigger?
+        if self.getValue( \
+            'Use oscillator-based repetition delay'):
+            
+            # TODO The first thing which should happen, is to
+            # check whether the new requested period is reasonable.
+            # This check includes for instance checking whether
+            # it is too small or large to represent by the
+            # oscillator. If yes, modify the period.
+            
+            # Parry for infinite frequencies, check limits.
+            # This part has been somewhat optimised, see if-cases.
+            # For instance the >= 0 or not check is flag-checkable.
+            
+            if value >= 0:
+            
+                # Value is positive
+                if value < 8.333333333333333e-10:
+                    
+                    # Value is an issue, the oscillator cannot
+                    # go any faster. Limit the requested period.
+                    value = 8.333333333333333e-10
+            
+            else:
+            
+                # Value is negative
+                if value > -8.333333333333333e-10:
+                    
+                    # Value is an issue, the oscillator cannot
+                    # go any faster. Limit the requested period.
+                    value = -8.333333333333333e-10
+            
+            ''' # See triple-apostrophe comment at while loop below
+            
+            # Fetch the current set value for the repetition
+            # oscillator.
+            previous_osc_freq = self.getNodeDouble( \
+                '/'+str(self.dev)+'/oscs/1/freq')'''
+            
+            # Must we synchronise to the jitter-free clause?
+            if self.getValue( \
+                'Minimise inter-device asynchronous jitter'):
+                
+                # Fetch the beat frequency (oscillator) and its
+                # period for repeated usage later.
+                beat_oscill = self.getNodeDouble( \
+                    '/'+str(self.dev)+'/oscs/0/freq')
+                    
+                beat_peri = abs(1 / beat_oscill)
+                
+                ''' # The below while-segment has been commented,
+                # fetching a perfectly representable value for
+                # the next 'guess' of the while loop is pretty
+                # complicated.
+                attempts = 0
+                while (attempts <= 30):'''
+                
+                # Are the devices *not* in sync?
+                if beat_oscill != 0:
+
+                    # A beat frequency exists. The oscillator
+                    # must be set to a whole multiple of the
+                    # beat-frequency oscillator.
+                    
+                    # Is the requested value *not* a legal
+                    # and valid multiple of the beat period?
+                    if not (value % beat_peri == 0):
+                    
+                        # The requested repetition frequency is
+                        # not a multiple of the beat frequency,
+                        # and has to be modified.
+                        
+                        # Is value even smaller than the beat
+                        # period?
+                        #                           TODO is this check still valid after adding 'sense checks?'
+                        if value > beat_peri:
+                    
+                            # value mod. beat_peri != 0
+                            nearest_int = \
+                                round(value / beat_peri)
+                            
+                            value = nearest_int * beat_peri
+                        
+                        else:
+                        
+                            # Value is smaller than (or equal
+                            # to) the beat period. Set the
+                            # value to the lowest feasible.
+                            value = beat_peri
+                    
+                # Get the corresponding frequency
+                rep_frequency = abs(1 / value)
+                
+                # Try to set rep_frequency.
+                # if success - report and break
+                # else: attempt += 1, value = TODO
+                
+                self.setNode( \
+                    '/'+str(self.dev)+'/oscs/1/freq', \
+                    rep_frequency)
+                
+                self.syncNodes()
+            
+                value = 1 / self.getNodeDouble( \
+                    '/'+str(self.dev)+'/oscs/1/freq')
+            
+                '''# See triple-apostrophe comment at the while-
+                # loop above.
+                
+                received_rpf = self.getNodeDouble( \
+                    '/'+str(self.dev)+'/oscs/1/freq')
+                
+                if received_rpf == rep_frequency:
+                
+                    # All is fine, the value was set and legal.
+                    break
+                    
+                else:
+                
+                    # Failure. Increment attempts.
+                    attempts += 1
+                    
+                    # Update value.
+                    # TODO Getting this next guess is pretty
+                    # much a PhD in itself to get right.
+                    # Hence the commented code.
+                    value = value * attempts / 30'''
+                
+            else:
+            
+                # The user has not requested to synchronise the
+                # delay to the beat frequency oscillator.
+            
+                # No jitter-free clause needed.
+                rep_frequency = abs(1 / value)
+                
+                self.setNode( \
+                    '/'+str(self.dev)+'/oscs/1/freq', \
+                    rep_frequency)
+                
+                self.syncNodes()
+            
+                value = 1 / self.getNodeDouble( \
+                    '/'+str(self.dev)+'/oscs/1/freq')
+                
+                        
+            ''' # See triple-apostrophe comment above.
+            # Check whether the set was successfull
+            if attempts > 30:
+
+                # Not fine, reset and raise error.
+                self.setNode( \
+                    '/'+str(self.dev)+'/oscs/1/freq',\
+                        previous_osc_freq)
+                        
+                raise ArithmeticError( \
+                    "Could not modify the requested repetition "+ \
+                    "rate to an exact oscillator value given "  + \
+                    "the currently set beat frequency." )'''
+        
+        else:
+        
+            # The user has requested not to use an oscillator
+            # for the internal trigger period. This implies
+            # a change of the sequencer program.
+            self.sequencer_demands_updating = True
+        
+        # The internal repetition rate value has to be
+        # set already at this stage, as the value
+        # returns after the isFinalCall check which
+        # might depend on this value.
+        self.setValue('Internal trigger period', value)
+        
+        # Sanity check for validness of internal repetition rate
+        self.perform_repetition_check = True
+    
+    
+    def setOscillatorBasedRepetitionDelay(self, quant, value):
+        '''TODO
+        '''
+        # If this command is run (and value is True),
+        # we must update the sequencer.
+        self.sequencer_demands_updating = True
+        
+        # Prep. the sequencer generation stage 2:
+        # WAIT_FOR_INITIAL_TRIGGER, DELAY_BEFORE_LOOP_END,
+        # WAIT_FOR_TRIGGER_TO_REPEAT
+        self.update_local_awg_program[2] = True
+        
+        # The sequencer program generation in turn checks the
+        # 'Use oscillator-based repetition delay' flag which
+        # at this time may be False, since value is returned
+        # *after* isFinalCall has run. Thus, we must force-set
+        # the flag from here.
+        self.setValue( \
+            'Use oscillator-based repetition delay', \
+            value \
+        )
+        
+        # Setting this value to true, since it involves the
+        # usage of oscillators, may change the channel grouping
+        # type.
+        if value or self.getValue( \
+            'Minimise inter-device asynchronous jitter'):
+            
+            # A channel grouping of 4x2 is required.
+            self.setNode( \
+                '/'+self.dev+'/system/awg/channelgrouping', 0)
+                
+        else:
+            
+            # A channel grouping of 1x8 is sufficient.
+            if self.getNodeInt( \
+                '/'+self.dev+'/system/awg/channelgrouping') != 2:
+                
+                # The grouping should be changed.
+                self.setNode( \
+                    '/'+self.dev+'/system/awg/channelgrouping', 2)
+    
+    
+    def setReferenceClock(self, quant, value):
+        '''TODO write text
+        '''
+        # Is the user changing the reference clock?
+        
+        # As the clock will revert to the 'Internal' mode in case
+        # of failure, more complex behaviour is required than a
+        # simple ZI API call.
+        
+        # To save on the waiting time: if the system is running
+        # in external mode, and we're trying to set it to external
+        # at bootup, simply ignore the set.
+        
+        req_value = int(quant.getCmdStringFromValue(value))
+        rfclk = str( \
+            '/'+self.dev+'/system/clocks/referenceclock/source' )
+        
+        if not (self.getNodeInt( rfclk ) == req_value):
+        
+            # Set the new value. The instrument may revert it,
+            # thus it must not enter the node shadow.
+            self.setNode( rfclk, req_value, volatile = True )
+            self.flushNodeWrites()
+            
+            # Wait for the 'Reference clock' value to eventually
+            # rebounce. Half of a second is a typical good value.
+            time.sleep(0.5)
+            
+            # Fetch the new value and compare differences.
+            self.syncNodes()
+            value = self.getNodeInt( rfclk )
+            
+            # Did we fail to change the value?
+            # TODO This if-case together with the if
+            # requested_value below can likely be algorithmically
+            # optimised.
+            if value != req_value:
+
+                if req_value == 1:
+                    
+                    # Has the user requested to halt the system in
+                    # case this happens?
+                    if self.getValue( \
+                        'Halt on external clock failure'):
+                        
+                        raise RuntimeError( \
+                            "Halted: Could not lock the "     + \
+                            "reference clock to an external " + \
+                            "signal.")
+                        
+                    else:
+                    
+                        # Send a lock failure warning.
+                        self.log( \
+                            "Warning: Could not lock the "    + \
+                            "reference clock to an external " + \
+                            "signal.")
+                
+                else:
+                
+                    # Send an unlock failure warning.
+                    self.log( \
+                        "Warning: Could not unlock the "      + \
+                        "reference clock from the external "  + \
+                        "signal.")
+    
+    
+    def setOutputSampleRate(self, quant, value):
+        '''TODO
+        '''
+        # Is the user changing a ZIAPI double which may invalidate
+        # the current internal repetition delay value?
+        
+        # Modify the sample rate clock
+        self.daq.setDouble( \
+            quant.set_cmd.replace('other ','') % self.dev, \
+            value \
+        )
+        
+        # This operation is delicate, thus we monitor a status
+        # string for its current status.
+        upload_timeout_ms = 2950
+        clock_status = 2 # 2 = 'Busy' acc. to ZI HDAWG doc.
+        
+        # Give it a tiny wait
+        time.sleep(0.050) # TODO This value should be minimised
+        
+        # elf/status provides information whether the upload is
+        # succeeding.
+        while (clock_status != 0) and (upload_timeout_ms >= 0):
+
+            # Fetch progress
+            clock_status = \
+                self.daq.getInt( \
+                    '/%s/system/clocks/sampleclock/status' \
+                    % self.dev)
+            
+            # Shortcut ending
+            if clock_status == 0:
+                break
+            
+            # Waiting sequence
+            time.sleep(0.050)
+            upload_timeout_ms -= 50
+        
+        # Check for sample clock change timeout
+        if upload_timeout_ms <= 0:
+            raise RuntimeError( \
+                "Failed to set \'Output sample rate\' due " + \
+                "to command timeout.")
+        
+        # Sample clock change reported failure
+        elif clock_status == 1:
+            raise RuntimeError( \
+                "Failed to set \'Output sample rate\' due " + \
+                "to some unknown device error.")
+        
+        # This command may change the validness of the internal
+        # repetition delay.
+        self.perform_repetition_check = True
+    
+    
+    def setOutputSampleRateDivisor(self, quant, value):
+        '''TODO
+        '''
+        
+        # Is the user changing the sampling rate combo?
+        
+        self.setNode( \
+            quant.set_cmd.replace('other ','') % self.dev, \
+            int(quant.getCmdStringFromValue(value)) \
+        )
+    
+        # This command may change the validness of the internal
+        # repetition delay.
+        self.perform_repetition_check = True
+    
+    
+    def setSequencerTriggers(self, quant, value):
+        '''TODO
+        '''
+        
+        # This command may change the validness of the internal
+        # repetition delay.
+        self.perform_repetition_check = True
+        
+        # Prep. the sequencer generation stage 4:
+        # START_TRIGGER_PULSE, END_TRIGGER_PULSE
+        self.update_local_awg_program[4] = True
+        
+        # Prep. the sequencer generation stage 5:
+        # DELAY_BEFORE_END_TRIGGER
+        self.update_local_awg_program[5] = True
+    
+    
+    def setDelayBeforeEndTrigger(self, quant, value):
+        '''TODO
+        '''
+        
+        # Is the user changing a value which should trigger the
+        # internal repetition check?
+        
+        # This command may change the validness of the internal
+        # repetition delay.
+        self.perform_repetition_check = True
+        
+        # Prep. the sequencer generation stage 5:
+        # DELAY_BEFORE_END_TRIGGER
+        self.update_local_awg_program[5] = True
+    
+    
+    def setRunMode(self, quant, value):
+        '''TODO
+        '''
+        
+        # Is the user changing the Run mode?
+        
+        # This command will require a change in the
+        # sequencer program.
+        self.sequencer_demands_updating = True
+        
+        # If changing back to 'Internal trigger' -> we may need
+        # to double-check that the internal repetition rate is
+        # valid. All previous calls during other Run modes
+        # have been ignored.
+        self.perform_repetition_check = True
+        
+        # We now make a note to the generateSequencerProgram
+        # that the run mode has changed.
+        
+        # Prep. the sequencer generation stage 2:
+        # WAIT_FOR_INITIAL_TRIGGER, DELAY_BEFORE_LOOP_END,
+        # WAIT_FOR_TRIGGER_TO_REPEAT
+        self.update_local_awg_program[2] = True
+        
+        # The Labber-stored value for 'Run mode' must be updated
+        # at this location as the generateSequencerProgram function
+        # will run before the setValue default after isFinalCall.
+        self.setValue('Run mode', value)
+    
+    
+    def setOutputRange(self, channel, quant, value):
+        '''Set the output range of channel, counting from 1.
+        '''
+        
+        # Alter the output range, make sure to update the
+        # self-object list of ranges. This list is used when
+        # resetting the output range after disabling the direct
+        # output.
+        
+        val = float(quant.getCmdStringFromValue(value))
+        
+        # Execute command
+        self.setNode( \
+            '/%s/sigouts/%s/range' % (self.dev, channel-1), val \
+        )
+        
+        # Update list
+        self.previous_ranges[channel-1] = val
+    
+    
+    def setBypassDacToPort(self, channel, quant, value):
+        '''Set whether channel, counting from 1, bypasses its DAC.
+        
+            For your information, the DAC bypass to port function
+            is known as 'Direct output' in ZI LabOne.
+        '''
+        # Disable and restore if false, merely enable if true
+        if not value:
+            
+            # Execute disablement
+            self.setNode( \
+                '/%s/sigouts/%s/direct' % (self.dev,channel-1), 0 \
+            )
+            
+            # Note to reader: this clause usually changes the
+            # measurement range in such a way that a relay
+            # will toggle the instrument into said range.
+            # Meaning that a weird double-klicking is expected.
+            self.setNode( \
+                '/%s/sigouts/%s/range' % (self.dev,channel-1), \
+                float(self.previous_ranges[channel-1]) \
+            )
+        
+        else:
+        
+            # Merely execute the enablement
+            self.setNode( \
+                '/%s/sigouts/%s/direct' % (self.dev,channel-1), 1 \
+            )
+    
+    
+    def setMarkerConfiguration(self, channel, marker, quant, value):
+        '''Set the start time or duration of a marker. Channel and marker
+        are counted from 0.
+        '''
+        
+        # The config can change three major topics:
+        # 1. Start time for marker 1/2
+        # 2. Duration of marker 1/2
+        # 3. Whether there are any markers left to be played.
+        
+        # Get the current sample rate (per divisor)
+        sample_rate =                                            \
+            self.getValue('Output sample rate') /                \
+            2**self.getValueIndex('Output sample rate divisor')
+        
+        # Change marker start or duration?
+        if('st' in quant.name):
+            
+            # Start it is. Convert value to samples.
+            start = int(round(value * sample_rate))
+            
+            # Fetch the current duration.
+            duration = int(self.marker_configuration[channel,marker,1])
+            
+            # Update the marker configuration.
+            self.configureMarker(channel,marker,start,duration)
+            
+        else:
+        
+            # So it's duration then.
+            duration = int(round(value * sample_rate))
+            
+            # Fetch the current start.
+            start = int(self.marker_configuration[channel,marker,0])
+            
+            # Update the marker configuration.
+            self.configureMarker(channel,marker,start,duration)
+    
+    
+    ################################
+    """ Marker configuration """
+    ################################
     
     def configureMarker(self, channel=0, marker=0, start=0, duration=0):
         ''' TODO
@@ -1693,6 +1890,11 @@ class Driver(LabberDriver):
             #     props['interfaces'][0]
             # )
  
+        # Keep the device model and its options, these identify which
+        # compiled programs may be reused. See fetchSequencerProgramDigest.
+        self.device_model   = str(device_model)
+        self.device_options = sorted(str(option) for option in device_options)
+        
         # Update the device options in the instrument server
         self.setValue('CNT installed', False)
         self.setValue( 'MF installed', False)
@@ -1725,9 +1927,31 @@ class Driver(LabberDriver):
                 # self.setValue('Output channel '+str(channel_check)+' detected', False)
             
         
+        # Declare the buffer of node writes, and the shadow of node values
+        # known to the driver. See setNode.
+        self.pending_node_writes = []
+        self.node_shadow = {}
+        
+        # Declare the nodes written by the driver. Only these are shadowed,
+        # as the instrument holds the value last written to them. Volatile
+        # nodes may be changed by the instrument on its own accord, such as
+        # the reference clock source reverting when losing its lock. These
+        # are never shadowed, see fetchNode.
+        self.written_nodes = set()
+        self.volatile_nodes = set([ \
+            '/'+self.dev+'/awgs/0/enable', \
+            '/'+self.dev+'/system/identify', \
+            '/'+self.dev+'/system/clocks/referenceclock/source'])
+        
+        # Declare the parsed set and get commands of the quantities. The
+        # node paths depend on the connected device. See parseSetCommand.
+        self.set_descriptors = {}
+        self.get_descriptors = {}
+        
         # Check if the API release version differs from the connected
         # data server's release version.
         ziUtils.api_server_version_check(self.daq)
+        self.labone_version = self.daq.version()
  
         # Report successful connection
         self.log('Connected to device '+str(self.dev.upper())+'.', level=30)
@@ -1736,6 +1960,102 @@ class Driver(LabberDriver):
         self.fetchAwgModule()
         
 
+    ###################
+    """ Node writes """
+    ###################
+    
+    def setNode(self, path, value, volatile = False):
+        '''Buffer a write of value to the node at path. The buffered writes
+        are sent to the instrument by flushNodeWrites, in the order they
+        were made.
+        
+        Written values are kept in the node shadow, and writing a value
+        the node already holds is suppressed. Nodes whose value the
+        instrument may change on its own accord, such as the AWG enable
+        node, must be written as volatile. Volatile writes are always sent,
+        and leave the node out of the shadow for good.
+        '''
+        
+        if volatile:
+            self.volatile_nodes.add(path)
+        else:
+            self.written_nodes.add(path)
+        
+        if (path not in self.volatile_nodes) and \
+            self.getValue('Cache node values'):
+            
+            # Suppress redundant writes.
+            if (path in self.node_shadow) and \
+                (self.node_shadow[path] == value):
+                return
+            
+            self.node_shadow[path] = value
+        
+        else:
+            self.node_shadow.pop(path, None)
+        
+        self.pending_node_writes.append([path, value])
+    
+    
+    def getNodeInt(self, path):
+        '''Return the integer value of the node at path. See fetchNode.
+        '''
+        return self.fetchNode(path, self.daq.getInt)
+    
+    
+    def getNodeDouble(self, path):
+        '''Return the double value of the node at path. See fetchNode.
+        '''
+        return self.fetchNode(path, self.daq.getDouble)
+    
+    
+    def fetchNode(self, path, get_function):
+        '''Return the value of the node at path. The value is taken from
+        the node shadow if present, otherwise it is read from the instrument
+        using get_function. The value read is kept in the node shadow only
+        if the node is written by the driver, and is not volatile.
+        '''
+        
+        if path in self.node_shadow:
+            return self.node_shadow[path]
+        
+        # The read must reflect any buffered node writes.
+        self.flushNodeWrites()
+        value = get_function(path)
+        
+        if self.getValue('Cache node values') and \
+            (path in self.written_nodes) and \
+            (path not in self.volatile_nodes):
+            self.node_shadow[path] = value
+        
+        return value
+    
+    
+    def syncNodes(self):
+        '''Send all buffered node writes, and synchronise with the
+        instrument. The instrument may have adjusted the written values,
+        for instance by rounding them. Thus, the node shadow is cleared.
+        '''
+        
+        self.flushNodeWrites()
+        self.daq.sync()
+        self.node_shadow.clear()
+    
+    
+    def flushNodeWrites(self):
+        '''Send all buffered node writes to the instrument, using a single
+        transactional set command.
+        '''
+        
+        if len(self.pending_node_writes) > 0:
+            
+            # Clear the buffer prior to sending, a failing transaction should
+            # not be re-attempted at every subsequent flush.
+            node_writes = self.pending_node_writes
+            self.pending_node_writes = []
+            self.daq.set(node_writes)
+    
+    
     ##################
     """ AWG module """
     ##################
@@ -1804,6 +2124,56 @@ class Driver(LabberDriver):
         self.loaded_waveforms = [[]]    * self.n_ch  # All waveform data.
         self.waveform_changed = [False] * self.n_ch  # Update this channel?
         
+        # Declare the digests and lengths of the loaded waveforms. These are
+        # used for detecting waveform changes, see hashWaveform.
+        self.loaded_waveform_digests = [self.hashWaveform([])] * self.n_ch
+        self.loaded_waveform_lengths = [0] * self.n_ch
+        
+        # Declare the cache of blueprint-assembled waveforms, and the set of
+        # waveform primitives fetched during the current final call.
+        # See fetchAndAssembleWaveform.
+        self.assembly_cache     = [None] * self.n_ch
+        self.fetched_primitives = {}
+        
+        # Declare the encoded native waveform buffer kept for every AWG
+        # core, see encodeNativeLane. The layout lists the buffer length,
+        # the channels held by its lanes and whether it holds markers. The
+        # ranges list the output range each lane was encoded with.
+        n_cores = (self.n_ch + 1) // 2
+        self.native_waveforms = [None] * n_cores
+        self.native_layouts   = [None] * n_cores
+        self.native_ranges    = [[None, None] for core in range(0, n_cores)]
+        
+        # Declare whether the instrument holds the native buffer of a core,
+        # see uploadNativeWaveform.
+        self.native_waveform_uploaded = [False] * n_cores
+        self.uploaded_waveform_bytes = 0
+        self.changed_waveform_samples = 0
+        
+        # Declare the waveform library, see fetchLibrarySlot. The library
+        # maps the sets of waveforms held by the instrument to their slots,
+        # in order of use. The native buffers are uploaded to the wave index
+        # of the slot being filled. The waveform memory used per declared
+        # sample is learned from the compiled programs, see waitForUpload.
+        self.library_active = False
+        self.library_slot_count = 1
+        self.library_slots = {}
+        self.native_wave_index = 0
+        self.waveform_memory_per_sample = None
+        
+        # Declare the hardware loop, see storeHardwareLoopPoint. The length
+        # is the amount of points of the loop the sequencer program plays,
+        # 0 meaning that no hardware loop is played. The key identifies the
+        # loop held by the instrument.
+        self.hardware_loop_length = 0
+        self.hardware_loop_waveforms = []
+        self.hardware_loop_digests = []
+        self.hardware_loop_key = None
+        
+        # Declare the values of the quantities set at the first point of
+        # the hardware loop, see checkHardwareLoopValue.
+        self.hardware_loop_values = {}
+        
         # Declare the marker configuration and whether to play markers.
         # Syntax: channel, marker (1 or 2), [start value, duration]
         self.marker_configuration = np.zeros((self.n_ch, 2, 2))
@@ -1813,6 +2183,12 @@ class Driver(LabberDriver):
         # Declare a flag for detecting when the sequencer requires an update.
         self.sequencer_demands_updating = False
         
+        # Declare the digest of the program running on the sequencer, and
+        # the amount of times an update generated the very same program.
+        # The program on the instrument is not known until one is uploaded.
+        self.loaded_program_digest = None
+        self.skipped_sequencer_recompilations = 0
+        
         # Declare the initial buffer length
         self.buffer_length = 0
         
@@ -1852,7 +2228,7 @@ class Driver(LabberDriver):
         # last set value. Thus, poll the instrument for said values.
         self.previous_ranges = [1.0] * self.n_ch
         for i in range(0,self.n_ch):
-            self.previous_ranges[i] = float(round(self.daq.getDouble( \
+            self.previous_ranges[i] = float(round(self.getNodeDouble( \
                 '/%s/sigouts/%s/range' % (self.dev, str(i))),1))
         
     
@@ -1860,11 +2236,39 @@ class Driver(LabberDriver):
     """ Writing waveforms to memory and updating the sequencer """
     ##############################################################
     
-    def updateSequencer(self):
-        '''Description goes here.
+    def updateSequencer(self, program_digest):
+        '''Compile and upload the generated local AWG program, identified
+        by program_digest, see fetchSequencerProgramDigest.
         '''
-        self.generateSequencerProgram()
-        self.compileAndUploadSourceString()
+        
+        # Until the upload succeeds, the program on the instrument is unknown.
+        self.loaded_program_digest = None
+        
+        # Programs compiled earlier are uploaded from the compiled program
+        # cache, skipping the compiler entirely.
+        if not self.uploadCachedProgram(program_digest):
+            self.compileAndUploadSourceString()
+            self.storeCompiledProgram(program_digest)
+        
+        self.loaded_program_digest = program_digest
+        
+        # The waveform memory content of all cores is now unknown.
+        self.native_waveform_uploaded = \
+            [False] * len(self.native_waveform_uploaded)
+        self.library_slots = {}
+        self.hardware_loop_key = None
+        self.setValue('Waveform library slots compiled', \
+            self.library_slot_count if self.library_active else 0)
+        
+        # Now that the memory usage of the waveform library is known, a
+        # library beyond the memory budget is shrunk to fit. A hardware loop
+        # requires a slot for every point, and is never shrunk.
+        if self.library_active and (self.hardware_loop_length == 0) and \
+            (self.fetchLibrarySlotCount() < self.library_slot_count):
+            self.update_local_awg_program[0] = True
+            self.generateSequencerProgram()
+            self.updateSequencer(self.fetchSequencerProgramDigest())
+            return
         
         # After blasting the sequencer memory,
         # we must restore the now lost waveforms.
@@ -1874,10 +2278,161 @@ class Driver(LabberDriver):
             # Thus, this section may be made more efficient. For instance using
             # some waveform_used list.
         
-            if len(self.loaded_waveforms[wave]) > 0:
+            if self.loaded_waveform_lengths[wave] > 0:
                 self.waveform_changed[wave] = True
         
     
+    def fetchSequencerProgramDigest(self):
+        '''Return a digest identifying the compiled form of the local AWG
+        program. The TIMESTAMP tag is ignored, as it does not alter the
+        compiled program. The device model, its installed options and the
+        LabOne version are included, as these all influence the compiler.
+        So are the channel grouping and the AWG core compiled for, as the
+        very same program text compiles differently for every grouping.
+        '''
+        
+        program_hash = hashlib.sha1()
+        for key in self.local_awg_program:
+            if key != 'TIMESTAMP':
+                program_hash.update(self.local_awg_program[key].encode())
+        
+        program_hash.update(( \
+            '\n// ' + str(self.device_model)   + \
+            '\n// ' + str(self.device_options) + \
+            '\n// ' + str(self.labone_version)).encode())
+        
+        # Note that the grouping may have been set moments ago, and is
+        # read through the node shadow. See setMinimiseInterDeviceJitter.
+        program_hash.update(( \
+            '\n// ' + str(self.getNodeInt( \
+                '/'+self.dev+'/system/awg/channelgrouping')) + \
+            '\n// ' + str(self.awgModule.getInt('awgModule/index'))).encode())
+        
+        return program_hash.hexdigest()
+    
+    
+    def fetchCompiledProgramCache(self):
+        '''Return the directory holding the compiled program cache.
+        The cache is a set of ELF files named by their program digests,
+        the least recently used of which are removed once the cache grows
+        beyond 'Compiled program cache size'. As the digest covers the
+        channel grouping, every grouping holds programs of its own. See
+        fetchSequencerProgramDigest.
+        '''
+        
+        cache_dir = os.path.join(self.awg_data_dir, "awg", "elf", \
+            "labber_program_cache")
+        
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        
+        return cache_dir
+    
+    
+    def uploadCachedProgram(self, program_digest, upload_timeout_ms = 10000):
+        '''Upload the ELF file compiled from an identical program earlier,
+        if there is one in the compiled program cache.
+        
+        Returns True if the cached program was uploaded.
+        '''
+        
+        if int(self.getValue('Compiled program cache size')) <= 0:
+            return False
+        
+        cached_elf = os.path.join(self.fetchCompiledProgramCache(), \
+            program_digest + '.elf')
+        if not os.path.isfile(cached_elf):
+            return False
+        
+        # Mark the cache entry as recently used.
+        os.utime(cached_elf, None)
+        
+        # Upload a copy of the cached file. The AWG module may overwrite
+        # the file it was last told to upload when compiling a new program.
+        upload_elf = os.path.join(self.awg_data_dir, "awg", "elf", \
+            self.dev + '_labber_cached.elf')
+        shutil.copyfile(cached_elf, upload_elf)
+        
+        self.awgModule.set('awgModule/elf/file', upload_elf)
+        self.awgModule.set('awgModule/elf/upload', 1)
+        with self.phase_timer.span('ELF upload'):
+            self.waitForUpload(upload_timeout_ms)
+        
+        self.setValue('Last compile duration', 0)
+        return True
+    
+    
+    def storeCompiledProgram(self, program_digest):
+        '''Copy the ELF file of a freshly compiled program into the
+        compiled program cache, and remove the least recently used cache
+        entries should the cache grow too large.
+        '''
+        
+        cache_size = int(self.getValue('Compiled program cache size'))
+        if cache_size <= 0:
+            return
+        
+        # The AWG module reports the compiler output relative to its
+        # ELF directory.
+        compiled_elf = self.awgModule.getString('awgModule/elf/file')
+        if not os.path.isabs(compiled_elf):
+            compiled_elf = os.path.join(self.awg_data_dir, "awg", "elf", \
+                compiled_elf)
+        
+        if not os.path.isfile(compiled_elf):
+            self.log(   "Warning: could not locate the compiled program " + \
+                        "\'" + compiled_elf + "\', it will not be cached.", \
+                        level=30)
+            return
+        
+        cache_dir = self.fetchCompiledProgramCache()
+        shutil.copyfile(compiled_elf, \
+            os.path.join(cache_dir, program_digest + '.elf'))
+        
+        # Evict the least recently used entries.
+        cached_elfs = sorted( \
+            glob.glob(os.path.join(cache_dir, '*.elf')), \
+            key = os.path.getmtime)
+        for cached_elf in cached_elfs[:-cache_size]:
+            os.remove(cached_elf)
+    
+    
+    def waitForCondition(   self, \
+                            condition, \
+                            timeout_s, \
+                            initial_interval_s = 0.001, \
+                            maximum_interval_s = 0.050):
+        '''Poll condition() until it returns True, or until timeout_s
+        seconds have passed. The polling interval starts out at
+        initial_interval_s and doubles for every unsuccessful poll, capped
+        at maximum_interval_s. Fast operations thus return within a
+        millisecond or so, whereas slow operations do not flood the
+        instrument with requests.
+        
+        Returns True if the condition was met, False on timeout.
+        '''
+        
+        deadline = time.monotonic() + timeout_s
+        interval = initial_interval_s
+        
+        while not condition():
+            
+            # Monitor whether the user halts the measurement.
+            if self.isStopped():
+                raise CompileAndUploadFailure(  "The measurement was " + \
+                                                "halted unexpectedly.")
+            
+            # Timeout monitoring.
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, maximum_interval_s)
+        
+        return True
+    
+    
     def compileAndUploadSourceString(   self, \
                                         compile_timeout_ms = 10000, \
                                         upload_timeout_ms  = 10000):
@@ -1894,24 +2449,22 @@ class Driver(LabberDriver):
                     "restart the device entirely."                   , \
                     level=30)
         
-        # Run the compilation process
-        while   (self.awgModule.getInt('awgModule/compiler/status') == -1) \
-            and (compile_timeout_ms >= 0):
-            
-            # Timeout monitoring, and setting the polling time
-            compile_timeout_ms -= 50
-            time.sleep(0.050)
-            
-            # Monitor whether the user halts the measurement.
-            if self.isStopped():
-                raise CompileAndUploadFailure(  "The measurement was " + \
-                                                "halted unexpectedly.")
+        # Run the compilation process. The AWG module does not offer any
+        # notification for when the compiler is done, hence poll the
+        # compiler status with a back-off. Short programs are typically
+        # compiled within a few milliseconds.
+        compile_start = time.monotonic()
+        with self.phase_timer.span('Compile'):
+            compile_finished = self.waitForCondition( \
+                lambda: self.awgModule.getInt('awgModule/compiler/status') \
+                    != -1, compile_timeout_ms / 1000.0)
+        self.setValue('Last compile duration', time.monotonic()-compile_start)
 
         # Fetch compilation status
         compiler_status = self.awgModule.getInt('awgModule/compiler/status')
         
         # Check for compilation timeout
-        if compile_timeout_ms <= 0:
+        if not compile_finished:
             raise CompileAndUploadFailure("The compilation process timed out.")
 
         # Compiler reports success.
@@ -1956,52 +2509,70 @@ class Driver(LabberDriver):
                                             "status integer = \'"        + \
                                             str(compiler_status)+"\'")
 
-        # Initiate upload process.
-        report_line = 1
-        time.sleep(0.2) # TODO: This delay should be minimised.
+        # Upload the compiled program to the instrument.
+        with self.phase_timer.span('ELF upload'):
+            self.waitForUpload(upload_timeout_ms)
+    
+    
+    def waitForUpload(self, upload_timeout_ms = 10000):
+        '''Monitor the AWG module while it uploads an ELF file to the
+        instrument. The ELF file is either freshly compiled, or fetched from
+        the compiled program cache, see uploadCachedProgram.
+        '''
         
-        # elf/status provides information whether the upload is succeeding.
-        while (self.awgModule.getDouble('awgModule/progress') < 1.0) \
-            and (self.awgModule.getInt('awgModule/elf/status') != 1) \
-            and (upload_timeout_ms >= 0):
-
+        # Initiate upload process. Right after compilation, the progress
+        # node of the AWG module may still report the previous upload.
+        # A finished progress is thus only trusted once the progress has
+        # been seen to reset, or once the settle time has passed.
+        upload_start = time.monotonic()
+        settle_time = self.getValue('Upload settle time')
+        
+        # Progress reports are rate-limited, the upload is polled much more
+        # often than it is worth printing to the log.
+        report = {'line': 1, 'time': upload_start, 'reset': False}
+        
+        def uploadFinished():
+            
             # Fetch progress
-            progress = self.awgModule.getDouble('awgModule/progress') * 100.0
+            progress = self.awgModule.getDouble('awgModule/progress')
             
-            if progress >= 100.0:
-                break   # Take a shortcut in case of tiny sequencer snippets
+            # elf/status provides information whether the upload is
+            # succeeding: 1 reports a failure, 2 an ongoing upload.
+            elf_status = self.awgModule.getInt('awgModule/elf/status')
+            if elf_status == 1:
+                return True
             
-            # Print status
-            self.log("< {} > awgModule/progress: {:.1f}%".format( \
-                    report_line, \
-                    progress     \
-                ), \
-                level=30 \
-            )
+            if (progress < 1.0) or (elf_status == 2):
+                report['reset'] = True
             
-            # Increments the current amount of printed objects
-            report_line += 1
+            elif report['reset'] or \
+                (time.monotonic() - upload_start >= settle_time):
+                return True
             
-            # The delay should be minimised to the smallest number possible
-            # not affecting the overall performance. For instance, a de-sync
-            # would be considered performance-breaking.
-            if progress >= 98.0:
-                time.sleep(0.025)
-                compile_timeout_ms -= 25
-                
-            elif progress >= 70.0:
-                time.sleep(0.300)
-                compile_timeout_ms -= 300
-                
-            else:
-                time.sleep(0.600)
-                compile_timeout_ms -= 600
+            # Print status
+            if time.monotonic() - report['time'] >= 0.5:
+                self.log("< {} > awgModule/progress: {:.1f}%".format( \
+                        report['line'], \
+                        progress * 100.0 \
+                    ), \
+                    level=30 \
+                )
+                report['line'] += 1
+                report['time']  = time.monotonic()
+            
+            return False
+        
+        upload_finished = self.waitForCondition( \
+            uploadFinished, \
+            upload_timeout_ms / 1000.0)
+        self.setValue('Last upload duration', time.monotonic()-upload_start)
         
         # Fetch upload status
         elf_status = self.awgModule.getInt('awgModule/elf/status')
+        report_line = report['line']
         
         # Check for upload timeout
-        if upload_timeout_ms <= 0:
+        if not upload_finished:
             raise CompileAndUploadFailure("The upload process timed out.")
         
         # Upload reported success
@@ -2020,47 +2591,432 @@ class Driver(LabberDriver):
                 ) \
             )
         
-        # Unknown error
-        else:
-            raise CompileAndUploadFailure( \
-                "Unknown upload status reported " + \
-                "by instrument at {:.2f}".format(   \
-                    self.awgModule.getDouble('awgModule/progress') * 100.0 \
-                ) \
-            )
-
-        # # TODO Delete or leave in?
-        # # If the device was playing before, enable playback again.
-        # # Ensure that the value is indeed set.
-        # if AWG_playback_status == 1:
-            # timeout = 0.0
-            # while (((self.awgModule.get('awgModule/awg/enable')).get('awg'))\
-                # .get('enable')[0] != 1) and (timeout <= 2.0):
-                
-                # # TODO these values should be minimised
-                # time.sleep(0.05)
-                # timeout += 0.05
-                # self.awgModule.set('awgModule/awg/enable', 1)
+        # Unknown error
+        else:
+            raise CompileAndUploadFailure( \
+                "Unknown upload status reported " + \
+                "by instrument at {:.2f}".format(   \
+                    self.awgModule.getDouble('awgModule/progress') * 100.0 \
+                ) \
+            )
+
+        # # TODO Delete or leave in?
+        # # If the device was playing before, enable playback again.
+        # # Ensure that the value is indeed set.
+        # if AWG_playback_status == 1:
+            # timeout = 0.0
+            # while (((self.awgModule.get('awgModule/awg/enable')).get('awg'))\
+                # .get('enable')[0] != 1) and (timeout <= 2.0):
+                
+                # # TODO these values should be minimised
+                # time.sleep(0.05)
+                # timeout += 0.05
+                # self.awgModule.set('awgModule/awg/enable', 1)
+    
+        # Perform a final check whether the sequencer has run out of memory
+        cache_utilisation = self.daq.getDouble( \
+            '/'+str(self.dev)+'/awgs/0/waveform/memoryusage')
+        
+        # Learn the memory used per declared waveform sample, which sizes
+        # the waveform library. See fetchLibrarySlotCount.
+        declared_samples = self.library_slot_count * \
+            self.buffer_length * len(self.fetchChannelsInUse())
+        if declared_samples > 0:
+            self.waveform_memory_per_sample = \
+                cache_utilisation / declared_samples
+        
+        # A waveform library running out of memory is shrunk by
+        # updateSequencer rather than halting the measurement.
+        if (cache_utilisation > 0.9999) and not \
+            (self.library_active and (self.library_slot_count > 1) and \
+                (self.hardware_loop_length == 0)):
+            if self.getValue('Halt on cache overflow'):
+                raise MemoryError( "The sequencer ran out of cache space "  + \
+                                   "("+str(cache_utilisation * 100.0)+"%)"  + \
+                                   ". Disable \'Halt on cache overflow\' "  + \
+                                   "or reduce waveform lengths to continue.")
+            else:
+                self.log(   "Warning: out of sequencer cache memory. " + \
+                            "Expect lower performance.", level=30)
+
+
+    def runUploadTransaction(self, program_digest = None, attempts = 3, \
+                             initial_backoff_s = 1.0):
+        '''Upload the changed waveforms of all AWG cores as one transaction,
+        preceded by the sequencer program identified by program_digest if
+        one is given. See updateSequencer.
+        
+        The sequencer is halted once, all changed cores are uploaded, the
+        instrument is synchronised with, and the sequencer is then enabled
+        once. The sequencer thus never restarts while only some cores hold
+        their new waveforms.
+        
+        Should the ZI API fail during the transaction, the transaction is
+        re-attempted as a whole after a growing back-off. Once all attempts
+        have failed, the API connection is re-instantiated if the user wishes
+        so, and the transaction is attempted a final time.
+        '''
+        
+        # The waveforms of this transaction, should it be re-attempted.
+        transaction_waveforms = list(self.waveform_changed)
+        
+        remaining_attempts = attempts
+        backoff_s = initial_backoff_s
+        reconnected = False
+        
+        while True:
+            try:
+                # Halt the sequencer.
+                with self.phase_timer.span('Enable'):
+                    self.daq.setInt('/'+str(self.dev)+'/awgs/0/enable', 0)
+                
+                # Upload the new sequencer program, if any. This marks all
+                # loaded waveforms as changed.
+                if program_digest is not None:
+                    self.updateSequencer(program_digest)
+                
+                # In waveform library mode, every waveform in use is
+                # uploaded to the slot which is to hold the current set.
+                library_slot = None
+                if self.library_active and (self.hardware_loop_length == 0):
+                    library_key, library_slot = self.fetchLibrarySlot()
+                    self.native_wave_index = library_slot
+                    self.native_waveform_uploaded = \
+                        [False] * len(self.native_waveform_uploaded)
+                    for wave in range(0, self.n_ch):
+                        if self.loaded_waveform_lengths[wave] > 0:
+                            self.waveform_changed[wave] = True
+                
+                # Upload the changed waveforms of all cores, and let them
+                # land before restarting the sequencer.
+                with self.phase_timer.span('Waveform upload'):
+                    if self.hardware_loop_length > 0:
+                        self.writeHardwareLoopToMemory()
+                    else:
+                        self.writeWaveformToMemory()
+                    
+                    # Select the library slot.
+                    if library_slot is not None:
+                        self.setNode(self.fetchLibraryRegisterNode(), \
+                            library_slot)
+                        self.flushNodeWrites()
+                    
+                    self.daq.sync()
+                
+                # Re-enable the playback.
+                with self.phase_timer.span('Enable'):
+                    self.daq.setInt('/'+str(self.dev)+'/awgs/0/enable', 1)
+                
+                if library_slot is not None:
+                    self.storeLibrarySlot(library_key, library_slot)
+                
+                return
+            
+            except RuntimeError as transaction_exception:
+                
+                remaining_attempts -= 1
+                self.log( \
+                    "WARNING: the upload transaction failed (" + \
+                    str(transaction_exception) + "). " + \
+                    str(remaining_attempts) + " attempt(s) remaining.", \
+                    level=30)
+            
+            # Re-attempt every waveform of the transaction. Cores which did
+            # land are skipped by uploadNativeWaveform.
+            self.waveform_changed = [ \
+                changed or in_transaction for changed, in_transaction \
+                    in zip(self.waveform_changed, transaction_waveforms)]
+            
+            if remaining_attempts > 0:
+                time.sleep(backoff_s)
+                backoff_s *= 2
+            
+            # Shall we consider waiting for device to auto-restore?
+            elif (not reconnected) and self.getValue( \
+                'Attempt API reconnection when the HDAWG crashes'):
+                
+                # Perform long wait.
+                halt_time = self.getValue('Time to wait')
+                
+                self.log( \
+                    "The measurement was halted by the instrument "  +\
+                    "driver for device \'"+self.dev_uppercase        +\
+                    "\' because the device crashed. The measurement" +\
+                    " will now wait for "+str(halt_time)+" seconds " +\
+                    "and attempt to reconnect to the ZI API.",level=30)
+                
+                time.sleep(halt_time)
+                
+                # Attempt to re-fetch the API. The memory content of the
+                # instrument is unknown, hence restore the sequencer program
+                # and every waveform during the final attempt.
+                self.instantiateInstrumentConnection()
+                reconnected = True
+                remaining_attempts = 1
+                
+                if program_digest is None:
+                    program_digest = self.loaded_program_digest
+                self.native_waveform_uploaded = \
+                    [False] * len(self.native_waveform_uploaded)
+                self.library_slots = {}
+            
+            else:
+                raise RuntimeError( \
+                    "HDAWG \'"+self.dev_uppercase+"\' has crashed; the " + \
+                    "device does not respond to any calls from the PC. " + \
+                    "Consider restarting the device using the front button.")
+    
+    
+    def fetchLibrarySlotCount(self):
+        '''Return the amount of slots of the waveform library. This is the
+        amount requested by the user, limited by the share of waveform
+        memory which the library may use. The memory used by a slot is
+        estimated from the compiled programs, see waitForUpload.
+        '''
+        
+        requested_slots = max(1, int(self.getValue('Waveform library slots')))
+        
+        slot_samples = self.buffer_length * len(self.fetchChannelsInUse())
+        if (self.waveform_memory_per_sample is None) or (slot_samples == 0) \
+            or (self.waveform_memory_per_sample <= 0):
+            return requested_slots
+        
+        affordable_slots = int( \
+            self.getValue('Waveform library memory budget') / \
+            (self.waveform_memory_per_sample * slot_samples))
+        
+        return max(1, min(requested_slots, affordable_slots))
+    
+    
+    def fetchLibraryRegisterNode(self):
+        '''Return the node of the user register selecting the library slot.
+        '''
+        return '/%s/awgs/0/userregs/%d' % \
+            (self.dev, int(self.getCmdStringFromValue( \
+                'Waveform library register')))
+    
+    
+    def fetchLibrarySlot(self):
+        '''Return the key identifying the current set of loaded waveforms,
+        and the slot of the waveform library for it. The slot either already
+        holds the set, or is the slot to upload the set to: a free slot, or
+        the least recently used slot once the library is full.
+        
+        The key consists of the waveform digests, as well as of the output
+        ranges and the marker configuration, as these alter the uploaded
+        data. The library is left unmodified, see storeLibrarySlot.
+        '''
+        
+        library_key = ( \
+            tuple(self.loaded_waveform_digests), \
+            tuple(self.fetchOutputRange(channel) \
+                for channel in range(0, self.n_ch)), \
+            self.marker_configuration.tobytes())
+        
+        if library_key in self.library_slots:
+            return library_key, self.library_slots[library_key]
+        
+        used_slots = set(self.library_slots.values())
+        for slot in range(0, self.library_slot_count):
+            if not slot in used_slots:
+                return library_key, slot
+        
+        # The library is ordered by use.
+        return library_key, self.library_slots[next(iter(self.library_slots))]
+    
+    
+    def storeLibrarySlot(self, library_key, slot):
+        '''Record that slot holds the set of waveforms of library_key, and
+        mark it as the most recently used slot.
+        '''
+        
+        for held_key in [key for key in self.library_slots \
+            if self.library_slots[key] == slot]:
+            del self.library_slots[held_key]
+        
+        self.library_slots[library_key] = slot
+    
+    
+    def selectLibrarySlot(self):
+        '''Select the slot of the waveform library which holds the current
+        set of loaded waveforms, if any, by writing the library register.
+        
+        Returns True if a slot was selected. The waveforms then need no
+        uploading.
+        '''
+        
+        library_key, slot = self.fetchLibrarySlot()
+        if self.library_slots.get(library_key) != slot:
+            return False
+        
+        self.storeLibrarySlot(library_key, slot)
+        self.setNode(self.fetchLibraryRegisterNode(), slot)
+        self.flushNodeWrites()
+        
+        # The instrument already holds every waveform of the set.
+        self.waveform_changed = [False] * self.n_ch
+        
+        return True
+    
+    
+    def checkHardwareLoopValue(self, quant, value, options):
+        '''Check the value set for quant at the current point of a hardware
+        loop. The program of a hardware loop only plays waveforms per point,
+        every other setting holds for the loop as a whole. A quantity other
+        than a waveform taking different values within the loop would thus
+        be played with the wrong value, and halts the measurement instead.
+        '''
+        
+        # Waveforms, blueprints and primitives may differ between points.
+        if quant.name.endswith(' - Waveform') or \
+            quant.name.endswith(' sequence blueprint') or \
+            quant.name.startswith('Waveform primitive '):
+            return
+        
+        (index, n_points) = self.getHardwareLoopIndex(options)
+        
+        # A new loop begins.
+        if (index == 0) and self.isFirstCall(options):
+            self.hardware_loop_values = {}
+        
+        if not quant.name in self.hardware_loop_values:
+            self.hardware_loop_values[quant.name] = value
+        
+        elif not np.array_equal(self.hardware_loop_values[quant.name], value):
+            raise RuntimeError( \
+                "Halted: '" + quant.name + "' differs between the " + \
+                "points of the hardware loop. Only waveforms may be " + \
+                "swept in a hardware loop of the HDAWG; sweep '"     + \
+                quant.name + "' in a loop of its own.")
+    
+    
+    def storeHardwareLoopPoint(self, options):
+        '''Store the waveforms of the current point of a hardware loop.
+        Once the last point of the loop is stored, the loop is uploaded, see
+        runHardwareLoop.
+        
+        Only the waveforms may differ between the points of a hardware loop,
+        see checkHardwareLoopValue.
+        '''
+        
+        (index, n_points) = self.getHardwareLoopIndex(options)
+        
+        # A new loop begins.
+        if (index == 0) or (len(self.hardware_loop_waveforms) != n_points):
+            self.hardware_loop_waveforms = [None] * n_points
+            self.hardware_loop_digests   = [None] * n_points
+        
+        # Waveform primitives are fetched at most once per point.
+        self.fetched_primitives = {}
+        
+        waveforms = []
+        for wave in range(0, self.n_ch):
+            with self.phase_timer.span('Waveform assembly'):
+                waveform = self.fetchAndAssembleWaveform(wave)
+            
+            # Counteract Labber returning [None], see performSetValue.
+            if np.array_equal(waveform, [None]):
+                waveform = []
+            
+            # Assemblies are cached, thus keep a copy of the waveform.
+            waveforms.append(np.array(waveform, dtype = float))
+        
+        self.hardware_loop_waveforms[index] = waveforms
+        self.hardware_loop_digests[index] = \
+            tuple(self.hashWaveform(waveform) for waveform in waveforms)
+        
+        if index == n_points - 1:
+            self.runHardwareLoop()
+    
+    
+    def runHardwareLoop(self):
+        '''Upload a sequencer program playing every point of the stored
+        hardware loop, along with the waveforms of every point. Every
+        repetition of the program loop plays the next point, hence external
+        triggers advance through the loop if the run mode awaits them.
+        
+        Should the instrument already hold the very same loop, nothing is
+        uploaded. The loop is restarted by performArm.
+        '''
+        
+        hardware_loop_key = ( \
+            tuple(self.hardware_loop_digests), \
+            tuple(self.fetchOutputRange(channel) \
+                for channel in range(0, self.n_ch)), \
+            self.marker_configuration.tobytes())
+        
+        self.uploaded_waveform_bytes = 0
+        self.changed_waveform_samples = 0
+        
+        if (hardware_loop_key != self.hardware_loop_key) or \
+            (self.loaded_program_digest is None):
+            
+            # Every point declares the longest waveform of the loop, on
+            # every channel used by any of the points.
+            self.buffer_length = 0
+            self.highest_waveform_in_use = 0
+            for wave in range(0, self.n_ch):
+                self.loaded_waveform_lengths[wave] = max( \
+                    len(point[wave]) for point in self.hardware_loop_waveforms)
+                if self.loaded_waveform_lengths[wave] > 0:
+                    self.buffer_length = max( \
+                        self.buffer_length, self.loaded_waveform_lengths[wave])
+                    self.highest_waveform_in_use = wave +1
+            
+            if self.perform_repetition_check:
+                self.perform_repetition_check = False
+                if self.getValue('Run mode') == 'Internal trigger':
+                    self.checkInternalRepetitionRateValid()
+            
+            self.hardware_loop_length = len(self.hardware_loop_waveforms)
+            self.update_local_awg_program[0] = True
+            with self.phase_timer.span('Sequencer generation'):
+                self.generateSequencerProgram()
+                program_digest = self.fetchSequencerProgramDigest()
+            
+            # A loop of as many points of equal lengths is played by the
+            # program already running, only the waveforms differ.
+            if program_digest == self.loaded_program_digest:
+                program_digest = None
+                self.skipped_sequencer_recompilations += 1
+                self.setValue('Skipped sequencer recompilations', \
+                    self.skipped_sequencer_recompilations)
+            
+            self.runUploadTransaction(program_digest)
+            self.hardware_loop_key = hardware_loop_key
+        
+        # The waveforms of the loop are held by the instrument.
+        self.hardware_loop_waveforms = []
+        
+        self.setValue('Waveform bytes uploaded', \
+            self.uploaded_waveform_bytes)
+        self.setValue('Waveform samples changed', \
+            self.changed_waveform_samples)
     
-        # Perform a final check whether the sequencer has run out of memory
-        cache_utilisation = self.daq.getDouble( \
-            '/'+str(self.dev)+'/awgs/0/waveform/memoryusage')
+    
+    def writeHardwareLoopToMemory(self):
+        '''Upload the waveforms of every point of the hardware loop to the
+        slot of the point. The sequencer is expected to be halted, see
+        runHardwareLoop.
+        '''
         
-        if cache_utilisation > 0.9999:
-            if self.getValue('Halt on cache overflow'):
-                raise MemoryError( "The sequencer ran out of cache space "  + \
-                                   "("+str(cache_utilisation * 100.0)+"%)"  + \
-                                   ". Disable \'Halt on cache overflow\' "  + \
-                                   "or reduce waveform lengths to continue.")
-            else:
-                self.log(   "Warning: out of sequencer cache memory. " + \
-                            "Expect lower performance.", level=30)
-
-
+        for point in range(0, len(self.hardware_loop_waveforms)):
+            self.loaded_waveforms = list(self.hardware_loop_waveforms[point])
+            self.waveform_changed = [wave < self.highest_waveform_in_use \
+                for wave in range(0, self.n_ch)]
+            self.native_wave_index = point
+            self.native_waveform_uploaded = \
+                [False] * len(self.native_waveform_uploaded)
+            self.writeWaveformToMemory()
+        
+        self.waveform_changed = [False] * self.n_ch
+    
+    
     def writeWaveformToMemory(self):
-        ''' Upload waveform vector data to device memory.
+        ''' Upload waveform vector data to device memory. The sequencer is
+        expected to be halted, see runUploadTransaction.
         
-        TODO insert more description.
+        Uploads which fail are re-raised, once no transfer is ongoing.
         '''
         
         # Resetting the core and wave indices
@@ -2069,244 +3025,285 @@ class Driver(LabberDriver):
         # Acquiring package length
         n = self.buffer_length
         
-        # First, we disable the playback. # TODO necessary?
-        '''self.daq.setInt('/'+str(self.dev)+'/awgs/0/enable', 0)'''
-        
-        # In order to not crash the device, all waveforms must be uploaded
-        # interleaved except the last one if it's odd. Not used channels
-        # must also be declared as phantom waveforms up to the highest channel
-        # in use, causing a large waste of resources.
-        
-        # Upload waveform vector data, poll all channels pairwise.
-        # Remember that highest_waveform_in_use = 0 corresponds to no
-        # waveforms declared for playback, and 1 corresponds to update
-        # waveform 0 for channel 1. This way, this loop will not trigger
-        # when there are no waveforms to play back.
-        for channel in range(0, self.highest_waveform_in_use, 2):
-
-            # Upload waveforms?
-            if self.waveform_changed[channel] or \
-                self.waveform_changed[channel+1]:
-            
-                # Because the user may have changed the measurement range
-                # between the two measurement points in question,
-                # we must fetch and re-check both x1 and x2.
-                
-                # Reset flags:
-                self.waveform_changed[channel  ] = False
-                self.waveform_changed[channel+1] = False
-                
-                # Load waveforms channel and channel+1 for treatment
-                x1 = np.asarray( self.loaded_waveforms[channel  ] , dtype = float )
-                x2 = np.asarray( self.loaded_waveforms[channel+1] , dtype = float )
-                
-                # Get their lengths, used several times.
-                len_x1 = len(x1)
-                len_x2 = len(x2)
-                
-                # Get the output range of the channels. When running waves with
-                # 'Direct output' enabled, the output range is fixed to 800 mV.
-                # The direct output is known as 'Bypass DAC to port' in the
-                # instruction file due to repeated confusion in usage cases.
-                '''TODO This is unnecessary right? Since the instrument
-                and/or command automatically changes the output range when
-                the 'Direct mode' (Bypass) is in effect? Meaning that
-                first checking whether it is bypassed is unnecessary.'''
-                if not self.getValue( \
-                    'Channel %d - Bypass DAC to port' % (channel + 1)):
-                    output_range_x1 = float(self.getCmdStringFromValue( \
-                        'Channel %d - Range' % (channel + 1)))
-                else:
-                    output_range_x1 = 0.8
-                    
-                if not self.getValue( \
-                    'Channel %d - Bypass DAC to port' % (channel + 2)):
-                    output_range_x2 = float(self.getCmdStringFromValue( \
-                        'Channel %d - Range' % (channel + 2)))
-                else:
-                    output_range_x2 = 0.8    
-                
-                # Prepare mnemonic package
-                data = np.zeros((n, 3))
-                data[:len_x1, 0] = x1 / output_range_x1
-                data[:len_x2, 1] = x2 / output_range_x2
-                
-                assert np.max(abs(data[:,0])) <= 1, \
-                    "Halted. The HDAWG was tasked to play a value on "    + \
-                    "channel "+str(channel+1)+" larger than the "         + \
-                    "channel's range. The absolute value of the maximum " + \
-                    "was "+str(np.max(abs(x1)))+" V."
-                
-                assert np.max(abs(data[:,1])) <= 1, \
-                    "Halted. The HDAWG was tasked to play a value on "    + \
-                    "channel "+str(channel+2)+" larger than the "         + \
-                    "channel's range. The absolute value of the maximum " + \
-                    "was "+str(np.max(abs(x2)))+" V."
-                
-                # Convert the array data to an injectable data format.
-                
-                # The appropriate core index is hard-coded to 0 as we either
-                # replace the first waveform, or both the first and second
-                # waveform of the core in question. In both cases, the index
-                # should be 0.
-                
-                # Does the waveform contain markers? This check is done
-                # in order to speed up uploading, since most waveforms will
-                # not contain markers.
-                if self.waveform_has_markers[channel] or \
-                    self.waveform_has_markers[channel+1]:
-                
-                    # The waveform has associated marker data.
-                    # The promise up to this point is that this marker data
-                    # *must* be of the same length as the waveforms themselves.
-                    
-                    # Load associated marker data for treatment. Remember that
-                    # markers are stored per channel output, and contains both
-                    # available markers on that channel.
-                    
-                    # TODO THIS DOES NOT LOAD MARKER 2
-                    # TODO There is a mismatch in the marker data.
-                    #       There is a single spurious single datapoint that
-                    #       is left turned on.
-                    marker = 0
-                    x_marks = np.zeros(n)
-                    x_marks[int(self.marker_configuration[channel,marker,0]): int(self.marker_configuration[channel,marker,0])+int(self.marker_configuration[channel,marker,1])] = 1
-                    
-                    data[:, 2] = x_marks
-                    
-                    # TODO If ZI adds support for different-length upload packets,
-                    # then the marker data cannot be locked to be strictly the
-                    # length of the buffer.
-                    
-                    # Will there be an interleaved upload?
-                    # Note the optimisation:
-                    # if channel+1 <= self.highest_waveform_in_use-1:
-                    if channel <= self.highest_waveform_in_use-2:
-                        inject = \
-                            ziUtils.convert_awg_waveform(   wave1=data[:,0], \
-                                                            wave2=data[:,1], \
-                                                            markers=data[:,2])
-                    else:
-                        inject = \
-                            ziUtils.convert_awg_waveform(   wave1=data[:,0], \
-                                                            markers=data[:,2])
-                    
-                    try:
-                        # Set command basis
-                        base = '/%s/awgs/%d/' % (self.dev, core_index)
-                        
-                        # Inject the injectable data. Note that all uploads
-                        # whatsoever will be sent to wave index 0, even
-                        # interleaved ones.
-                        self.daq.setVector(base + 'waveform/waves/0', inject)
-                        
-                    
-                    except Exception as setVector_exception:
-                    
-                        # Get time of error
-                        error_timestamp = \
-                            (datetime.now()).strftime("%d-%b-%Y (%H:%M:%S)")
-                        self.log( "WARNING: There was an exception when "   +\
-                                  "attempting to upload waveforms (with "   +\
-                                  "markers) at time: "+\
-                                  error_timestamp, level=30)
-                
-                        # Get exception
-                        self.log( \
-                            "The exception was: " + str(setVector_exception),\
-                            level=30)
-                        
-                else:
-
-                    # The waveform does not have associated markers.
-                    # Perform normal upload.
-                
-                    # Will there be an interleaved upload?
-                    # Note the optimisation:
-                    # if channel+1 <= self.highest_waveform_in_use-1:
-                    if channel <= self.highest_waveform_in_use-2:
-                        inject = \
-                            ziUtils.convert_awg_waveform(   wave1=data[:,0], \
-                                                            wave2=data[:,1])
-                    else:
-                        inject = \
-                            ziUtils.convert_awg_waveform( wave1=data[:,0] )
-                    
-                    # Set command basis
-                    base = '/%s/awgs/%d/' % (self.dev, core_index)
-                    
-                    try:
-                        # Inject the injectable data. Note that all uploads
-                        # whatsoever will be sent to wave index 0, even
-                        # interleaved ones.
-                        self.daq.setVector(base + 'waveform/waves/0', inject)
-                    
-                    except Exception as setVector_exception:
-                    
-                        # Get time of error
-                        error_timestamp = \
-                            (datetime.now()).strftime("%d-%b-%Y (%H:%M:%S)")
-                        self.log( "WARNING: There was an exception when "  + \
-                                  "attempting to upload waveforms " + \
-                                  "(without markers) at time: " + \
-                                  error_timestamp, level=30)
-                
-                        # Get exception
-                        self.log( \
-                            "The exception was: " + str(setVector_exception), \
-                            level=30)
-            
+        # The waveforms of an AWG core are uploaded interleaved if both of
+        # its channels are in use, and as a single waveform if only one is.
+        # Channels not in use are not declared in the sequencer program, and
+        # cores without any channel in use are skipped altogether. The layout
+        # of every core must match the program, see generateSequencerProgram.
         
-            # Increase the core index for the next run of the for-loop
-            core_index += 1
+        # Every core is encoded on this thread, and transferred on the
+        # upload thread. Pipelining lets the encoding of the next core overlap
+        # the transfer of the previous one. Either way, there is only ever
+        # one ongoing call to the API session.
+        pipelined = self.getValue('Pipeline waveform uploads')
+        pending_uploads = []
         
-            # Attempt to enable instrument (even after injection failure).
-            remaining_enable_attempts = 3
-           
-            while remaining_enable_attempts >= 0:
-                try:                    
-                    # Re-enable the playback
-                    self.daq.setInt('/'+str(self.dev)+'/awgs/0/enable', 1)
+        try:
+        
+            # Upload waveform vector data, poll all channels pairwise.
+            # Remember that highest_waveform_in_use = 0 corresponds to no
+            # waveforms declared for playback, and 1 corresponds to update
+            # waveform 0 for channel 1. This way, this loop will not trigger
+            # when there are no waveforms to play back.
+            for channel in range(0, self.highest_waveform_in_use, 2):
                 
-                    # Success
-                    remaining_enable_attempts = -1
+                # Which channels of the core are in use? Every channel in
+                # use takes a lane of the native buffer of the core.
+                lanes = [lane_channel for lane_channel in [channel, channel+1] \
+                    if self.loaded_waveform_lengths[lane_channel] > 0]
                 
-                except Exception: # TODO define exception
-                    
-                    self.log( \
-                        "WARNING: setVector timeout. "   + \
-                        str(remaining_enable_attempts-1) + \
-                        " upload attempt(s) remaining.", level=30)
-                    remaining_enable_attempts -= 1
-                    time.sleep(5) # TODO is this waiting clause a valid tactic?
+                # Upload waveforms?
+                if any(self.waveform_changed[lane_channel] \
+                    for lane_channel in lanes):
                 
-                if remaining_enable_attempts == 0:
-                    
-                    # Shall we consider waiting for device to auto-restore?
-                    if self.getValue( \
-                        'Attempt API reconnection when the HDAWG crashes'):
-                        
-                        # Perform long wait.
-                        halt_time = self.getValue('Time to wait')
-                        
-                        self.log( + \
-                            "The measurement was halted by the instrument "  +\
-                            "driver for device \'"+self.dev_uppercase        +\
-                            "\' because the device crashed. The measurement" +\
-                            " will now wait for "+str(halt_time)+" seconds " +\
-                            "and attempt to reconnect to the ZI API.",level=30)
-                        
-                        time.sleep(halt_time)
-                        
-                        # Attempt to re-fetch the API.
-                        self.instantiateInstrumentConnection()
+                    # Does the waveform contain markers? This check is done
+                    # in order to speed up uploading, since most waveforms will
+                    # not contain markers.
+                    markers_included = any(self.waveform_has_markers[ \
+                        lane_channel] for lane_channel in lanes)
+                
+                    # The encoded native buffer of the core is kept between
+                    # uploads. Only if its layout changed must it be rebuilt
+                    # entirely, otherwise only the lanes of the changed channels
+                    # are re-encoded.
+                    layout = (n, tuple(lanes), markers_included)
+                    if self.native_layouts[core_index] != layout:
+                        self.native_waveforms[core_index] = np.zeros( \
+                            n * len(lanes), dtype = np.uint16)
+                        self.native_layouts[core_index] = layout
+                        self.native_ranges[core_index]  = [None, None]
+                        self.native_waveform_uploaded[core_index] = False
+                
+                    # Acquire the marker data of every lane, if any. Remember
+                    # that markers are stored per channel output, thus every
+                    # lane takes the markers of the channel it holds.
+                    if markers_included:
+                        marker_data = [self.fetchMarkerData(lane_channel, n) \
+                            for lane_channel in lanes]
+                    else:
+                        marker_data = [None] * len(lanes)
+                
+                    # Because the user may have changed the measurement range
+                    # between the two measurement points in question, we must
+                    # check the range of both x1 and x2. A lane is re-encoded if
+                    # either its waveform or its range changed.
+                    changed_samples = 0
+                    for lane in range(0, len(lanes)):
                     
-                    else:                
-                        raise RuntimeError( \
-                            "HDAWG \'"+self.dev_uppercase+"\' has crashed; the " + \
-                            "device does not respond to any calls from the PC. " + \
-                            "Consider restarting the device using the front button.")
+                        output_range = self.fetchOutputRange(lanes[lane])
                     
+                        if self.waveform_changed[lanes[lane]] or \
+                            (self.native_ranges[core_index][lane] != output_range):
+                        
+                            changed_samples += self.encodeNativeLane( \
+                                core_index, lane, lanes[lane], \
+                                output_range, marker_data[lane])
+                            self.native_ranges[core_index][lane] = output_range
+                
+                    # Reset flags:
+                    self.waveform_changed[channel  ] = False
+                    self.waveform_changed[channel+1] = False
+                
+                    # Upload the data to the core in question.
+                    pending_upload = self.uploadNativeWaveform( \
+                        core_index, changed_samples, markers_included)
+                
+                    if pending_upload is not None:
+                        pending_uploads.append(pending_upload)
+                        if not pipelined:
+                            self.finishNativeUpload(pending_uploads.pop())
+        
+                # Increase the core index for the next run of the for-loop
+                core_index += 1
+        
+        finally:
+            # Wait for the waveforms of all cores to land, also should
+            # something have failed. No transfer may be ongoing once the
+            # failure is handled, see runUploadTransaction.
+            upload_exceptions = []
+            for pending_upload in pending_uploads:
+                try:
+                    self.finishNativeUpload(pending_upload)
+                except Exception as upload_exception:
+                    upload_exceptions.append(upload_exception)
+        
+        if len(upload_exceptions) > 0:
+            raise upload_exceptions[0]
+    
+    
+    def fetchChannelsInUse(self):
+        '''Return the channels carrying waveform data, where 0 corresponds
+        to output 1. Only these channels are declared in the sequencer
+        program and hold waveform memory.
+        '''
+        
+        return [wave for wave in range(0, self.n_ch) \
+            if self.loaded_waveform_lengths[wave] > 0]
+    
+    
+    def fetchOutputRange(self, channel):
+        '''Return the output range (in volts) of channel 'channel', where
+        0 corresponds to output 1.
+        '''
+        
+        # Get the output range of the channel. When running waves with
+        # 'Direct output' enabled, the output range is fixed to 800 mV.
+        # The direct output is known as 'Bypass DAC to port' in the
+        # instruction file due to repeated confusion in usage cases.
+        '''TODO This is unnecessary right? Since the instrument
+        and/or command automatically changes the output range when
+        the 'Direct mode' (Bypass) is in effect? Meaning that
+        first checking whether it is bypassed is unnecessary.'''
+        if not self.getValue( \
+            'Channel %d - Bypass DAC to port' % (channel + 1)):
+            return float(self.getCmdStringFromValue( \
+                'Channel %d - Range' % (channel + 1)))
+        else:
+            return 0.8
+    
+    
+    def fetchMarkerData(self, channel, n):
+        '''Return the marker data of channel 'channel' as a vector of
+        length n, ready for the native AWG waveform format.
+        '''
+        
+        # The promise up to this point is that this marker data
+        # *must* be of the same length as the waveforms themselves.
+        
+        # TODO THIS DOES NOT LOAD MARKER 2
+        # TODO There is a mismatch in the marker data.
+        #       There is a single spurious single datapoint that
+        #       is left turned on.
+        marker = 0
+        x_marks = np.zeros(n, dtype = np.uint16)
+        x_marks[int(self.marker_configuration[channel,marker,0]): int(self.marker_configuration[channel,marker,0])+int(self.marker_configuration[channel,marker,1])] = 1
+        
+        # TODO If ZI adds support for different-length upload packets,
+        # then the marker data cannot be locked to be strictly the
+        # length of the buffer.
+        
+        return x_marks
+    
+    
+    def encodeNativeLane(self, core_index, lane, channel, output_range, \
+                         marker_data = None):
+        '''Encode the waveform of channel 'channel' into lane 'lane' (0 or 1)
+        of the native buffer kept for AWG core 'core_index', in place.
+        
+        Returns the amount of samples spanned by the changes made to the
+        lane, 0 meaning that the lane content did not change.
+        '''
+        
+        native = self.native_waveforms[core_index]
+        n = self.native_layouts[core_index][0]
+        
+        # Load the waveform for treatment, scaled to the output range.
+        x = np.asarray(self.fetchLoadedWaveform(channel), dtype = float)
+        scaled = np.zeros(n)
+        scaled[:len(x)] = x / output_range
+        
+        assert np.max(abs(scaled)) <= 1, \
+            "Halted. The HDAWG was tasked to play a value on "    + \
+            "channel "+str(channel+1)+" larger than the "         + \
+            "channel's range. The absolute value of the maximum " + \
+            "was "+str(np.max(abs(x)))+" V."
+        
+        # Convert the array data to an injectable data format. The marker
+        # data is that of the channel held by the lane, see fetchMarkerData.
+        if marker_data is None:
+            lane_words = ziUtils.convert_awg_waveform(wave1 = scaled)
+        else:
+            lane_words = ziUtils.convert_awg_waveform( \
+                wave1 = scaled, markers = marker_data)
+        
+        # Interleaved buffers hold every other word per lane.
+        stride = len(self.native_layouts[core_index][1])
+        native_lane = native[lane::stride]
+        
+        changed_words = np.flatnonzero(native_lane != lane_words)
+        if len(changed_words) == 0:
+            return 0
+        
+        native_lane[:] = lane_words
+        
+        return int(changed_words[-1] - changed_words[0] + 1)
+    
+    
+    def uploadNativeWaveform(self, core_index, changed_samples, \
+                             markers_included):
+        '''Start uploading the native buffer of an AWG core to its wave
+        index 0 (or to the wave index of a waveform library slot), on the
+        upload thread.
+        
+        Should the buffer be unchanged since it was last uploaded, the
+        upload is skipped altogether and None is returned. The waveform
+        nodes of the ZI API do not accept writes at an offset, hence changed
+        data is always uploaded as a whole buffer.
+        
+        Otherwise, the pending upload is returned. It must be handed to
+        finishNativeUpload before the native buffer is modified again.
+        '''
+        
+        # Nothing changed, skip the upload.
+        if (changed_samples == 0) and \
+            self.native_waveform_uploaded[core_index]:
+            return None
+        
+        # Inject the injectable data. Note that all uploads
+        # whatsoever will be sent to wave index 0, even
+        # interleaved ones. In waveform library mode, the uploads
+        # are sent to the wave index of the library slot instead.
+        transfer = self.upload_pool.submit(self.daq.setVector, \
+            '/%s/awgs/%d/waveform/waves/%d' % \
+                (self.dev, core_index, self.native_wave_index), \
+            self.native_waveforms[core_index])
+        
+        return (core_index, changed_samples, markers_included, transfer)
+    
+    
+    def finishNativeUpload(self, pending_upload):
+        '''Wait for an upload started by uploadNativeWaveform to finish.
+        
+        The amount of bytes transferred and samples changed are added to
+        the upload counters reported at the end of every final call. Should
+        the upload have failed, the exception is logged and re-raised.
+        '''
+        
+        core_index, changed_samples, markers_included, transfer = \
+            pending_upload
+        inject = self.native_waveforms[core_index]
+        
+        try:
+            # Any exception raised by setVector is raised here.
+            transfer.result()
+            
+            # Keep a record of what was uploaded.
+            self.native_waveform_uploaded[core_index] = True
+            self.uploaded_waveform_bytes  += inject.nbytes
+            self.changed_waveform_samples += changed_samples
+        
+        except Exception as setVector_exception:
+            
+            # The content of the core's memory is now unknown.
+            self.native_waveform_uploaded[core_index] = False
+            
+            # Get time of error
+            error_timestamp = \
+                (datetime.now()).strftime("%d-%b-%Y (%H:%M:%S)")
+            self.log( "WARNING: There was an exception when "  + \
+                      "attempting to upload waveforms " + \
+                      ("(with markers)" if markers_included else \
+                       "(without markers)") + " at time: " + \
+                      error_timestamp, level=30)
+            
+            # Get exception
+            self.log( \
+                "The exception was: " + str(setVector_exception), \
+                level=30)
+            
+            # The upload transaction decides whether to re-attempt.
+            raise
+    
     
     def fetchAndAssembleWaveform(self, wave):
         '''TODO
@@ -2319,6 +3316,11 @@ class Driver(LabberDriver):
         Hence, the solution was to assemble primitives before simply uploading
         the finished segment as a flat waveform.
         
+        Assembled waveforms are cached per channel. The cache is keyed on the
+        blueprint and on the digests of the primitives that the blueprint
+        references, meaning that a channel is only re-assembled when one of
+        its inputs changed.
+        
         '''
         
         # We have received a request to assemble waveform 'wave.'
@@ -2326,11 +3328,22 @@ class Driver(LabberDriver):
         blueprint = \
             self.getValueArray('Waveform '+str(wave+1)+' sequence blueprint')
         
-        # Prepare waveform for assembly
-        assembled_waveform = []
-        
         if len(blueprint) > 0: # TODO is it possible that Labber returns a [None] at this stage?
             
+            # Fetch the primitives referenced by the blueprint, and
+            # figure out whether this very assembly has been made before.
+            blueprint = [int(entry) for entry in blueprint]
+            assembly_key = (tuple(blueprint), tuple( \
+                self.fetchWaveformPrimitive(primitive)[0] \
+                    for primitive in blueprint[1::2]))
+            
+            cached_assembly = self.assembly_cache[wave]
+            if (cached_assembly is not None) and \
+                (cached_assembly[0] == assembly_key):
+                
+                # Nothing changed, return the previous assembly.
+                return cached_assembly[1]
+            
             # There is a blueprint, assemble the waveform.
             # The syntax of the blueprint is:
             # [S1, P1, S2, P2, S3, P3] where for Blueprint X (1...n_ch) -
@@ -2345,13 +3358,16 @@ class Driver(LabberDriver):
             # Result 7: [0 0 0 0.313 0.13 0.313 0.13 0 0 3.13 31.3 0 0 0.3]
             
             # For blueprint X, [insert Y zeroes, insert primitive Z ...]
-            for i in range(0,len(blueprint),2):
-                assembled_waveform.extend([0] * blueprint[i])
-                assembled_waveform.extend( \
-                    self.getValueArray( \
-                        'Waveform primitive '+str(blueprint[i+1]+1) \
-                    ) \
-                )
+            assembled_waveform = self.assembleBlueprintWaveform( \
+                blueprint, \
+                [self.fetchWaveformPrimitive(primitive)[1] \
+                    for primitive in blueprint[1::2]] \
+            )
+            
+            # Store the assembly. The digest entry is filled in by
+            # fetchWaveformDigest once it has been calculated.
+            self.assembly_cache[wave] = \
+                [assembly_key, assembled_waveform, None]
         
         else:
             
@@ -2363,6 +3379,96 @@ class Driver(LabberDriver):
         return assembled_waveform
     
     
+    def assembleBlueprintWaveform(self, blueprint, primitives):
+        '''Assemble a waveform from a blueprint [S1, P1, S2, P2, ...] and
+        the list of primitive data [data of P1, data of P2, ...].
+        
+        The total length is calculated up front, and the primitives are then
+        written into a single preallocated float64 array. The zero-valued
+        gaps are provided by the preallocation itself.
+        '''
+        
+        # Get the gap and primitive lengths, and thus the total length.
+        gaps    = blueprint[0::2]
+        lengths = [len(primitive_data) for primitive_data in primitives]
+        
+        assembled_waveform = \
+            np.zeros(sum(gaps) + sum(lengths), dtype = np.float64)
+        
+        # Insert the primitives at their respective positions.
+        position = 0
+        for i in range(0, len(lengths)):
+            position += gaps[i]
+            assembled_waveform[position : position + lengths[i]] = \
+                primitives[i]
+            position += lengths[i]
+        
+        return assembled_waveform
+    
+    
+    def fetchWaveformPrimitive(self, primitive):
+        '''Return a tuple of the digest and the data of waveform primitive
+        'primitive', where 0 corresponds to 'Waveform primitive 1'.
+        
+        Every primitive is fetched and hashed at most once per final call,
+        no matter how many blueprints reference it.
+        '''
+        
+        if not primitive in self.fetched_primitives:
+            primitive_data = self.getValueArray( \
+                'Waveform primitive '+str(primitive+1))
+            self.fetched_primitives[primitive] = \
+                (self.hashWaveform(primitive_data), primitive_data)
+        
+        return self.fetched_primitives[primitive]
+    
+    
+    def fetchWaveformDigest(self, wave, waveform):
+        '''Return the digest of a waveform fetched for channel 'wave'.
+        
+        Waveforms served from the assembly cache reuse the digest calculated
+        when the waveform was first assembled, an unchanged channel is thus
+        not re-hashed.
+        '''
+        
+        cached_assembly = self.assembly_cache[wave]
+        if (cached_assembly is not None) and (cached_assembly[1] is waveform):
+            if cached_assembly[2] is None:
+                cached_assembly[2] = self.hashWaveform(waveform)
+            return cached_assembly[2]
+        
+        return self.hashWaveform(waveform)
+    
+    
+    def fetchLoadedWaveform(self, wave):
+        '''Return the waveform data currently loaded for channel 'wave'.
+        
+        Should the driver have been told not to retain copies of the loaded
+        waveforms, the waveform is re-assembled from the values held by the
+        instrument server.
+        '''
+        
+        if self.loaded_waveforms[wave] is None:
+            return self.fetchAndAssembleWaveform(wave)
+        
+        return self.loaded_waveforms[wave]
+    
+    
+    def hashWaveform(self, waveform):
+        '''Return a digest identifying the content of a waveform.
+        
+        The digest is a tuple of the waveform length and a BLAKE2b hash of
+        its float64 sample buffer. Two waveforms with equal digests are
+        considered equal, which replaces the element-wise comparison against
+        a stored copy of the previously loaded waveform.
+        '''
+        
+        samples = np.ascontiguousarray(waveform, dtype = np.float64)
+        
+        return (len(samples), \
+            hashlib.blake2b(samples, digest_size = 16).digest())
+    
+    
     #####################################################
     """ Check validness of requested repetition delay """
     #####################################################
@@ -2470,8 +3576,7 @@ class Driver(LabberDriver):
         
         # How much time is spent playing waveforms? We require the buffer
         # length and the amount of currently playing waves. The latter is
-        # solved by observing self.highest_waveform_in_use. Remember that
-        # if no waveform is declared, highest_waveform_in_use = 0.
+        # solved by counting the channels in use, see fetchChannelsInUse.
         # The 2* factor stems from 2 sequencer cycles being added for every
         # declared waveform in the sequencer program. This in turn stems
         # from playWave, where two arguments (one cycle each) are required
@@ -2479,7 +3584,7 @@ class Driver(LabberDriver):
         
         time_for_playing_waveforms = \
             (self.buffer_length / sample_rate) + \
-            2 * (self.highest_waveform_in_use / sequencer_clk)
+            2 * (len(self.fetchChannelsInUse()) / sequencer_clk)
         
         # Perform the final check
         internal_delay_period = \
@@ -2605,94 +3710,139 @@ class Driver(LabberDriver):
             waveform_declaration_setup = ''
             playwave_setup = ''
             
-            # Should we place commas between waveforms?
-            first_waveform_declared = False
+            # Only the channels carrying waveform data are declared. Unused
+            # channels are left out of the program, and hold no waveform
+            # memory. See fetchChannelsInUse.
+            channels_in_use = self.fetchChannelsInUse()
+            
+            # What waveforms should be declared with a marker? The channels
+            # in use of an AWG core are uploaded with markers if any of them
+            # has markers, see writeWaveformToMemory.
+            self.declare_marker = [False] * self.n_ch
+            for n in channels_in_use:
+                core_channel = n - (n % 2)
+                self.declare_marker[n] = any(self.waveform_has_markers[ \
+                    lane_channel] for lane_channel in channels_in_use \
+                        if lane_channel - (lane_channel % 2) == core_channel)
             
             # Should there be a marker declaration in the beginning?
-            if any(self.waveform_has_markers):
+            if any(self.declare_marker):
                 
                 # Add marker declaration.
                 waveform_declaration_setup += \
                     'wave w_m = marker({0}, 1);\n'.format(self.buffer_length)
-                    
             
-            # What waveforms should be declared with a marker?
-            self.declare_marker = [False] * self.n_ch
-            for n in range(0, self.highest_waveform_in_use, 2):
-                
-                # For all channels
-                if n < self.highest_waveform_in_use-1:
-                    if self.waveform_has_markers[n] or self.waveform_has_markers[n+1]:
-                        self.declare_marker[n]   = True
-                        self.declare_marker[n+1] = True
-                
-                elif n == self.highest_waveform_in_use-1:
-                    # But, if this waveform is the highest waveform in use,
-                    # and the following (non-existant) waveform has marker
-                    # data, then do not declare markers on the higher part
-                    # of the waveform pair.
-                    
-                    if self.waveform_has_markers[n]:
-                        self.declare_marker[n]   = True
-                    
-                    
-                    
+            # In waveform library mode, every slot of the library declares a
+            # set of waveforms of its own. See fetchLibrarySlot. A hardware
+            # loop holds every point of the loop in a slot of its own.
+            if self.hardware_loop_length > 0:
+                library = True
+                self.library_slot_count = self.hardware_loop_length
+            else:
+                library = self.getValue('Waveform library')
+                self.library_slot_count = \
+                    self.fetchLibrarySlotCount() if library else 1
+            playwave_setups = []
             
-            # How many waveforms should be declared?
-            # Remember that self.highest_waveform_in_use = 0 corresponds to no
-            # waveforms declared.
-            for n in range(0, self.highest_waveform_in_use):
+            for slot in range(0, self.library_slot_count):
+                
+                # Library waveforms are named by their slot. They are
+                # declared using randomUniform, as the compiler may otherwise
+                # merge the identical slots into a single waveform. See the
+                # note on zeros below.
+                if library:
+                    suffix = '_' + str(slot)
+                    initial_wave = \
+                        'randomUniform({0},1e-4)'.format(self.buffer_length)
+                else:
+                    suffix = ''
+                    initial_wave = 'zeros({0})'.format(self.buffer_length)
+                
+                # Should we place commas between waveforms?
+                first_waveform_declared = False
+                playwave_setup = ''
+            
+                # Declare the waveforms of the channels in use. An AWG core
+                # with a single channel in use plays a single waveform.
+                for n in channels_in_use:
                 
-                # Is this waveform wasted? If len > 0, then no.
-                if len(self.loaded_waveforms[n]) > 0:
-                    
                     # TODO This here below is a variant waveform
                     # declaration using randomUniform. I've been told that
                     # using zeros might cause unwanted optimisation in the
                     # SeqC compiler, so that for instance the setVector
                     # command would not be able to correctly upload
                     # waveforms.
-                    
+                
                     #   'wave w{0} = randomUniform({1},1e-4) + m1;\n'\
                     #       .format(n+1, self.buffer_length)
-                    
+                
                     if(self.declare_marker[n]):
                         waveform_declaration_setup += \
-                            'wave w{0} = zeros({1}) + w_m;\n'\
-                                .format(n+1, self.buffer_length)
+                            'wave w{0}{1} = {2} + w_m;\n'\
+                                .format(n+1, suffix, initial_wave)
                     else:
                         waveform_declaration_setup += \
-                            'wave w{0} = zeros({1});\n'\
-                                .format(n+1, self.buffer_length)
-                        
-                else:
-                    
-                    # Waveform is wasted. Add markers or not?
-                    if(self.declare_marker[n]):
-                        waveform_declaration_setup += \
-                            'wave w{0} = zeros({1}) + w_m; // Unused.\n'\
-                                .format(n+1, self.buffer_length)
+                            'wave w{0}{1} = {2};\n'\
+                                .format(n+1, suffix, initial_wave)
+                
+                    # Waveform initial declaration / generation
+                    if first_waveform_declared:
+                        playwave_setup += ', {0}, w{0}{1}'.format(n+1, suffix)
+                
                     else:
-                        waveform_declaration_setup += \
-                            'wave w{0} = zeros({1}); // Unused.\n'\
-                                .format(n+1, self.buffer_length)
+                        # Declare the first waveform for playback
+                        playwave_setup += '{0}, w{0}{1}'.format(n+1, suffix)
+                        first_waveform_declared = True
+                
+                playwave_setups.append(playwave_setup)
+            
+            # The library register selects the slot to play. The compiler
+            # does not number the waveforms of switch cases in any given
+            # order, thus slot s is assigned wave index s of every AWG core
+            # explicitly. The uploads go to native_wave_index = slot.
+            self.library_active = library and (playwave_setup != '')
+            if self.library_active:
                 
-                # Waveform initial declaration / generation
-                if first_waveform_declared:
-                    playwave_setup += ', {0}, w{0}'.format(n+1)
+                for slot in range(0, self.library_slot_count):
+                    waveform_declaration_setup += \
+                        'assignWaveIndex({0}, {1});\n'.format( \
+                            playwave_setups[slot], slot)
                 
+                # In a hardware loop, the sequencer advances to the slot of
+                # the next point by itself, once for every repetition of the
+                # program loop. Thus, every trigger plays the next point.
+                if self.hardware_loop_length > 0:
+                    waveform_declaration_setup += 'var point = 0;\n'
+                    playwave_setup = '\tswitch(point){\n'
                 else:
-                    # Declare the first waveform for playback
-                    playwave_setup += '{0}, w{0}'.format(n+1)
-                    first_waveform_declared = True
-
+                    playwave_setup = '\tswitch(getUserReg({0})){{\n'.format( \
+                        int(self.getCmdStringFromValue( \
+                            'Waveform library register')))
+                
+                for slot in range(0, self.library_slot_count):
+                    playwave_setup += '\t\tcase {0}: playWave({1});\n'.format( \
+                        slot, playwave_setups[slot])
+                playwave_setup += '\t}\n'
+                
+                if self.hardware_loop_length > 0:
+                    playwave_setup += '\tpoint = point + 1;\n' + \
+                        '\tif (point == {0}) {{\n\t\tpoint = 0;\n\t}}\n'.format( \
+                            self.hardware_loop_length)
+            
+            elif playwave_setup != '':
+                playwave_setup = '\tplayWave('+playwave_setup+');\n'
+            
+            # Until the library is active, uploads go to wave index 0.
+            if not self.library_active:
+                self.native_wave_index = 0
+            
             # The condition for checking the waveform declaration is covered
             # by the playwave setup condition, thus the actions have been
             # combined.
             if playwave_setup != '':
                 self.local_awg_program.update({ \
                     'WAVEFORM_DECLARATION':waveform_declaration_setup + '\n', \
-                    'PLAYWAVE':'\tplayWave('+playwave_setup+');\n', \
+                    'PLAYWAVE':playwave_setup, \
                     'WAITWAVE':'\twaitWave();\n'})
             else:
                 # There are no waves to play, remove all instances related
@@ -3006,6 +4156,91 @@ class Driver(LabberDriver):
 
         assert halt_after_write == False, "Wrote list to file!"
         
+###############################
+""" Timing of sweep points. """
+###############################
+
+class PhaseTimer(object):
+    '''Record the durations of the phases of a sweep point, such as
+    compiling or uploading waveforms, using the monotonic clock.
+    
+    Every phase has a histogram of its durations, with bins of a quarter
+    decade from 10 us up. Shorter and longer durations are counted in the
+    first and last bin. Optionally, every recorded span is appended to a
+    trace file, as one JSON object per line.
+    '''
+    
+    # The histogram bins, in log10 of the duration in seconds.
+    histogram_start = -5.0
+    histogram_step  = 0.25
+    histogram_bins  = 28
+    
+    def __init__(self, phases):
+        self.phases = list(phases)
+        self.point = 0
+        self.trace_path = None
+        self.trace_file = None
+        self.reset()
+    
+    def reset(self):
+        '''Clear the durations recorded so far.'''
+        
+        self.histograms = {phase: np.zeros(self.histogram_bins) \
+            for phase in self.phases}
+        self.last_durations  = {phase: 0.0 for phase in self.phases}
+        self.total_durations = {phase: 0.0 for phase in self.phases}
+        self.counts          = {phase: 0   for phase in self.phases}
+    
+    def beginPoint(self):
+        '''Mark the start of a new sweep point in the trace.'''
+        
+        self.point += 1
+    
+    @contextlib.contextmanager
+    def span(self, phase):
+        '''Record the duration of the enclosed block as one span of phase.
+        Spans are recorded even if the block raises.
+        '''
+        
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(phase, start, time.monotonic() - start)
+    
+    def record(self, phase, start, duration):
+        '''Record a span of phase, started at the monotonic time start.'''
+        
+        bin_index = int((np.log10(max(duration, 1e-12)) - \
+            self.histogram_start) // self.histogram_step)
+        self.histograms[phase][ \
+            min(max(bin_index, 0), self.histogram_bins - 1)] += 1
+        
+        self.last_durations[phase]   = duration
+        self.total_durations[phase] += duration
+        self.counts[phase]          += 1
+        
+        if self.trace_file is not None:
+            self.trace_file.write(json.dumps({'point': self.point, \
+                'phase': phase, 'start': start, 'duration': duration}) + '\n')
+    
+    def setTraceFile(self, path):
+        '''Append the spans to the file at path, or stop tracing if path
+        is None or empty. The file is only reopened if path changes.
+        '''
+        
+        path = path or None
+        if path == self.trace_path:
+            return
+        
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+        
+        self.trace_path = path
+        if path is not None:
+            self.trace_file = open(path, 'a')
+
 ####################################
 """ Miscellaneous functionality. """
 ####################################
@@ -5,14 +5,14 @@
 
 # Needed for other rudimentaries
 from __future__ import print_function
+import contextlib
+import json
 import os
-import re
 import pydoc
 import random
 import sys
 import numpy as np
 import time
-import textwrap
 from BaseDriver import LabberDriver, Error, IdError
 
 # Import ziPython from a relative path independent of system installation
@@ -26,6 +26,9 @@ import zhinst.utils as ziUtils
 # Actual class definition: class Driver(InstrumentDriver.InstrumentWorker):
 class Driver(LabberDriver):
 
+    # The phases of a sweep point whose durations are recorded, in the
+    # order of the 'Timing phase' combo box. See PhaseTimer.
+    timed_phases = ['Compile', 'ELF upload', 'Waveform upload', 'Enable', 'Scope wait', 'Scope read', 'Averaging']
 
     """
 ###############################################################################
@@ -100,17 +103,22 @@ class Driver(LabberDriver):
         # Do not omit this step unless you know what you are doing.
         # self.scopeModule.execute()
 
+        # Record the durations of the phases of every sweep point
+        self.phase_timer = PhaseTimer(self.timed_phases)
+
+        # Prepare the routing of quantities to their set and get functions
+        self.buildQuantityRoutes()
+
         # Clear any/sporadically loaded waveform data
         self.loaded_waveform_1 = None
         self.loaded_waveform_2 = None
 
+        # No program has been compiled by this driver so far
+        self.compiled_awg_program = None
+
         # Generate a default AWG program
-        # TODO: import the vectorWrite functionality from the HDAWG driver.
         self.generateLocalAwgProgram()
 
-        # Generate a default padding value
-        self.padding = 0
-
         # Generate a default state of AWG waveform playback
         self.AWG_plays_back_internally = 0
 
@@ -120,6 +128,7 @@ class Driver(LabberDriver):
         # Generate default values for the two fetched channels
         # TODO: this depends on the amount of available channels right?
         self.acquired_data = [None, None]
+        self.acquired_variance = [None, None]
 
         # Set up the data collection based on what channels are "activated"
         # Leave some time for the variables to take effect in the instruments.
@@ -158,167 +167,26 @@ class Driver(LabberDriver):
         except UnboundLocalError:
             raise 'Could not close the device. There is likely no connection to the API.'
 
+        # Close the timing trace file, if any
+        self.phase_timer.setTraceFile(None)
+
 
     def performSetValue(self, quant, value, sweepRate=0.0, options={}):
         """Perform the Set Value instrument operation. This function should
         return the actual value set by the instrument"""
 
-        # Booleans
-        # TODO how many scopes there are depends on installed options. Range should be 2.
-        # TODO how many channels there are depends on installed options. Range should be something like 8
-        # TODO single shot should be automatically set to zero when the scope triggers (Deprecated?)
-        if quant.name in ['SigOut1On','SigOut2On'] + \
-                         ['ImpedanceFifty1On','ImpedanceFifty2On'] + \
-                         ['EnableScope'+str(x+1) for x in range(2)] + \
-                         ['Force Scope '+str(x+1) for x in range(2)] + \
-                         ['SingleShotScope'+str(x+1) for x in range(1)] + \
-                         ['TriggerEnabledScope'+str(x+1) for x in range(1)] + \
-                         ['Auto Threshold Input '+str(x+1) for x in range(4)] + \
-                         ['Auto Range Input '+str(x+1) for x in range(2)] + \
-                         ['ACSigIn'+str(x+1) for x in range(2)] + \
-                         ['FiftyOhmSigIn'+str(x+1) for x in range(2)] + \
-                         ['HysteresisMode'+str(x+1) for x in range(2)]:
-            self.api_session.setInt(str(quant.get_cmd % self.dev), 1 if value else 0)
-
-        # Simple floating points
-        elif quant.name in ['TriggerVoltageScope'+str(x+1) for x in range(1)] + \
-                           ['RangeSigIn'+str(x+1) for x in range(2)] + \
-                           ['SampleLengthScope'+str(x+1) for x in range(1)] + \
-                           ['ScalingSigIn'+str(x+1) for x in range(2)] + \
-                           ['Oscillator'+str(x+1) for x in range(2)] + \
-                           ['TriggerDelayScope'+str(x+1) for x in range(2)] + \
-                           ['TriggerHoldoffScope'+str(x+1) for x in range(2)] + \
-                           ['AmplitudeOutput'+str(x+1)+'AWG' for x in range(2)] + \
-                           ['UserRegister'+str(x+1) for x in range(16)]:
-            self.api_session.setDouble(str(quant.get_cmd % self.dev), float(value))
-
-        # Combos
-        # TODO SignalSourceChannel is specific and not generic, fix it.
-        elif quant.name in ['TriggerFlankScope'+str(x+1) for x in range(1)] + \
-                           ['SignalSourceChannel'+str(x+1)+'Scope1' for x in range(2)] + \
-                           ['SamplingRateScope'+str(x+1) for x in range(1)] + \
-                           ['TriggerSourceScope'+str(x+1) for x in range(1)] + \
-                           ['TriggerFlankScope'+str(x+1) for x in range(1)] + \
-                           ['DiffSigIn'+str(x+1) for x in range(2)] + \
-                           ['ModeOutput'+str(x+1)+'AWG' for x in range(2)] + \
-                           ['TriggerSourceAnalogue'+str(x+1)+'AWG' for x in range(2)] + \
-                           ['TriggerSourceDigital'+str(x+1)+'AWG' for x in range(2)] + \
-                           ['SlopeDigital'+str(x+1)+'AWG' for x in range(2)] + \
-                           ['OutputSamplingRateAWG']:
-            # Convert input to integer
-            intValue = int(quant.getCmdStringFromValue(value))
-            self.api_session.setInt(str(quant.get_cmd % self.dev), intValue)
-
-        # Output signal range-related combos
-        elif quant.name in ['RangeSigOut1']:
-            # First, we must establish if we are in HiZ-mode or not
-            if self.api_session.getInt('/'+self.dev+'/sigouts/0/imp50'):
-                doubleValue = float(quant.getCmdStringFromValue(value))
-            else:
-                doubleValue = float(quant.getCmdStringFromValue(value))*2.0
-            self.api_session.setDouble(str(quant.get_cmd % self.dev), doubleValue)
-            self.local_awg_program = re.sub('const RSC = 1/[^;]+; // Range scaling', 'const RSC = 1/'+quant.getCmdStringFromValue(value)+'; // Range scaling', self.local_awg_program)
-
-        elif quant.name in ['RangeSigOut2']:
-            # First, we must establish if we are in HiZ-mode or not
-            if self.api_session.getInt('/'+self.dev+'/sigouts/1/imp50'):
-                doubleValue = float(quant.getCmdStringFromValue(value))
-                # TODO channel 2?
-            else:
-                doubleValue = float(quant.getCmdStringFromValue(value))*2.0
-                # TODO channel 2?
-            self.api_session.setDouble(str(quant.get_cmd % self.dev), doubleValue)
-
-        # Integer values that use floats for setting parameters in the server
-        #elif quant.name in ['SampleLengthScope'+str(x+1) for x in range(1)]:
-        #    self.api_session.setDouble(str(quant.get_cmd % self.dev), value*1.0)
-
-        # awgModule-related Booleans
-        elif quant.name in ['EnableAWG']:
-            self.awgModule.set(str(quant.get_cmd), 1 if value else 0)
-
-        # ... awgModule-related ANTI-Booleans
-        elif quant.name in ['EnableRerunAWG']:
-            self.api_session.setInt(str(quant.get_cmd % self.dev), 0 if value else 1)
-
-        # DIO- and output DC-offset related floats
-        elif quant.name in ['ManualThresholdRefTrigInput'+str(x+1) for x in range(4)] + \
-                           ['OffsetSigOut'+str(x+1) for x in range(2)]:
-
-            # Fix click-box incrementation being overridden by LabOne
-            # TODO there should be some while-loop or similar for setting
-            # and getting values in increments of 1.25% until the changes are
-            # legal according to the server. (Deprecated?)
-
-            #new_val = float(value)
-            #old_val = self.api_session.getDouble(str(quant.get_cmd % self.dev))
-            #if (old_val < new_val): # TODO while-loop
-            #new_val = float(value)
-            #new_value = new_val-new_val*1.05
-
-            self.api_session.setDouble(str(quant.get_cmd % self.dev), float(value))
-            value = self.api_session.getDouble(str(quant.get_cmd % self.dev))
-
-        # Scope hysteresis-related doubles
-        # TODO so what is the best way to force an update of another value? (in Labber?)
-        elif quant.name in ['TriggerHysteresisScope'+str(x+1) for x in range(2)]:
-            self.api_session.setInt('/'+self.dev+'/scopes/0/trighysteresis/mode', 0) # TODO this should fetch the current scope in question.
-            self.api_session.setDouble(str(quant.get_cmd % self.dev), float(value))
-            value = self.api_session.getDouble(str(quant.get_cmd % self.dev))
-        elif quant.name in ['RelativeTriggerHysteresisScope'+str(x+1) for x in range(2)]:
-            self.api_session.setInt('/'+self.dev+'/scopes/0/trighysteresis/mode', 1) # TODO this should fetch the current scope in question.
-            self.api_session.setDouble(str(quant.get_cmd % self.dev), float(value)/100.0)
-            value = self.api_session.getDouble(str(quant.get_cmd % self.dev))*100.0
-
-        # Percentage-related floats
-        elif quant.name in ['TriggerReferenceScope'+str(x+1) for x in range(2)]:
-            self.api_session.setDouble(str(quant.get_cmd % self.dev), float(value)/100.0)
-
-        # Factory reset etc.
-        elif quant.name in ['I messed up...']:
-            ziUtils.disable_everything(self.api_session, self.dev)
-
-        # Compile and upload
-        elif quant.name in ['Compile and upload']:
-            self.compileAndUploadSourceString()
-
-        # Insert Labber data vector into local program
-        elif quant.name in ['Insert into program']:
-            self.loadLabberVectorIntoProgram(0)
-            self.loadLabberVectorIntoProgram(1)
-
-        # Clear local AWG program
-        elif quant.name in ['Clear local AWG program']:
-            self.generateLocalAwgProgram()
-
-        # Loaded vector playback rate related commands
-        elif quant.name in ['LoadedVectorPlaybackRate'] + \
-                           ['UseInternalVectorPlaybackRate']:
-            value = self.localProgramPlayback(str(quant.get_cmd),value)
-
-        # Commands related to amount of records to average every run
-        elif quant.name in ['RecordAmountToAverage']:
-            self.amountOfRecordsToAverage = int(value)
-
-        # Simple signal generator-related commands
-        elif quant.name in ['SimpleSigGenLoop','SimpleSigGenAwgPoints'] + \
-                           ['SimpleSigGenAmplitude']:
-            value = self.simpleSignalGenerator(str(quant.get_cmd),value)
-        elif quant.name in ['SimpleSigGenWaveformType']:
-            # Convert input to integer
-            intValue = int(quant.getCmdStringFromValue(value))
-            value = self.simpleSignalGenerator(str(quant.get_cmd), intValue)
-
-        # Acquire data per scope
-        elif quant.name in ['Acquire data using scope '+str(x+1) for x in range(2)]:
-            pass
-            # self.runScopeDataAcquisition(0,2.0) # TODO acquire time-out from the user (Labber instrument server)
-            # self.setValue('ScopedVector1',self.acquired_data.get('wave')) # Set as Y-axis in a Labber vector
-
+        # Route the quantity to its set function, see buildQuantityRoutes.
+        # Quantities without a set function are merely stored by Labber.
+        route = self.set_routes.get(quant.name)
+        if route is not None:
+            value = route(quant, value)
 
         # Final call check
         if self.isFinalCall(options):
-            pass
+
+            # Number the sweep point in the timing trace, if requested
+            self.phase_timer.setTraceFile(self.getValue('Timing trace file') if self.getValue('Write timing trace') else None)
+            self.phase_timer.beginPoint()
 
             # self.loaded_waveform = self.getValueArray('LoadedVector')
             # np.savetxt("C:/Users/qtlab/Desktop/Vectordumps/Vectordump"+str(self.iteratorTODODEBUG)+".txt", self.loaded_waveform) # TODO DEBUG
@@ -362,215 +230,417 @@ class Driver(LabberDriver):
         """Perform the Get Value instrument operation. This function should
         return the actual value set by the instrument"""
 
+        # Route the quantity to its get function, see buildQuantityRoutes.
+        route = self.get_routes.get(quant.name)
+        if route is not None:
+            return route(quant)
+
+        return quant.getValue()
+
+    # Acquire data from the scoped channels
+    def getScopedVector(self, quant):
+
+        self.log('UHFQA MEAS START RATO: '+str(self.amountOfRecordsToAverage)+' Get scoped vector aka a measurment',level=30)
+        # TODO Very important, does the /scopes/0/channel need to be configured (to for instance 3) in order to actually acquire data from channel 1 and 2 into the 'wave' dict?
+        # (Deprecated?)
+
+        self.log('A ScopedVector GET is running.',level=30)
+        requested_channel = int(quant.name[-1])-1
+
+        # Is the requested channel activated?
+        if self.getValue(quant.name + 'Enabled'): #self.getValue('ScopedVector1Enabled')
+
+            # The requested channel is activated. Is there already data
+            # available for that channel or do we need to scope for it?
+            if self.acquired_data[requested_channel] is None:
+
+                # There is no data available on that channel, a scope
+                # run must be performed to acquire it.
+
+                # Load value from other Labber-related instruments
+                # Also, ensure that the loaded waveforms are not NoneType
+                # when attempting the len operation below.
+
+                # Reset detection of duplicate waveform upload
+                update_channel_1 = 0
+                update_channel_2 = 0
+
+                if self.getValue('ScopedVector1Enabled'):
+                    if not np.array_equal(self.loaded_waveform_1,self.getValueArray('LoadedVector1')):
+                        update_channel_1 = 1
+                        self.loaded_waveform_1 = self.getValueArray('LoadedVector1')
+                else:
+                    self.loaded_waveform_1 = []
+                if self.getValue('ScopedVector2Enabled'):
+                    if not np.array_equal(self.loaded_waveform_2,self.getValueArray('LoadedVector2')):
+                        update_channel_2 = 1
+                        self.loaded_waveform_2 = self.getValueArray('LoadedVector2')
+                else:
+                    self.loaded_waveform_2 = []
+
+                # In case this is a get-run, the loaded vectors will be empty.
+                # Otherwise, we are clear to run the acquisition
+                if ((len(self.loaded_waveform_1) > 0) and self.getValue('ScopedVector1Enabled') and update_channel_1) or + \
+                   ((len(self.loaded_waveform_2) > 0) and self.getValue('ScopedVector2Enabled') and update_channel_2):
+
+                    with self.phase_timer.span('Enable'):
+                        self.awgModule.set('awgModule/awg/enable', 0)
+
+                    if self.getValue('ScopedVector1Enabled'):
+                        self.loadLabberVectorIntoProgram(0)
+                    if self.getValue('ScopedVector2Enabled'):
+                        self.loadLabberVectorIntoProgram(1)
+
+                        # TODO this codelet sure does have optimisation potential
+
+                    if self.AWG_plays_back_internally:
+                        self.localProgramPlayback('setEditorPlayback',self.AWG_loaded_vector_playback_rate)
+
+                    if self.getValue('Stream loaded vectors'):
+                        # The samples are not part of the program, only the
+                        # lengths of the placeholder waves are. Recompile
+                        # only if the program has changed since the last
+                        # upload, then stream the samples.
+                        if self.assembleLocalAwgProgram() != self.compiled_awg_program:
+                            self.compileAndUploadSourceString()
+                        self.writeLoadedVectors()
+                    else:
+                        self.compileAndUploadSourceString()
+
+                    self.api_session.sync()
+                    with self.phase_timer.span('Enable'):
+                        self.awgModule.set('awgModule/awg/enable', 1)
+
+                else:
+                    self.log("A loaded waveform had zero length. No scope acquisition was performed.",level=30)
+
+                if ((len(self.loaded_waveform_1) > 0) and self.getValue('ScopedVector1Enabled')) or ((len(self.loaded_waveform_2) > 0) and self.getValue('ScopedVector2Enabled')):
+                    self.api_session.setInt('/' + self.dev + '/scopes/0/enable',1)
+                    self.api_session.sync()
+
+                    self.runScopeDataAcquisition(0) # TODO implement and acquire a time-out from the user (Labber instrument server)
+                    self.log('A measurement has been completed.',level=30)
+                else:
+                    # TODO hotfix
+                    self.acquired_data[requested_channel] = 0
+
+
+                # Clear out the acquired data for the selected channel
+                # self.acquired_data[requested_channel] = None
+
+            # Data is now available on the channel. Fetch it and mark
+            # the channel as 'gotten' ie. None.
+
+            # TODO What if the user sets the Scope sampling exponent ('time') after getting ScopedVector1 but before getting ScopeVector2?
+            # This should be fixed with some self variable, which should only update when an actual scope session runs.
+
+            scopeSamplingExponent = self.api_session.getInt('/'+self.dev+'/awgs/0/time')
+            dt = 1/(1800000000/(2**(scopeSamplingExponent)))
+            self.acquired_data_formatted = quant.getTraceDict(self.acquired_data[requested_channel], dt=dt)
+
+            self.acquired_data[requested_channel] = None
+
+        else:
+            # The requested channel is not activated, return garbage.
+            self.acquired_data_formatted = []
+
+            scopeSamplingExponent = self.api_session.getInt('/'+self.dev+'/awgs/0/time')
+            dt = 1/(1800000000/(2**(scopeSamplingExponent)))
+            self.acquired_data_formatted = quant.getTraceDict([], dt=dt)
+
+        self.log('UHFQA MEAS FINISHED RATO: '+str(self.amountOfRecordsToAverage)+'  Get scoped vector aka a measurment',level=30)
+        return self.acquired_data_formatted
+
+    # Variance of the records of the last scope run, see foldScopeRecord.
+    def getScopedVariance(self, quant):
+        variance = self.acquired_variance[int(quant.name[-1])-1]
+        scopeSamplingExponent = self.api_session.getInt('/'+self.dev+'/awgs/0/time')
+        dt = 1/(1800000000/(2**(scopeSamplingExponent)))
+        return quant.getTraceDict([] if variance is None else variance, dt=dt)
+
+
+
+    """
+###############################################################################
+    QUANTITY ROUTING
+###############################################################################
+    """
+
+
+    # Build the tables routing every quantity name to its set and get
+    # functions. The tables are built once when opening the instrument,
+    # making the routing of a quantity a single dictionary lookup.
+    def buildQuantityRoutes(self):
+        self.node_paths = {}
+        self.set_routes = {}
+        self.get_routes = {}
+
         # Booleans
         # TODO how many scopes there are depends on installed options. Range should be 2.
         # TODO how many channels there are depends on installed options. Range should be something like 8
         # TODO single shot should be automatically set to zero when the scope triggers (Deprecated?)
-        if quant.name in ['SigOut1On','SigOut2On'] + \
-                         ['ImpedanceFifty1On','ImpedanceFifty2On'] + \
-                         ['EnableScope'+str(x+1) for x in range(2)] + \
-                         ['Force Scope '+str(x+1) for x in range(2)] + \
-                         ['SingleShotScope'+str(x+1) for x in range(1)] + \
-                         ['TriggerEnabledScope'+str(x+1) for x in range(1)] + \
-                         ['ACSigIn'+str(x+1) for x in range(2)] + \
-                         ['FiftyOhmSigIn'+str(x+1) for x in range(2)] + \
-                         ['HysteresisMode'+str(x+1) for x in range(2)]:
-            #value = self.api_session.getInt(str(quant.get_cmd % self.dev))
-            return (self.api_session.getInt(str(quant.get_cmd % self.dev)) > 0)
+        for name in ['SigOut1On','SigOut2On'] + \
+                    ['ImpedanceFifty1On','ImpedanceFifty2On'] + \
+                    ['EnableScope'+str(x+1) for x in range(2)] + \
+                    ['Force Scope '+str(x+1) for x in range(2)] + \
+                    ['SingleShotScope'+str(x+1) for x in range(1)] + \
+                    ['TriggerEnabledScope'+str(x+1) for x in range(1)] + \
+                    ['ACSigIn'+str(x+1) for x in range(2)] + \
+                    ['FiftyOhmSigIn'+str(x+1) for x in range(2)] + \
+                    ['HysteresisMode'+str(x+1) for x in range(2)]:
+            self.set_routes[name] = self.setBooleanNode
+            self.get_routes[name] = self.getBooleanNode
+        for name in ['Auto Threshold Input '+str(x+1) for x in range(4)] + \
+                    ['Auto Range Input '+str(x+1) for x in range(2)]:
+            self.set_routes[name] = self.setBooleanNode
 
         # Simple floating points
-        elif quant.name in ['TriggerVoltageScope'+str(x+1) for x in range(1)] + \
-                           ['AmplitudeOutput'+str(x+1)+'AWG' for x in range(2)] + \
-                           ['RangeSigIn'+str(x+1) for x in range(2)] + \
-                           ['ScalingSigIn'+str(x+1) for x in range(2)] + \
-                           ['Oscillator'+str(x+1) for x in range(2)] + \
-                           ['TriggerDelayScope'+str(x+1) for x in range(2)] + \
-                           ['TriggerHoldoffScope'+str(x+1) for x in range(2)] + \
-                           ['ManualThresholdRefTrigInput'+str(x+1) for x in range(4)] + \
-                           ['OffsetSigOut'+str(x+1) for x in range(2)] + \
-                           ['UserRegister'+str(x+1) for x in range(16)]:
-            return self.api_session.getDouble(str(quant.get_cmd % self.dev))
+        for name in ['TriggerVoltageScope'+str(x+1) for x in range(1)] + \
+                    ['RangeSigIn'+str(x+1) for x in range(2)] + \
+                    ['ScalingSigIn'+str(x+1) for x in range(2)] + \
+                    ['Oscillator'+str(x+1) for x in range(2)] + \
+                    ['TriggerDelayScope'+str(x+1) for x in range(2)] + \
+                    ['TriggerHoldoffScope'+str(x+1) for x in range(2)] + \
+                    ['AmplitudeOutput'+str(x+1)+'AWG' for x in range(2)] + \
+                    ['UserRegister'+str(x+1) for x in range(16)]:
+            self.set_routes[name] = self.setDoubleNode
+            self.get_routes[name] = self.getDoubleNode
+
+        # Integer values that use doubles for setting parameters in the server
+        for name in ['SampleLengthScope'+str(x+1) for x in range(1)]:
+            self.set_routes[name] = self.setDoubleNode
+            self.get_routes[name] = lambda quant: int(self.api_session.getDouble(self.getNodePath(quant)))
 
         # Combos
         # TODO SignalSourceChannel is specific and not generic, fix it.
         # TODO get value for vertical channels is not working
-        elif quant.name in ['TriggerFlankScope'+str(x+1) for x in range(1)] + \
-                           ['SignalSourceChannel'+str(x+1)+'Scope1' for x in range(2)] + \
-                           ['SamplingRateScope'+str(x+1) for x in range(1)] + \
-                           ['TriggerSourceScope'+str(x+1) for x in range(1)] + \
-                           ['TriggerFlankScope'+str(x+1) for x in range(1)] + \
-                           ['DiffSigIn'+str(x+1) for x in range(2)] + \
-                           ['ModeOutput'+str(x+1)+'AWG' for x in range(2)] + \
-                           ['TriggerSourceAnalogue'+str(x+1)+'AWG' for x in range(2)] + \
-                           ['TriggerSourceDigital'+str(x+1)+'AWG' for x in range(2)] + \
-                           ['SlopeDigital'+str(x+1)+'AWG' for x in range(2)] + \
-                           ['OutputSamplingRateAWG']:
-            return quant.getValueFromCmdString(self.api_session.getInt(str(quant.get_cmd % self.dev)))
-
+        for name in ['TriggerFlankScope'+str(x+1) for x in range(1)] + \
+                    ['SignalSourceChannel'+str(x+1)+'Scope1' for x in range(2)] + \
+                    ['SamplingRateScope'+str(x+1) for x in range(1)] + \
+                    ['TriggerSourceScope'+str(x+1) for x in range(1)] + \
+                    ['DiffSigIn'+str(x+1) for x in range(2)] + \
+                    ['ModeOutput'+str(x+1)+'AWG' for x in range(2)] + \
+                    ['TriggerSourceAnalogue'+str(x+1)+'AWG' for x in range(2)] + \
+                    ['TriggerSourceDigital'+str(x+1)+'AWG' for x in range(2)] + \
+                    ['SlopeDigital'+str(x+1)+'AWG' for x in range(2)] + \
+                    ['OutputSamplingRateAWG']:
+            self.set_routes[name] = self.setComboNode
+            self.get_routes[name] = self.getComboNode
 
         # Output signal range-related combos
-        elif quant.name in ['RangeSigOut1','RangeSigOut2']:
-            if (self.api_session.getDouble(str(quant.get_cmd % self.dev)) - 0.200) < 0:
-                return quant.getValueFromCmdString(0.075) # Then, we recieved a 'low' range
-            else:
-                return quant.getValueFromCmdString(0.75)
+        self.set_routes['RangeSigOut1'] = self.setRangeSigOut1
+        self.set_routes['RangeSigOut2'] = self.setRangeSigOut2
+        self.get_routes['RangeSigOut1'] = self.getRangeSigOut
+        self.get_routes['RangeSigOut2'] = self.getRangeSigOut
 
-        # Integer values that use doubles for setting parameters in the server
-        elif quant.name in ['SampleLengthScope'+str(x+1) for x in range(1)]:
-            return int(self.api_session.getDouble(str(quant.get_cmd % self.dev)))
+        # awgModule-related Booleans
+        self.set_routes['EnableAWG'] = self.setEnableAWG
+        self.get_routes['EnableAWG'] = lambda quant: self.awgModule.get(str(quant.get_cmd))
 
-        # awgModule related Booleans
-        elif quant.name in ['EnableAWG']:
-            return self.awgModule.get(str(quant.get_cmd))
+        # ... awgModule-related ANTI-Booleans
+        self.set_routes['EnableRerunAWG'] = self.setEnableRerunAWG
+        self.get_routes['EnableRerunAWG'] = lambda quant: (self.api_session.getInt(self.getNodePath(quant)) < 1)
 
-        # awgModule-related ANTI-Booleans
-        elif quant.name in ['EnableRerunAWG']:
-            return (self.api_session.getInt(str(quant.get_cmd % self.dev)) < 1)
+        # DIO- and output DC-offset related floats
+        for name in ['ManualThresholdRefTrigInput'+str(x+1) for x in range(4)] + \
+                    ['OffsetSigOut'+str(x+1) for x in range(2)]:
+            self.set_routes[name] = self.setDoubleNodeWithReadback
+            self.get_routes[name] = self.getDoubleNode
 
         # Scope hysteresis-related doubles
         # TODO so what is the best way to force an update of another value? (in Labber?)
-        elif quant.name in ['SimpleSigGenLoop']:
-            return self.AWG_SSN_looping
-        elif quant.name in ['TriggerHysteresisScope'+str(x+1) for x in range(2)]:
-            #self.api_session.setInt('/'+self.dev+'/scopes/0/trighysteresis/mode', 0) # TODO this should fetch the current scope in question.
-            return self.api_session.getDouble(str(quant.get_cmd % self.dev))
-        elif quant.name in ['RelativeTriggerHysteresisScope'+str(x+1) for x in range(2)]:
-            #self.api_session.setInt('/'+self.dev+'/scopes/0/trighysteresis/mode', 1) # TODO this should fetch the current scope in question.
-            return self.api_session.getDouble(str(quant.get_cmd % self.dev))*100.0
+        for name in ['TriggerHysteresisScope'+str(x+1) for x in range(2)]:
+            self.set_routes[name] = self.setTriggerHysteresisScope
+            self.get_routes[name] = self.getDoubleNode
+        for name in ['RelativeTriggerHysteresisScope'+str(x+1) for x in range(2)]:
+            self.set_routes[name] = self.setRelativeTriggerHysteresisScope
+            self.get_routes[name] = self.getPercentageNode
 
         # Percentage-related floats
-        elif quant.name in ['TriggerReferenceScope'+str(x+1) for x in range(2)]:
-            return self.api_session.getDouble(str(quant.get_cmd % self.dev))*100.0
-
-        # Loaded vector playback rate
-        elif quant.name in ['LoadedVectorPlaybackRate']:
-            return self.AWG_loaded_vector_playback_rate
-
-        # Internal or external waveform playback source
-        elif quant.name in ['UseInternalVectorPlaybackRate']:
-            return self.AWG_plays_back_internally
-
-        # Relative offset between channels 1 and 2
-        # THIS FUNCTION IS DEPRECATED
-        # elif quant.name in ['RelativePhaseOffset']:
-        #    return self.AWG_relative_phase_channels_1_2
+        for name in ['TriggerReferenceScope'+str(x+1) for x in range(2)]:
+            self.set_routes[name] = self.setPercentageNode
+            self.get_routes[name] = self.getPercentageNode
 
-        # Commands related to amount of records to average every run
-        elif quant.name in ['RecordAmountToAverage']:
-            return self.amountOfRecordsToAverage*1.0
+        # Factory reset etc.
+        self.set_routes['I messed up...'] = self.setFactoryReset
 
-        # Simple signal generator
-        elif quant.name in ['SimpleSigGenAwgPoints']:
-            return self.AWG_SSG_no_points
-        elif quant.name in ['SimpleSigGenAmplitude']:
-            return self.AWG_SSG_amplitude
-        elif quant.name in ['SimpleSigGenWaveformType']:
-            return quant.getValueFromCmdString(self.AWG_SSG_waveform)
+        # Compile and upload
+        self.set_routes['Compile and upload'] = self.setCompileAndUpload
 
-        # Acquire data from the scoped channels
-        elif quant.name in ['ScopedVector1', 'ScopedVector2']:
+        # Insert Labber data vector into local program
+        self.set_routes['Insert into program'] = self.setInsertIntoProgram
 
-            self.log('UHFQA MEAS START RATO: '+str(self.amountOfRecordsToAverage)+' Get scoped vector aka a measurment',level=30)
-            # TODO Very important, does the /scopes/0/channel need to be configured (to for instance 3) in order to actually acquire data from channel 1 and 2 into the 'wave' dict?
-            # (Deprecated?)
+        # Clear local AWG program
+        self.set_routes['Clear local AWG program'] = self.setClearLocalAwgProgram
 
-            self.log('A ScopedVector GET is running.',level=30)
-            requested_channel = int(quant.name[-1])-1
+        # Durations recorded by the phase timer
+        for name in ['Timing histogram', 'Timing last duration', 'Timing mean duration', 'Timing count']:
+            self.get_routes[name] = self.getPhaseTiming
+        self.set_routes['Reset timing'] = self.setResetTiming
 
-            # Is the requested channel activated?
-            if self.getValue(quant.name + 'Enabled'): #self.getValue('ScopedVector1Enabled')
+        # Loaded vector playback rate related commands
+        for name in ['LoadedVectorPlaybackRate'] + \
+                    ['UseInternalVectorPlaybackRate']:
+            self.set_routes[name] = lambda quant, value: self.localProgramPlayback(str(quant.get_cmd),value)
+        self.get_routes['LoadedVectorPlaybackRate'] = lambda quant: self.AWG_loaded_vector_playback_rate
+        self.get_routes['UseInternalVectorPlaybackRate'] = lambda quant: self.AWG_plays_back_internally
 
-                # The requested channel is activated. Is there already data
-                # available for that channel or do we need to scope for it?
-                if self.acquired_data[requested_channel] is None:
+        # Commands related to amount of records to average every run
+        self.set_routes['RecordAmountToAverage'] = self.setRecordAmountToAverage
+        self.get_routes['RecordAmountToAverage'] = lambda quant: self.amountOfRecordsToAverage*1.0
 
-                    # There is no data available on that channel, a scope
-                    # run must be performed to acquire it.
+        # Simple signal generator-related commands
+        for name in ['SimpleSigGenLoop','SimpleSigGenAwgPoints'] + \
+                    ['SimpleSigGenAmplitude']:
+            self.set_routes[name] = lambda quant, value: self.simpleSignalGenerator(str(quant.get_cmd),value)
+        self.set_routes['SimpleSigGenWaveformType'] = lambda quant, value: self.simpleSignalGenerator(str(quant.get_cmd), int(quant.getCmdStringFromValue(value)))
+        self.get_routes['SimpleSigGenLoop'] = lambda quant: self.AWG_SSN_looping
+        self.get_routes['SimpleSigGenAwgPoints'] = lambda quant: self.AWG_SSG_no_points
+        self.get_routes['SimpleSigGenAmplitude'] = lambda quant: self.AWG_SSG_amplitude
+        self.get_routes['SimpleSigGenWaveformType'] = lambda quant: quant.getValueFromCmdString(self.AWG_SSG_waveform)
 
-                    # Load value from other Labber-related instruments
-                    # Also, ensure that the loaded waveforms are not NoneType
-                    # when attempting the len operation below.
+        # Acquire data per scope
+        # self.runScopeDataAcquisition(0,2.0) # TODO acquire time-out from the user (Labber instrument server)
+        # self.setValue('ScopedVector1',self.acquired_data.get('wave')) # Set as Y-axis in a Labber vector
 
-                    # Reset detection of duplicate waveform upload
-                    update_channel_1 = 0
-                    update_channel_2 = 0
+        # Acquire data from the scoped channels
+        for name in ['ScopedVector1', 'ScopedVector2']:
+            self.get_routes[name] = self.getScopedVector
+        for name in ['ScopedVariance1', 'ScopedVariance2']:
+            self.get_routes[name] = self.getScopedVariance
 
-                    if self.getValue('ScopedVector1Enabled'):
-                        if not np.array_equal(self.loaded_waveform_1,self.getValueArray('LoadedVector1')):
-                            update_channel_1 = 1
-                            self.loaded_waveform_1 = self.getValueArray('LoadedVector1')
-                    else:
-                        self.loaded_waveform_1 = []
-                    if self.getValue('ScopedVector2Enabled'):
-                        if not np.array_equal(self.loaded_waveform_2,self.getValueArray('LoadedVector2')):
-                            update_channel_2 = 1
-                            self.loaded_waveform_2 = self.getValueArray('LoadedVector2')
-                    else:
-                        self.loaded_waveform_2 = []
+        # Relative offset between channels 1 and 2
+        # THIS FUNCTION IS DEPRECATED
+        # self.get_routes['RelativePhaseOffset'] = lambda quant: self.AWG_relative_phase_channels_1_2
 
-                    # In case this is a get-run, the loaded vectors will be empty.
-                    # Otherwise, we are clear to run the acquisition
-                    if ((len(self.loaded_waveform_1) > 0) and self.getValue('ScopedVector1Enabled') and update_channel_1) or + \
-                       ((len(self.loaded_waveform_2) > 0) and self.getValue('ScopedVector2Enabled') and update_channel_2):
+    # Resolve the node path of a quantity, once
+    def getNodePath(self, quant):
+        try:
+            return self.node_paths[quant.name]
+        except KeyError:
+            self.node_paths[quant.name] = str(quant.get_cmd % self.dev)
+            return self.node_paths[quant.name]
 
-                        self.awgModule.set('awgModule/awg/enable', 0)
+    def setBooleanNode(self, quant, value):
+        self.api_session.setInt(self.getNodePath(quant), 1 if value else 0)
+        return value
 
-                        if self.getValue('ScopedVector1Enabled'):
-                            self.loadLabberVectorIntoProgram(0)
-                        if self.getValue('ScopedVector2Enabled'):
-                            self.loadLabberVectorIntoProgram(1)
+    def getBooleanNode(self, quant):
+        return (self.api_session.getInt(self.getNodePath(quant)) > 0)
 
-                            # TODO this codelet sure does have optimisation potential
+    def setDoubleNode(self, quant, value):
+        self.api_session.setDouble(self.getNodePath(quant), float(value))
+        return value
 
-                        if self.AWG_plays_back_internally:
-                            self.localProgramPlayback('setEditorPlayback',self.AWG_loaded_vector_playback_rate)
+    def getDoubleNode(self, quant):
+        return self.api_session.getDouble(self.getNodePath(quant))
 
-                        self.compileAndUploadSourceString()
+    # Convert input to integer
+    def setComboNode(self, quant, value):
+        self.api_session.setInt(self.getNodePath(quant), int(quant.getCmdStringFromValue(value)))
+        return value
 
-                        self.api_session.sync()
-                        self.awgModule.set('awgModule/awg/enable', 1)
+    def getComboNode(self, quant):
+        return quant.getValueFromCmdString(self.api_session.getInt(self.getNodePath(quant)))
 
-                    else:
-                        self.log("A loaded waveform had zero length. No scope acquisition was performed.",level=30)
+    def setRangeSigOut1(self, quant, value):
+        # First, we must establish if we are in HiZ-mode or not
+        if self.api_session.getInt('/'+self.dev+'/sigouts/0/imp50'):
+            doubleValue = float(quant.getCmdStringFromValue(value))
+        else:
+            doubleValue = float(quant.getCmdStringFromValue(value))*2.0
+        self.api_session.setDouble(self.getNodePath(quant), doubleValue)
+        self.AWG_output_range_1 = quant.getCmdStringFromValue(value)
+        self.update_local_awg_program.add(self.generateProgramConstants)
+        return value
 
-                    if ((len(self.loaded_waveform_1) > 0) and self.getValue('ScopedVector1Enabled')) or ((len(self.loaded_waveform_2) > 0) and self.getValue('ScopedVector2Enabled')):
-                        self.api_session.setInt('/' + self.dev + '/scopes/0/enable',1)
-                        self.api_session.sync()
+    def setRangeSigOut2(self, quant, value):
+        # First, we must establish if we are in HiZ-mode or not
+        if self.api_session.getInt('/'+self.dev+'/sigouts/1/imp50'):
+            doubleValue = float(quant.getCmdStringFromValue(value))
+            # TODO channel 2?
+        else:
+            doubleValue = float(quant.getCmdStringFromValue(value))*2.0
+            # TODO channel 2?
+        self.api_session.setDouble(self.getNodePath(quant), doubleValue)
+        return value
 
-                        self.runScopeDataAcquisition(0) # TODO implement and acquire a time-out from the user (Labber instrument server)
-                        self.log('A measurement has been completed.',level=30)
-                    else:
-                        # TODO hotfix
-                        self.acquired_data[requested_channel] = 0
+    def getRangeSigOut(self, quant):
+        if (self.api_session.getDouble(self.getNodePath(quant)) - 0.200) < 0:
+            return quant.getValueFromCmdString(0.075) # Then, we recieved a 'low' range
+        else:
+            return quant.getValueFromCmdString(0.75)
 
+    def setEnableAWG(self, quant, value):
+        self.awgModule.set(str(quant.get_cmd), 1 if value else 0)
+        return value
 
-                    # Clear out the acquired data for the selected channel
-                    # self.acquired_data[requested_channel] = None
+    def setEnableRerunAWG(self, quant, value):
+        self.api_session.setInt(self.getNodePath(quant), 0 if value else 1)
+        return value
 
-                # Data is now available on the channel. Fetch it and mark
-                # the channel as 'gotten' ie. None.
+    # Fix click-box incrementation being overridden by LabOne
+    # TODO there should be some while-loop or similar for setting
+    # and getting values in increments of 1.25% until the changes are
+    # legal according to the server. (Deprecated?)
+    def setDoubleNodeWithReadback(self, quant, value):
+        self.api_session.setDouble(self.getNodePath(quant), float(value))
+        return self.api_session.getDouble(self.getNodePath(quant))
+
+    def setTriggerHysteresisScope(self, quant, value):
+        self.api_session.setInt('/'+self.dev+'/scopes/0/trighysteresis/mode', 0) # TODO this should fetch the current scope in question.
+        self.api_session.setDouble(self.getNodePath(quant), float(value))
+        return self.api_session.getDouble(self.getNodePath(quant))
+
+    def setRelativeTriggerHysteresisScope(self, quant, value):
+        self.api_session.setInt('/'+self.dev+'/scopes/0/trighysteresis/mode', 1) # TODO this should fetch the current scope in question.
+        self.api_session.setDouble(self.getNodePath(quant), float(value)/100.0)
+        return self.api_session.getDouble(self.getNodePath(quant))*100.0
+
+    def setPercentageNode(self, quant, value):
+        self.api_session.setDouble(self.getNodePath(quant), float(value)/100.0)
+        return value
 
-                # TODO What if the user sets the Scope sampling exponent ('time') after getting ScopedVector1 but before getting ScopeVector2?
-                # This should be fixed with some self variable, which should only update when an actual scope session runs.
+    def getPercentageNode(self, quant):
+        return self.api_session.getDouble(self.getNodePath(quant))*100.0
 
-                scopeSamplingExponent = self.api_session.getInt('/'+self.dev+'/awgs/0/time')
-                dt = 1/(1800000000/(2**(scopeSamplingExponent)))
-                self.acquired_data_formatted = quant.getTraceDict(self.acquired_data[requested_channel], dt=dt)
+    def setFactoryReset(self, quant, value):
+        ziUtils.disable_everything(self.api_session, self.dev)
+        return value
 
-                self.acquired_data[requested_channel] = None
+    def setCompileAndUpload(self, quant, value):
+        self.compileAndUploadSourceString()
+        if self.getValue('Stream loaded vectors') and (self.AWG_channel_1_is_playing or self.AWG_channel_2_is_playing):
+            self.writeLoadedVectors()
+        return value
 
-            else:
-                # The requested channel is not activated, return garbage.
-                self.acquired_data_formatted = []
+    def setInsertIntoProgram(self, quant, value):
+        self.loadLabberVectorIntoProgram(0)
+        self.loadLabberVectorIntoProgram(1)
+        return value
 
-                scopeSamplingExponent = self.api_session.getInt('/'+self.dev+'/awgs/0/time')
-                dt = 1/(1800000000/(2**(scopeSamplingExponent)))
-                self.acquired_data_formatted = quant.getTraceDict([], dt=dt)
+    def setClearLocalAwgProgram(self, quant, value):
+        self.generateLocalAwgProgram()
+        return value
 
-            self.log('UHFQA MEAS FINISHED RATO: '+str(self.amountOfRecordsToAverage)+'  Get scoped vector aka a measurment',level=30)
-            return self.acquired_data_formatted
+    def setResetTiming(self, quant, value):
+        self.phase_timer.reset()
+        return value
 
-        return quant.getValue()
+    # Recorded durations of the phase selected by 'Timing phase'
+    def getPhaseTiming(self, quant):
+        phase = self.getValue('Timing phase')
+        if quant.name == 'Timing histogram':
+            return quant.getTraceDict(self.phase_timer.histograms[phase], t0=PhaseTimer.histogram_start, dt=PhaseTimer.histogram_step)
+        elif quant.name == 'Timing last duration':
+            return self.phase_timer.last_durations[phase]
+        elif quant.name == 'Timing mean duration':
+            return self.phase_timer.total_durations[phase] / max(self.phase_timer.counts[phase], 1)
+        return self.phase_timer.counts[phase]
+
+    def setRecordAmountToAverage(self, quant, value):
+        self.amountOfRecordsToAverage = int(value)
+        return value
 
 
 
@@ -615,6 +685,12 @@ class Driver(LabberDriver):
         # Maximum amount of tries for scoping
         maximum_amount_of_scope_tries = 3
 
+        # Should the records be averaged while they arrive?
+        stream_records = self.getValue('Stream scope records')
+
+        # All tries share one wall-clock deadline.
+        deadline = time.monotonic() + self.getValue('Scope timeout')
+
         # Define the condition for success
         scope_run_successful = 0
 
@@ -626,6 +702,8 @@ class Driver(LabberDriver):
             progress = 0
             records = 0
 
+            self.resetScopeAccumulator()
+
             # We then start the scope module, and enable the chosen scope.
             self.scopeModule.execute()
             self.api_session.setInt('/' + self.dev + '/scopes/' + str(scope) + '/enable', 1)
@@ -633,65 +711,155 @@ class Driver(LabberDriver):
             # The data acquisition is now running.
             # It may terminate when we either have a sufficient amount of collected
             # records or when the scope reports its progress as completed.
-            timeout = 0 # Hotfix TODO / CK
-
-            while (records < self.amountOfRecordsToAverage or progress < 1.0) and (timeout < 60):
-                time.sleep(0.025)
-                records = self.scopeModule.getInt("scopeModule/records")
-                progress = self.scopeModule.progress()[0]
-                timeout += 0.025 # Hotfix TODO /CK
+            # When streaming, the records are folded in on every poll and
+            # the run is complete once enough of them have been folded.
+            run_start = time.monotonic()
+            poll_interval = 0.001
+
+            while True:
+                if stream_records:
+                    self.foldScopeRecords(self.scopeModule.read(True).get(wave_nodepath, []))
+                    records = self.scope_record_count
+                    if records >= self.amountOfRecordsToAverage:
+                        break
+                else:
+                    records = self.scopeModule.getInt("scopeModule/records")
+                    progress = self.scopeModule.progress()[0]
+                    if records >= self.amountOfRecordsToAverage and progress >= 1.0:
+                        break
+
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                poll_interval = self.scopePollInterval(records, now - run_start, poll_interval)
+                time.sleep(min(poll_interval, deadline - now))
+
+            self.phase_timer.record('Scope wait', run_start, time.monotonic() - run_start)
 
             # The data acquisition ran, we now shut off the module.
             self.api_session.setInt('/' + self.dev + '/scopes/' + str(scope) + '/enable', 0)
             self.scopeModule.finish()
 
-            # Dump the data to the client
-            data_read = self.scopeModule.read(True)
+            # Dump the data to the client. When streaming, the records were
+            # folded in while polling, and reading the whole history once more
+            # would only stall the run. The folded records then tell whether
+            # any data was acquired.
+            if stream_records:
+                records = self.scope_record_count
+                data_acquired = records > 0
+            else:
+                with self.phase_timer.span('Scope read'):
+                    data_read = self.scopeModule.read(True)
+                data_acquired = wave_nodepath in data_read
 
             # Was this a successful run?
             # There are two sufficient failure conditions:
-            # If the wave nodepath is missing from the data (= no data acquired)
-            # or if the amount of records were too few.
-            if (wave_nodepath in data_read) and (records >= self.amountOfRecordsToAverage):
+            # If no data was acquired (= the wave nodepath is missing from
+            # the data) or if the amount of records were too few.
+            if data_acquired and (records >= self.amountOfRecordsToAverage):
 
                 # Successful. Break the loop.
                 scope_run_successful = 1
 
+            elif (time.monotonic() >= deadline) and self.getValue('Return partial scope averages') and data_acquired and (records > 0):
+
+                # Out of time, settle for the records that did arrive.
+                self.log('The scope acquisition timed out after '+str(records)+' of '+str(self.amountOfRecordsToAverage)+' records, returning the average of those.',level=30)
+                scope_run_successful = 1
+
             else:
 
                 # Not successful. Decrease remaining trial count.
                 # Restart the loop by not declaring the run completed.
                 maximum_amount_of_scope_tries -= 1
 
-                # If the trial amount expires, raise an error.
-                if maximum_amount_of_scope_tries == 0:
-                    raise 'Error: the subscribed data did not contain samples from '+self.dev+'\'s scope '+str(scope)+' in a reasonable amount of attempts.'
-
-        # TODO Only operate on self.amountOfRecordsToAverage number of records
-        # to save time and resources.
+                # If the trial amount or the time expires, raise an error.
+                if (maximum_amount_of_scope_tries == 0) or (time.monotonic() >= deadline):
+                    raise Exception('Error: the subscribed data did not contain samples from '+self.dev+'\'s scope '+str(scope)+' in a reasonable amount of attempts.')
 
-        acquired = data_read[wave_nodepath]
+        # The records have already been averaged while streaming. Otherwise,
+        # decode and average the records of all channels in a single pass.
+        with self.phase_timer.span('Averaging'):
+            if stream_records:
+                mean, variance = self.scopeAccumulatorResult()
+            else:
+                mean = self.averageScopeRecords(data_read[wave_nodepath][:self.amountOfRecordsToAverage])
+                variance = None
 
         # "Return" the acquired and averaged data.
         if self.getValue('ScopedVector1Enabled') or ( (not self.getValue('ScopedVector1Enabled')) and (self.getValue('ScopedVector2Enabled')) ):
-            data = []
-
-            for i, record in enumerate(acquired):
-                wave = record[0]['wave']
-                data.append(wave[0])
-
-            self.acquired_data[0] = np.mean(data[:self.amountOfRecordsToAverage], axis=0)
+            self.acquired_data[0] = mean[0]
+            self.acquired_variance[0] = None if variance is None else variance[0]
 
         if self.getValue('ScopedVector2Enabled'):
-            data = []
-
-            for i, record in enumerate(acquired):
-                wave = record[0]['wave']
-                #data.append(wave[0])
-                #self.log(wave,level=30) # TODO DEBUG
-                data.append(wave[1])
-
-            self.acquired_data[1] = np.mean(data[:self.amountOfRecordsToAverage], axis=0)
+            self.acquired_data[1] = mean[1]
+            self.acquired_variance[1] = None if variance is None else variance[1]
+
+    # Average scope records, as returned by a scope module read. The waves
+    # of all channels are summed into one accumulator while iterating the
+    # records once, without collecting them in intermediate lists.
+    def averageScopeRecords(self, records):
+        total = np.array(records[0][0]['wave'], dtype=np.float64)
+        for record in records[1:]:
+            total += record[0]['wave']
+        return total / len(records)
+
+    # Time to wait before polling the scope again. Once the rate at which
+    # records arrive is known, sleep until the remaining records are
+    # expected (polling every millisecond from then on). Until then, back
+    # off exponentially. Never sleep longer than 50 ms.
+    def scopePollInterval(self, records, elapsed, previous_interval):
+        record_rate = self.getValue('Scope trigger rate')
+        if (record_rate <= 0) and (records > 0) and (elapsed > 0):
+            record_rate = records / elapsed
+        if record_rate > 0:
+            expected = (self.amountOfRecordsToAverage - records) / record_rate
+            return min(max(expected, 0.001), 0.05)
+        return min(previous_interval * 2, 0.05)
+
+    # Clear the running averages before a scope run.
+    def resetScopeAccumulator(self):
+        self.scope_record_count = 0
+        self.scope_last_timestamp = None
+        self.scope_mean = None
+        self.scope_m2 = None
+
+    # Fold the records returned by a scope module read into the running
+    # averages. A read returns the whole record history, hence records
+    # that have already been folded are recognised by their timestamp.
+    def foldScopeRecords(self, records):
+        for record in records:
+            if self.scope_record_count >= self.amountOfRecordsToAverage:
+                return
+            timestamp = record[0]['timestamp']
+            if (self.scope_last_timestamp is not None) and (timestamp <= self.scope_last_timestamp):
+                continue
+            self.scope_last_timestamp = timestamp
+            self.foldScopeRecord(record[0]['wave'])
+
+    # Welford's update of the running mean, and of the sum of squared
+    # deviations if the variance is requested. The accumulators hold one
+    # record of all channels, whatever the amount of records averaged.
+    def foldScopeRecord(self, wave):
+        self.scope_record_count += 1
+        if self.scope_mean is None:
+            self.scope_mean = np.array(wave, dtype=np.float64)
+            if self.getValue('Accumulate scope variance'):
+                self.scope_m2 = np.zeros_like(self.scope_mean)
+            return
+        delta = wave - self.scope_mean
+        self.scope_mean += delta / self.scope_record_count
+        if self.scope_m2 is not None:
+            self.scope_m2 += delta * (wave - self.scope_mean)
+
+    # Return the mean and the sample variance (None if not accumulated) of
+    # the folded records.
+    def scopeAccumulatorResult(self):
+        if self.scope_m2 is None:
+            return self.scope_mean, None
+        if self.scope_record_count < 2:
+            return self.scope_mean, np.zeros_like(self.scope_m2)
+        return self.scope_mean, self.scope_m2 / (self.scope_record_count - 1)
 
     """
 ###############################################################################
@@ -767,6 +935,9 @@ class Driver(LabberDriver):
 ###############################################################################
     """
 
+    # Generate the default local AWG program. The program is kept as a
+    # dictionary of sections, which are regenerated independently whenever
+    # the settings they depend on change. See assembleLocalAwgProgram.
     def generateLocalAwgProgram(self):
 
         self.AWG_SSG_no_points = 2414
@@ -774,107 +945,130 @@ class Driver(LabberDriver):
         self.AWG_SSG_waveform = 1 # Sine
         self.AWG_SSN_looping = 1
         self.AWG_loaded_vector_playback_rate = 0
+        self.AWG_playback_wait_cycles = None
+        self.AWG_output_range_1 = '0.75'
         #self.AWG_relative_phase_channels_1_2 = 0.0
         self.AWG_channel_1_is_playing = 0
         self.AWG_channel_2_is_playing = 0
+        self.padding = 0
 
 
         # TODO when only playing channel 2, how should the marker be set up?
         # Perhaps it would be a good idea to include some sort of marker on
         # channel 2?
 
-        self.local_awg_program = textwrap.dedent("""\
-const AWG_N = 2414;
-const AWG_AMPL = 1.0;
-const RSC = 1/0.75; // Range scaling
-//var t = 0;
-
-// Marker construction
-//const marker_pos = 0;
-//wave marker_left = marker(marker_pos,0);
-//wave marker_right = marker(AWG_N-marker_pos,1);
-//wave w_marker = join(marker_left,marker_right);
-
-// Waveform definitions
-//wave w0 = "wave0";
-//wave w1 = gauss(AWG_N, AWG_N/2, AWG_N/20);
-//wave w2;
-//wave w3; // End of w3 definition
-//wave w4; // End of w4 definition
-
-// Waveform + marker construction and scaling
-//wave w3_w_marker = RSC*w3;// + w_marker;
-//wave w4_wo_marker = RSC*w4;
-
-while(1){
-
-//if (t == 0) {
-waitDigTrigger(1,1);
-setTrigger(1);
-//playWave(w0);
-//playWave(w1);
-//playWave(w2);
-//playWave(1,w3_w_marker); // Only channel 1 is playing
-//playWave(2,w4_wo_marker); // Only channel 2 is playing
-//playWave(1,w3_w_marker,2,w4_wo_marker); // Both channel 1 and 2 are playing
-waitWave();
-setTrigger(0);
-//wait(10000);
-
-//t = t + 1;
-//} // End of t-swap
-
-//if (t == 1) {
-//wait(0);
-//t = 0;
-//} // End of t-reset
-
-
-
-
-} // End of while-loop
-            """
-        )
-
-#    def loadLabberVectorIntoProgram(self):
-#        #self.loaded_waveform = self.getValueArray('LoadedVector')
-#        self.local_awg_program = self.local_awg_program.replace('\n//wave w3;', '\nwave w3 = ;')
-#        self.local_awg_program = self.local_awg_program.replace('\n//wave w3_w_marker', '\nwave w3_w_marker')
-#        self.local_awg_program = self.local_awg_program.replace('\n//playWave(1,w3_w_marker)', '\nplayWave(1,w3_w_marker)')
-#        self.local_awg_program = re.sub('wave w3 = [^;]+;', 'wave w3 = ;', self.local_awg_program)
-#        self.local_awg_program = self.local_awg_program.replace('\nwave w3 = ', '\nwave w3 = vect('+','.join([str(x) for x in self.loaded_waveform_1])+')')
+        # The sections of the program, in order of appearance.
+        self.local_awg_program = {
+            'CONSTANTS'             : '',
+            'PLAYBACK_COUNTER'      : '',
+            'WAVEFORM_DECLARATION'  : '',
+            'WHILE_LOOP_START'      : '',
+            'PLAYBACK_DELAY_START'  : '',
+            'WAIT_FOR_TRIGGER'      : 'waitDigTrigger(1,1);\nsetTrigger(1);\n',
+            'PLAYWAVE'              : '',
+            'END_TRIGGER'           : 'waitWave();\nsetTrigger(0);\n',
+            'PLAYBACK_DELAY_END'    : '',
+            'WHILE_LOOP_END'        : '',
+        }
+        self.plain_local_awg_program = None
+
+        # Every section generator must run before the first assembly.
+        self.update_local_awg_program = {
+            self.generateProgramConstants,
+            self.generateProgramWaveforms,
+            self.generateProgramPlaybackDelay,
+            self.generateProgramLoop,
+        }
+
+    # Regenerate the sections that have changed, and join all sections into
+    # the source string that is handed to the compiler.
+    def assembleLocalAwgProgram(self):
+        if self.update_local_awg_program or self.plain_local_awg_program is None:
+            for generate in self.update_local_awg_program:
+                generate()
+            self.update_local_awg_program = set()
+            self.plain_local_awg_program = ''.join(self.local_awg_program.values())
+        return self.plain_local_awg_program
+
+    # Constants: the simple signal generator settings and the range scaling.
+    def generateProgramConstants(self):
+        self.local_awg_program['CONSTANTS'] = \
+            'const AWG_N = '+str(self.AWG_SSG_no_points)+';\n' + \
+            'const AWG_AMPL = '+str(self.AWG_SSG_amplitude)+';\n' + \
+            'const RSC = 1/'+self.AWG_output_range_1+'; // Range scaling\n\n'
+
+    # Waveform definitions, their scaling, and the playWave of the channels
+    # that are playing a loaded vector.
+    def generateProgramWaveforms(self):
+        declaration = ''
+        if self.AWG_channel_1_is_playing:
+            declaration += 'wave w3 = '+self.loadedVectorDefinition(0)+'; // End of w3 definition\n'
+            declaration += 'wave w3_w_marker = RSC*w3;\n'
+        if self.AWG_channel_2_is_playing:
+            declaration += 'wave w4 = '+self.loadedVectorDefinition(1)+'; // End of w4 definition\n'
+            declaration += 'wave w4_wo_marker = RSC*w4;\n'
+        self.local_awg_program['WAVEFORM_DECLARATION'] = declaration + '\n'
+
+        if self.AWG_channel_1_is_playing and self.AWG_channel_2_is_playing:
+            self.local_awg_program['PLAYWAVE'] = 'playWave(1,w3_w_marker,2,w4_wo_marker);\n'
+        elif self.AWG_channel_1_is_playing:
+            self.local_awg_program['PLAYWAVE'] = 'playWave(1,w3_w_marker);\n'
+        elif self.AWG_channel_2_is_playing:
+            self.local_awg_program['PLAYWAVE'] = 'playWave(2,w4_wo_marker);\n'
+        else:
+            self.local_awg_program['PLAYWAVE'] = ''
+
+    # Every other loop iteration waits, setting the internal playback rate.
+    def generateProgramPlaybackDelay(self):
+        if self.AWG_playback_wait_cycles is None:
+            self.local_awg_program['PLAYBACK_COUNTER'] = ''
+            self.local_awg_program['PLAYBACK_DELAY_START'] = ''
+            self.local_awg_program['PLAYBACK_DELAY_END'] = ''
+        else:
+            self.local_awg_program['PLAYBACK_COUNTER'] = 'var t = 0;\n\n'
+            self.local_awg_program['PLAYBACK_DELAY_START'] = 'if (t == 0) {\n'
+            self.local_awg_program['PLAYBACK_DELAY_END'] = \
+                't = t + 1;\n} // End of t-swap\n\n' + \
+                'if (t == 1) {\nwait('+str(self.AWG_playback_wait_cycles)+');\nt = 0;\n} // End of t-reset\n'
+
+    # The "seamless" looping of the simple signal generator.
+    def generateProgramLoop(self):
+        if self.AWG_SSN_looping:
+            self.local_awg_program['WHILE_LOOP_START'] = 'while(1){\n\n'
+            self.local_awg_program['WHILE_LOOP_END'] = '\n} // End of while-loop\n'
+        else:
+            self.local_awg_program['WHILE_LOOP_START'] = ''
+            self.local_awg_program['WHILE_LOOP_END'] = ''
+
+    # The definition of the wave holding the loaded vector of a channel.
+    # Channel 1 carries the playback padding.
+    def loadedVectorDefinition(self, channel):
+        if self.getValue('Stream loaded vectors'):
+            return 'zeros('+str(self.placeholderLength())+')'
+        vector = self.loaded_waveform_1 if channel == 0 else self.loaded_waveform_2
+        samples = [] if vector is None else [str(x) for x in vector]
+        if channel == 0:
+            samples += ['0.0'] * self.padding
+        return 'vect('+','.join(samples)+')'
 
     def loadLabberVectorIntoProgram(self,channel):
-
         if channel == 0:
             self.AWG_channel_1_is_playing = 1
-            self.local_awg_program = self.local_awg_program.replace('\n//wave w3;', '\nwave w3 = ;')
-            self.local_awg_program = self.local_awg_program.replace('\n//wave w3_w_marker', '\nwave w3_w_marker')
-
-            # Clean out the vector definition and refill.
-            self.local_awg_program = re.sub('wave w3 = [^;]+;', 'wave w3 = ;', self.local_awg_program)
-            self.local_awg_program = self.local_awg_program.replace('\nwave w3 = ', '\nwave w3 = vect('+','.join([str(x) for x in self.loaded_waveform_1])+')')
-
-            if self.AWG_channel_2_is_playing:
-                self.local_awg_program = self.local_awg_program.replace('\nplayWave(2,w4_wo_marker)', '\n//playWave(2,w4_wo_marker)')
-                self.local_awg_program = self.local_awg_program.replace('\n//playWave(1,w3_w_marker,2,w4_wo_marker);', '\nplayWave(1,w3_w_marker,2,w4_wo_marker);')
-            else:
-                self.local_awg_program = self.local_awg_program.replace('\n//playWave(1,w3_w_marker)', '\nplayWave(1,w3_w_marker)')
-
         elif channel == 1:
             self.AWG_channel_2_is_playing = 1
-            self.local_awg_program = self.local_awg_program.replace('\n//wave w4;', '\nwave w4 = ;')
-            self.local_awg_program = self.local_awg_program.replace('\n//wave w4_wo_marker', '\nwave w4_wo_marker')
 
-            # Clean out the vector definition and refill.
-            self.local_awg_program = re.sub('wave w4 = [^;]+;', 'wave w4 = ;', self.local_awg_program)
-            self.local_awg_program = self.local_awg_program.replace('\nwave w4 = ', '\nwave w4 = vect('+','.join([str(x) for x in self.loaded_waveform_2])+')')
+        # Both definitions and the playWave depend on which channels play.
+        self.update_local_awg_program.add(self.generateProgramWaveforms)
 
-            if self.AWG_channel_1_is_playing:
-                self.local_awg_program = self.local_awg_program.replace('\nplayWave(1,w3_w_marker)', '\n//playWave(1,w3_w_marker)')
-                self.local_awg_program = self.local_awg_program.replace('\n//playWave(1,w3_w_marker,2,w4_wo_marker);', '\nplayWave(1,w3_w_marker,2,w4_wo_marker);')
-            else:
-                self.local_awg_program = self.local_awg_program.replace('\n//playWave(2,w4_wo_marker)', '\nplayWave(2,w4_wo_marker)')
+    # Length of the placeholder waves, long enough to hold the loaded vectors
+    # of all playing channels. Channel 1 also carries the playback padding.
+    def placeholderLength(self):
+        length = 0
+        if self.AWG_channel_1_is_playing and self.loaded_waveform_1 is not None:
+            length = max(length, len(self.loaded_waveform_1) + self.padding)
+        if self.AWG_channel_2_is_playing and self.loaded_waveform_2 is not None:
+            length = max(length, len(self.loaded_waveform_2))
+        return length
 
     def appendToLocalAwgProgramFromCsv(self):
         print('Error')
@@ -895,23 +1089,13 @@ setTrigger(0);
                 set_value = 0.0
 
                 # Undo the previous wait clauses
-                self.local_awg_program = self.local_awg_program.replace('\nvar t = 0;', '\n//var t = 0;')
-                self.local_awg_program = self.local_awg_program.replace('\nif (t == 0) {', '\n//if (t == 0) {')
-                self.local_awg_program = self.local_awg_program.replace('\nt = t + 1;', '\n//t = t + 1;')
-                self.local_awg_program = self.local_awg_program.replace('\n} // End of t-swap', '\n//} // End of t-swap')
-                self.local_awg_program = re.sub('\nif \(t == 1\) {\nwait\(.*\);\nt = 0;\n} \/\/ End of t-reset','\n//if (t == 1) {\n//wait(0);\n//t = 0;\n//} // End of t-reset',self.local_awg_program)
-                self.local_awg_program = self.local_awg_program.replace('\nif (t == 1) {\nwait(0);\nt = 0;\n} // End of t-reset', '\n//if (t == 1) {\n//wait(0);\n//t = 0;\n//} // End of t-reset')
+                self.AWG_playback_wait_cycles = None
+                self.update_local_awg_program.add(self.generateProgramPlaybackDelay)
 
                 # Is there any padding that need removal?
                 if self.padding > 0:
-                    if ('= vect(' in self.local_awg_program) :
-                        for x in range(self.padding):
-                            self.local_awg_program = self.local_awg_program.replace(',0.0); // End of w3 definition','); // End of w3 definition')
-                    else:
-                        self.log("Interestingly, there were padded zeroes to remove but the local program did not contain a loaded vector. You should look into this.")
-
-                    # Clear out self.padding
                     self.padding = 0
+                    self.update_local_awg_program.add(self.generateProgramWaveforms)
 
                 # TODO: Experiments have shown that the padding is no longer working since version 0.75,
                 # A revert of this function is in order although put on hold until the external
@@ -977,15 +1161,9 @@ setTrigger(0);
                     # TODO the required wait cycles should lessen with the amount
                     # of cycles required to run the actual program. It is hard-coded above
 
-                    # Insert wait clause
-                    self.local_awg_program = self.local_awg_program.replace('\n//var t = 0;', '\nvar t = 0;')
-                    self.local_awg_program = self.local_awg_program.replace('\n//if (t == 0) {', '\nif (t == 0) {')
-                    self.local_awg_program = self.local_awg_program.replace('\n//t = t + 1;', '\nt = t + 1;')
-                    self.local_awg_program = self.local_awg_program.replace('\n//} // End of t-swap', '\n} // End of t-swap')
-                    self.local_awg_program = self.local_awg_program.replace('\n//if (t == 1) {\n//wait(0);\n//t = 0;\n//} // End of t-reset', '\nif (t == 1) {\nwait('+str(required_wait_cycles)+');\nt = 0;\n} // End of t-reset')
-
-                    # In case we were merely updating an old setting:
-                    self.local_awg_program = re.sub('\nif \(t == 1\) {\nwait\(.*\);\nt = 0;\n} \/\/ End of t-reset','\nif (t == 1) {\nwait('+str(required_wait_cycles)+');\nt = 0;\n} // End of t-reset',self.local_awg_program)
+                    # Insert wait clause, or update an old setting
+                    self.AWG_playback_wait_cycles = required_wait_cycles
+                    self.update_local_awg_program.add(self.generateProgramPlaybackDelay)
 
                     # Do we also require padding?
                     rest = no_of_ticks_needed % 1.0
@@ -1006,22 +1184,13 @@ setTrigger(0);
                             self.log("The rest evaluated vs the final resolution as representable. The padding is now "+str(self.padding),level=30) # TODO DEBUG
 
                             # Append 'padding' amount of zeroes to the w3 vector
-                            zero_vector_string = [str(0.0) for x in range(self.padding)]
-
-                            # Keep in mind that if the padding amount is 0, a '[]' will be inserted into the vector inside the local program.
-                            # This will however never happen due to the if rest > maximum_possible_resolution above.
-
-                            self.local_awg_program = self.local_awg_program.replace('); // End of w3 definition', ','+(((str(zero_vector_string).replace(' ','')).replace('\'','')).replace('[','')).replace(']','') + '); // End of w3 definition')
-
-                            # TODO Insertion of padding into both vectors must be done in a better way. Imagine if this is done in the wrong order. Or if one vector is deactivated, and the padding then overwritten?
-
-                        # TODO
-                        #self.local_awg_program = re.sub('wave w3 = [^;]+;', 'wave w3 = ;', self.local_awg_program)
-                        #self.local_awg_program = self.local_awg_program.replace('\nwave w3 = ', '\nwave w3 = vect('+','.join([str(x) for x in self.loaded_waveform])+')')
+                            self.update_local_awg_program.add(self.generateProgramWaveforms)
 
                     else:
                         # We do not require padding.
-                        self.padding = 0
+                        if self.padding > 0:
+                            self.padding = 0
+                            self.update_local_awg_program.add(self.generateProgramWaveforms)
 
             self.AWG_loaded_vector_playback_rate = set_value
 
@@ -1031,42 +1200,6 @@ setTrigger(0);
 
         return set_value
 
-    # TODO this entire comment blob is likely not to be implemented and should be removed
-    # Enable disable AWG Playback rate
-    #def enablelocalProgramPlayback():
-        # TODO: insert enable/disable box into Labber,
-        # check if the loaded vector is a valid vector
-        #   if it is, then insert this into the program:
-
-                # self.local_awg_program = self.local_awg_program.replace('\n//var t = 0;', '\nvar t = 0;')
-                # self.local_awg_program = self.local_awg_program.replace('\n//if (t == 0) {', '\nif (t == 0) {')
-                # self.local_awg_program = self.local_awg_program.replace('\n//t = t + 1;', '\nt = t + 1;')
-                # self.local_awg_program = self.local_awg_program.replace('\n//} // End of t-swap', '\n} // End of t-swap')
-                # TODO Add some comment after the wait clause to designate it better in the regex, and replace whatever is inside it with the appropriate value
-                # self.local_awg_program = self.local_awg_program.replace('\n//if (t == 1) {\n//wait(0);\n//t = 0;\n//} // End of t-reset', '\nif (t == 1) {\nwait('+str(required_wait_cycles)+');\nt = 0;\n} // End of t-reset')
-
-                # Do we also require padding?
-                # rest = no_of_ticks_needed % 1.0
-                # if (rest > 0) :
-                    # maximum_possible_resolution = 1/awgPlaybackRate
-                    # padding = (rest / 225000000)/awgPlaybackRate # Time needed / Playback rate
-
-                    # Append 'padding' amount of zeroes to the w3 vector
-                    # zero_vector_string = [",0.0" for x in range(padding)]
-                    # self.local_awg_program = self.local_awg_program.replace('); // End of w3 definition', zero_vector_string + '); // End of w3 definition')
-
-                    # TODO
-                    # #self.local_awg_program = re.sub('wave w3 = [^;]+;', 'wave w3 = ;', self.local_awg_program)
-                    # #self.local_awg_program = self.local_awg_program.replace('\nwave w3 = ', '\nwave w3 = vect('+','.join([str(x) for x in self.loaded_waveform])+')')
-
-
-        # Make sure to update the bool appropriately in accordance with what
-        # Labber expects.
-
-        # On disable
-
-    #    pass
-
 
     # Simple signal generator function
     def simpleSignalGenerator(self, command, value):
@@ -1076,22 +1209,14 @@ setTrigger(0);
         # Request "seamless" looping
         if command == 'loop':
             set_value = int(value)
-            if set_value:
-                # Loop
-                self.local_awg_program = self.local_awg_program.replace('\n//while(1){', '\nwhile(1){')
-                self.local_awg_program = self.local_awg_program.replace('\n//} // End of while-loop', '\n} // End of while-loop')
-                self.AWG_SSN_looping = 1
-            else:
-                # Unloop
-                self.local_awg_program = self.local_awg_program.replace('\nwhile(1){', '\n//while(1){')
-                self.local_awg_program = self.local_awg_program.replace('\n} // End of while-loop', '\n//} // End of while-loop')
-                self.AWG_SSN_looping = 0
+            self.AWG_SSN_looping = 1 if set_value else 0
+            self.update_local_awg_program.add(self.generateProgramLoop)
 
         # Set the number of AWG points in the waveform
         elif command == 'awgPoints':
             set_value = int(value)
-            self.local_awg_program = self.local_awg_program.replace('\nconst AWG_N = '+str(self.AWG_SSG_no_points), '\nconst AWG_N = '+str(set_value))
             self.AWG_SSG_no_points = set_value
+            self.update_local_awg_program.add(self.generateProgramConstants)
 
         # Define the waveform that is to be played back
         elif command == 'wave':
@@ -1099,14 +1224,9 @@ setTrigger(0);
             # set that box to what it is supposed to be.
             set_value = value
             if value == 1: # Sine wave # TODO non-optimised in terms of upload speed
-                #self.waveform_1 = 0.5*np.sin(np.linspace(0, random.randint(1,10)*np.pi, self.AWG_simple_sig_gen))
                 # TODO phase offset, number of periods
-                #self.local_awg_program = self.local_awg_program.replace('\n//wave w2', '\nwave w2 = sine(AWG_N,AWG_AMPL,0,1)')
-
                 # TODO there should be something in the way of tickboxes for
                 # controlling what waves get played back
-                # Make sure there are default waveforms to play then.
-                #self.local_awg_program = self.local_awg_program.replace('\n//playWave(w2)', '\nplayWave(w2)')
                 self.AWG_SSG_waveform = set_value
             elif value == 2:
                 # TODO square wave
@@ -1117,8 +1237,8 @@ setTrigger(0);
 
         elif command == 'amplitude':
             set_value = float(value)
-            self.local_awg_program = self.local_awg_program.replace('\nconst AWG_AMPL = '+str(self.AWG_SSG_amplitude), '\nconst AWG_AMPL = '+str(set_value))
             self.AWG_SSG_amplitude = set_value
+            self.update_local_awg_program.add(self.generateProgramConstants)
 
         return set_value
 
@@ -1133,36 +1253,51 @@ setTrigger(0);
         print('Error')
 
 
-    # TODO The function injectMemory is defective and should be replaced entirely
-    # with the HDAWG-method.
-
-    # Inject waveform data into the device mnemonically
-    def injectMemory(self, target_waveform_index, waveform_data_to_inject):
-        # For the transferred array, floating-point (-1.0...+1.0) and
-        # 16 bit signed integers are allowed (-32768 ... +32767).
-        # Dual-channel waves require interleaving is required.
-
-        # Index = waveform in the sequencer program that will be replaced
-        # with the data in awgs/X/waveform/data.
-
-        # N = total number of waveforms
-        # M>0 = number of waveforms defined per CSV file
-        # Index = 0,...,M-1 for all CSV-defined waveforms sorted alphabetically by filename,
-        # M,...,N-1 in the order that the waveforms are defined in the sequencer program.
-
-        # So for instance if there are no CSV-defined waveforms, index = 2
-        # would correspond to the third waveform given in the sequencer program.
-
-        self.waven = np.sinc(np.linspace(-6*np.pi, 6*np.pi, 2000))
-        #index = 3
-        self.api_session.setInt('/' + self.dev + '/awgs/0/waveform/index', target_waveform_index)
-        self.api_session.sync()
-
-        self.api_session.vectorWrite('/' + self.dev + '/awgs/0/waveform/data', self.waven)
-
+    # Stream the loaded vectors into the placeholder waves of the compiled
+    # program. The played waves are scaled by RSC in the program, hence the
+    # samples are scaled the same way here. The waves of both channels are
+    # played by one playWave, so they share waveform index 0.
+    def writeLoadedVectors(self):
+        length = self.placeholderLength()
+        waves = []
+        for channel, is_playing, vector in [(1, self.AWG_channel_1_is_playing, self.loaded_waveform_1), (2, self.AWG_channel_2_is_playing, self.loaded_waveform_2)]:
+            if is_playing:
+                wave = np.zeros(length)
+                if vector is not None:
+                    wave[:len(vector)] = vector
+
+                # Both channels are scaled by AWG_output_range_1, as the
+                # program applies a single RSC to both waves.
+                wave = wave/float(self.AWG_output_range_1)
+
+                # The compiled vect() path would have shown samples beyond
+                # the range, rather than saturating them silently.
+                if np.max(np.abs(wave), initial=0.0) > 1.0:
+                    self.log('Warning: LoadedVector'+str(channel)+' exceeds the AWG output range, '+str(int(np.count_nonzero(np.abs(wave) > 1.0)))+' sample(s) were clipped.',level=30)
+                waves.append(np.clip(wave, -1.0, 1.0))
+
+        if len(waves) == 0 or length == 0:
+            return
+
+        with self.phase_timer.span('Waveform upload'):
+            self.api_session.setVector('/' + self.dev + '/awgs/0/waveform/waves/0', ziUtils.convert_awg_waveform(*waves))
+
+
+    # Poll condition() with an exponentially increasing interval until it
+    # returns True. Returns False if timeout seconds pass before that.
+    def waitForCondition(self, condition, timeout, initial_interval=0.001, maximum_interval=0.05):
+        deadline = time.monotonic() + timeout
+        interval = initial_interval
+        while not condition():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, maximum_interval)
+        return True
 
     # Engage the AWG compiler and upload source string to the device.
-    def compileAndUploadSourceString(self):
+    def compileAndUploadSourceString(self, compile_timeout=10.0, upload_timeout=10.0):
 
         self.log('UHFQA MEAS START RATO: '+str(self.amountOfRecordsToAverage)+'  compile',level=30)
 
@@ -1179,15 +1314,21 @@ setTrigger(0);
 
         # Check if a specific source string has been requested
         # TODO removed 'Default' due to errors
-        program = self.local_awg_program
+        program = self.assembleLocalAwgProgram()
+
+        # Whatever was compiled before is about to be replaced.
+        self.compiled_awg_program = None
 
         # Transfer the source string to the compiler.
         self.awgModule.set('awgModule/compiler/sourcestring', program)
 
-        # Compiling process has initialised.
-        while self.awgModule.getInt('awgModule/compiler/status') == -1:
-            print('Compiling...')
-            time.sleep(0.1)
+        # Compiling process has initialised. The AWG module does not notify
+        # when the compiler is done, hence poll the status with a back-off.
+        compile_start = time.monotonic()
+        if not self.waitForCondition(lambda: self.awgModule.getInt('awgModule/compiler/status') != -1, compile_timeout):
+            raise Exception("The compilation process timed out after {:.1f} s.".format(compile_timeout))
+        self.setValue('Last compile duration', time.monotonic() - compile_start)
+        self.phase_timer.record('Compile', compile_start, time.monotonic() - compile_start)
 
         # Compilation failure.
         if self.awgModule.getInt('awgModule/compiler/status') == 1:
@@ -1209,15 +1350,29 @@ setTrigger(0);
         self.log('UHFQA MEAS FINISHED RATO: '+str(self.amountOfRecordsToAverage)+'  compile',level=30)
         self.log('UHFQA MEAS START RATO: '+str(self.amountOfRecordsToAverage)+'  upload',level=30)
 
-        # Initiate upload process.
-        time.sleep(0.2)
-        i = 0
-
-        # elf/status provides information whether the upload is succeeding or not.
-        while (self.awgModule.getDouble('awgModule/progress') < 1.0) and (self.awgModule.getInt('awgModule/elf/status') != 1):
-            print("{} awgModule/progress: {:.0f}%".format(i, self.awgModule.getDouble('awgModule/progress')*100.0))
-            time.sleep(0.5)
-            i += 1
+        # Initiate upload process. The progress node may still report the
+        # previous upload right after compiling. A finished progress is thus
+        # only trusted once the progress has been seen to reset, or once the
+        # settle time has passed.
+        upload_start = time.monotonic()
+        settle_time = self.getValue('Upload settle time')
+        progress_reset = [False]
+
+        # elf/status provides information whether the upload is succeeding or
+        # not: 1 reports a failure, 2 an ongoing upload.
+        def uploadFinished():
+            elf_status = self.awgModule.getInt('awgModule/elf/status')
+            if elf_status == 1:
+                return True
+            if (self.awgModule.getDouble('awgModule/progress') < 1.0) or (elf_status == 2):
+                progress_reset[0] = True
+                return False
+            return progress_reset[0] or (time.monotonic() - upload_start >= settle_time)
+
+        if not self.waitForCondition(uploadFinished, upload_timeout):
+            raise Exception("The upload process timed out at {:.0f}%.".format(self.awgModule.getDouble('awgModule/progress')*100.0))
+        self.setValue('Last upload duration', time.monotonic() - upload_start)
+        self.phase_timer.record('ELF upload', upload_start, time.monotonic() - upload_start)
 
         if self.awgModule.getInt('awgModule/elf/status') == 0:
             print("Upload to the instrument successful.")
@@ -1225,15 +1380,18 @@ setTrigger(0);
         if self.awgModule.getInt('awgModule/elf/status') == 1:
             raise Exception("Upload to the instrument failed at {:.2f}".format(self.awgModule.getDouble('awgModule/progress')))
 
+        # Keep track of the program running on the device.
+        self.compiled_awg_program = program
+
         # If the device was playing before, enable playback again.
         if ((current_AWG_playback_status.get('awg')).get('enable')[0]) == 1:
-            i = 0
-            while ((self.awgModule.get('awgModule/awg/enable')).get('awg')).get('enable')[0] != 1:
-                time.sleep(0.1)
+            def playbackEnabled():
+                if ((self.awgModule.get('awgModule/awg/enable')).get('awg')).get('enable')[0] == 1:
+                    return True
                 self.awgModule.set('awgModule/awg/enable',1)
-                if i == 1:
-                    print('The AWG module is very slow to respond.')
-                i += 1;
+                return False
+            if not self.waitForCondition(playbackEnabled, 2.0):
+                self.log('The AWG module is very slow to respond, playback may not have been re-enabled.', level=30)
         self.log('UHFQA MEAS FINISHED RATO: '+str(self.amountOfRecordsToAverage)+'  upload',level=30)
 
 
@@ -1347,3 +1505,72 @@ setTrigger(0);
 #              norm_correlation_coeff, ".", sep="")
 #        return data_read
         pass
+
+
+"""
+###############################################################################
+    TIMING OF SWEEP POINTS
+###############################################################################
+"""
+
+# Record the durations of the phases of a sweep point, such as compiling or
+# waiting for the scope, using the monotonic clock. Every phase has a
+# histogram of its durations in bins of a quarter decade from 10 us, where
+# shorter and longer durations end up in the first and last bin. Optionally,
+# every span is appended to a trace file as one JSON object per line.
+class PhaseTimer(object):
+
+    # The histogram bins, in log10 of the duration in seconds
+    histogram_start = -5.0
+    histogram_step = 0.25
+    histogram_bins = 28
+
+    def __init__(self, phases):
+        self.phases = list(phases)
+        self.point = 0
+        self.trace_path = None
+        self.trace_file = None
+        self.reset()
+
+    # Clear the durations recorded so far
+    def reset(self):
+        self.histograms = {phase: np.zeros(self.histogram_bins) for phase in self.phases}
+        self.last_durations = {phase: 0.0 for phase in self.phases}
+        self.total_durations = {phase: 0.0 for phase in self.phases}
+        self.counts = {phase: 0 for phase in self.phases}
+
+    # Mark the start of a new sweep point in the trace
+    def beginPoint(self):
+        self.point += 1
+
+    # Record the duration of the enclosed block, even if it raises
+    @contextlib.contextmanager
+    def span(self, phase):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(phase, start, time.monotonic() - start)
+
+    # Record a span of phase, started at the monotonic time start
+    def record(self, phase, start, duration):
+        bin_index = int((np.log10(max(duration, 1e-12)) - self.histogram_start) // self.histogram_step)
+        self.histograms[phase][min(max(bin_index, 0), self.histogram_bins - 1)] += 1
+        self.last_durations[phase] = duration
+        self.total_durations[phase] += duration
+        self.counts[phase] += 1
+        if self.trace_file is not None:
+            self.trace_file.write(json.dumps({'point': self.point, 'phase': phase, 'start': start, 'duration': duration}) + '\n')
+
+    # Append the spans to the file at path, or stop tracing if path is None
+    # or empty. The file is only reopened if the path changes.
+    def setTraceFile(self, path):
+        path = path or None
+        if path == self.trace_path:
+            return
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+        self.trace_path = path
+        if path is not None:
+            self.trace_file = open(path, 'a')
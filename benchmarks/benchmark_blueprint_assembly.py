@@ -0,0 +1,87 @@
+#   @title      Blueprint assembly micro-benchmark
+#   @other      Compares the preallocated NumPy blueprint assembler of the
+#               HDAWG driver against the former list-growth assembler.
+#
+
+from __future__ import print_function
+
+import time
+
+import numpy as np
+
+from driver_loader import createBareDriver, loadDriverModule
+
+
+def assembleUsingLists(blueprint, primitives):
+    '''The former assembler, growing a Python list segment by segment.'''
+    
+    assembled_waveform = []
+    for i in range(0, len(blueprint), 2):
+        assembled_waveform.extend([0] * blueprint[i])
+        assembled_waveform.extend(primitives[i // 2])
+    
+    return assembled_waveform
+
+
+def syntheticBlueprint(segments, gap_length, primitive_lengths, seed=313):
+    '''Generate a blueprint of 'segments' gap and primitive pairs, drawing
+    from 16 random primitives with lengths picked from primitive_lengths.
+    '''
+    
+    random = np.random.RandomState(seed)
+    primitive_data = [ \
+        random.uniform(-1.0, 1.0, random.choice(primitive_lengths)) \
+            for primitive in range(0, 16)]
+    
+    blueprint = []
+    for segment in range(0, segments):
+        blueprint += [int(random.randint(0, gap_length)), \
+                      int(random.randint(0, 16))]
+    
+    return blueprint, [primitive_data[p] for p in blueprint[1::2]]
+
+
+def timeCall(function, repetitions):
+    '''Return the best wall time (in seconds) of several calls.'''
+    
+    best = float('inf')
+    for repetition in range(0, repetitions):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    
+    return best
+
+
+if __name__ == '__main__':
+    
+    driver = createBareDriver(loadDriverModule('HDAWG'))
+    
+    cases = [
+        ('10 segments, short',          10,   100, [64, 256]),
+        ('200 segments, ~100 kSa',     200,   200, [128, 512]),
+        ('500 segments, ~2 MSa',       500,  2000, [1024, 4096]),
+        ('100 segments, ~8 MSa',       100, 40000, [32768, 65536]),
+    ]
+    
+    print('{:<26}{:>12}{:>14}{:>14}{:>10}'.format( \
+        'Case', 'Samples', 'Lists [ms]', 'NumPy [ms]', 'Speedup'))
+    
+    for name, segments, gap_length, primitive_lengths in cases:
+        blueprint, primitives = \
+            syntheticBlueprint(segments, gap_length, primitive_lengths)
+        
+        reference = assembleUsingLists(blueprint, primitives)
+        result    = driver.assembleBlueprintWaveform(blueprint, primitives)
+        assert np.array_equal(np.asarray(reference, dtype = float), result)
+        
+        repetitions = 3 if len(result) > 10**6 else 20
+        list_time  = timeCall( \
+            lambda: assembleUsingLists(blueprint, primitives), repetitions)
+        numpy_time = timeCall( \
+            lambda: driver.assembleBlueprintWaveform(blueprint, primitives), \
+            repetitions)
+        
+        print('{:<26}{:>12}{:>14.3f}{:>14.3f}{:>9.1f}x'.format( \
+            name, len(result), list_time*1e3, numpy_time*1e3, \
+            list_time / numpy_time))
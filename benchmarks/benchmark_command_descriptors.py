@@ -0,0 +1,145 @@
+#   @title      Command descriptor micro-benchmark
+#   @other      Compares the parsed command descriptors of the HDAWG driver
+#               against parsing the set_cmd and get_cmd strings on every
+#               call, using a stand-in API that does no communication. The
+#               latter is done by the very same driver with the parsing of
+#               command descriptors disabled.
+#
+
+from __future__ import print_function
+
+import collections
+import time
+
+from driver_loader import createBareDriver, loadDriverModule
+
+
+class StubApi(object):
+    '''Stand-in ziDAQServer, keeping node values in a dictionary.'''
+
+    def __init__(self):
+        self.nodes = {}
+        self.calls = 0
+
+    def setDouble(self, path, value):
+        self.calls += 1
+        self.nodes[path] = value
+
+    def setInt(self, path, value):
+        self.calls += 1
+        self.nodes[path] = value
+
+    def set(self, node_writes):
+        self.calls += 1
+        for path, value in node_writes:
+            self.nodes[path] = value
+
+    def getDouble(self, path):
+        self.calls += 1
+        return float(self.nodes.get(path, 0.0))
+
+    def getInt(self, path):
+        self.calls += 1
+        return int(self.nodes.get(path, 0))
+
+
+class Quantity(object):
+    '''Stand-in Labber quantity.'''
+
+    def __init__(self, name, set_cmd, get_cmd, datatype, combo=None):
+        self.name     = name
+        self.set_cmd  = set_cmd
+        self.get_cmd  = get_cmd
+        self.datatype = datatype
+        self.combo    = combo or {}
+
+    def getCmdStringFromValue(self, value):
+        return self.combo[value]
+
+    def getValueFromCmdString(self, cmd_string):
+        for value in self.combo:
+            if float(self.combo[value]) == float(cmd_string):
+                return value
+        return cmd_string
+
+
+def timeCalls(function, calls):
+    '''Return the wall time (in seconds) of calling function calls times,
+    passing the call index.
+    '''
+
+    start = time.perf_counter()
+    for call in range(0, calls):
+        function(call)
+
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    calls = 100000
+
+    quantities = [
+        (Quantity('Channel 1 - Offset', 'double /%s/sigouts/0/offset', \
+            'double /%s/sigouts/0/offset', 0), [0.1, 0.2]),
+        (Quantity('Channel 1 - Output', 'boolean /%s/sigouts/0/on', \
+            'boolean /%s/sigouts/0/on', 1), [True, False]),
+        (Quantity('Trigger 1 - Impedance', 'int /%s/triggers/in/0/imp50', \
+            'int /%s/triggers/in/0/imp50', 2, {'1 kOhm': '0', \
+            '50 Ohm': '1'}), ['1 kOhm', '50 Ohm']),
+    ]
+
+    print('{:<34}{:>18}{:>18}{:>10}'.format( \
+        'Case (%d calls)' % calls, 'Scans [us/call]', \
+        'Parsed [us/call]', 'Speedup'))
+
+    for cache_node_values in [False, True]:
+
+        drivers = []
+        for use_descriptors in [False, True]:
+
+            driver = createBareDriver(loadDriverModule('HDAWG'), \
+                {'Cache node values': cache_node_values})
+            driver.dev = 'dev8000'
+            driver.daq = StubApi()
+            driver.pending_node_writes = []
+            driver.node_shadow         = {}
+            driver.set_descriptors     = {}
+            driver.get_descriptors     = {}
+
+            # Without descriptors, every call takes the string scanning route.
+            if not use_descriptors:
+                driver.set_descriptors = collections.defaultdict(lambda: None)
+                driver.get_descriptors = collections.defaultdict(lambda: None)
+
+            drivers.append(driver)
+
+        options = {'first': False, 'final': False}
+
+        for quant, values in quantities:
+
+            label = ' (node shadow)' if cache_node_values else ''
+
+            for operation in ['set', 'get']:
+
+                times = []
+                for driver in drivers:
+
+                    # Flush the buffered writes as often as a sweep with a
+                    # hundred quantities per point would.
+                    def setValue(call):
+                        driver.performSetValue(quant, values[call % 2], \
+                            options = options)
+                        if call % 100 == 99:
+                            driver.flushNodeWrites()
+
+                    def getValue(call):
+                        driver.performGetValue(quant)
+
+                    times.append(timeCalls( \
+                        setValue if operation == 'set' else getValue, calls))
+
+                print('{:<34}{:>18.3f}{:>18.3f}{:>9.1f}x'.format( \
+                    quant.name.split(' - ')[1] + ' ' + operation + label, \
+                    times[0] / calls * 1e6, times[1] / calls * 1e6, \
+                    times[0] / times[1]))
@@ -0,0 +1,75 @@
+#   @title      Scope record extraction micro-benchmark
+#   @other      Compares the single-pass scope record averaging of the UHFQA
+#               driver against the former extraction, which iterated all
+#               records once per channel into Python lists before averaging.
+#
+
+from __future__ import print_function
+
+import time
+
+import numpy as np
+
+from driver_loader import createBareDriver, loadDriverModule
+
+
+def averageUsingLists(acquired, amount_of_records, channels):
+    '''The former extraction, one pass and one list per channel.'''
+
+    averages = []
+    for channel in channels:
+        data = []
+        for i, record in enumerate(acquired):
+            wave = record[0]['wave']
+            data.append(wave[channel])
+        averages.append(np.mean(data[:amount_of_records], axis=0))
+
+    return averages
+
+
+def syntheticRecords(records, samples, seed=313):
+    '''Generate two-channel records, shaped like the records returned by
+    a flat read of the scope module.
+    '''
+
+    random = np.random.RandomState(seed)
+    return [[{'timestamp': record, \
+        'wave': random.uniform(-1.0, 1.0, (2, samples))}] \
+            for record in range(0, records)]
+
+
+def timeCall(function, *arguments):
+    '''Return the result and the wall time (in seconds) of a call.'''
+
+    start = time.perf_counter()
+    result = function(*arguments)
+
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    driver = createBareDriver(loadDriverModule('UHFQA'))
+
+    print('{:<24}{:>14}{:>14}{:>10}'.format( \
+        'Records x samples', 'Lists [ms]', 'Single [ms]', 'Speedup'))
+
+    for records, samples in [(1000, 4096), (10000, 4096)]:
+
+        acquired = syntheticRecords(records, samples)
+        driver.amountOfRecordsToAverage = records
+
+        former, former_time = timeCall( \
+            averageUsingLists, acquired, records, [0, 1])
+        single, single_time = timeCall( \
+            driver.averageScopeRecords, acquired[:records])
+
+        # Both extractions must agree on the averages.
+        assert np.allclose(former[0], single[0]) and \
+               np.allclose(former[1], single[1])
+
+        print('{:<24}{:>14.1f}{:>14.1f}{:>9.1f}x'.format( \
+            '%d x %d' % (records, samples), former_time * 1e3, \
+            single_time * 1e3, former_time / single_time))
+
+        del acquired
@@ -0,0 +1,192 @@
+#   @title      Sweep benchmarks against a simulated instrument
+#   @other      Opens the HDAWG and UHFQA drivers against the simulated ZI API
+#               of simulated_zi.py, and runs sweeps resembling those of a
+#               measurement through performSetValue and performGetValue.
+#               Reports the latency per sweep point, the amount of API calls
+#               per sweep point and the peak memory allocated by each sweep.
+#
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+
+import numpy as np
+
+from driver_loader import getQuantity, loadDriverModule, openDriver, \
+    setHardwareLoopPoint, setQuantities
+from simulated_zi import SimulatedZi, SimulatorSettings
+
+
+def pulse(samples, amplitude=1.0, frequency=20.0):
+    '''A Gaussian-windowed sine, as typically swept in a measurement.'''
+
+    time_axis = np.linspace(-1.0, 1.0, samples)
+    return amplitude * np.exp(-8 * time_axis**2) * \
+        np.sin(frequency * np.pi * time_axis)
+
+
+def hdawgAmplitudeSweep(driver, points):
+    '''Sweep the amplitude of two channels, the sequencer is left as is.'''
+
+    for amplitude in np.linspace(0.05, 1.0, points):
+        yield lambda amplitude = amplitude: setQuantities(driver, [ \
+            ('Channel 1 - Waveform', pulse(4096, amplitude)), \
+            ('Channel 2 - Waveform', pulse(4096, -amplitude))])
+
+
+def hdawgOffsetSweep(driver, points):
+    '''Sweep a node value, next to unchanged waveforms.'''
+
+    for offset in np.linspace(-0.1, 0.1, points):
+        yield lambda offset = offset: setQuantities(driver, [ \
+            ('Channel 1 - Offset', offset), \
+            ('Channel 1 - Waveform', pulse(4096, 0.5)), \
+            ('Channel 2 - Waveform', pulse(4096, -0.5))])
+
+
+def hdawgLengthSweep(driver, points):
+    '''Toggle between a few waveform lengths, every point requires another
+    sequencer program.
+    '''
+
+    lengths = [1024, 2048, 4096, 8192]
+    for point in range(0, points):
+        yield lambda point = point: setQuantities(driver, [ \
+            ('Channel 1 - Waveform', pulse(lengths[point % len(lengths)]))])
+
+
+def hdawgLibrarySweep(driver, points):
+    '''Repeat an amplitude sweep of two channels with the waveform library
+    enabled. Once all amplitudes were played, points only select a slot.
+    '''
+
+    setQuantities(driver, [('Waveform library', True)])
+
+    amplitudes = np.linspace(0.05, 1.0, 8)
+    for point in range(0, points):
+        amplitude = amplitudes[point % len(amplitudes)]
+        yield lambda amplitude = amplitude: setQuantities(driver, [ \
+            ('Channel 1 - Waveform', pulse(4096, amplitude)), \
+            ('Channel 2 - Waveform', pulse(4096, -amplitude))])
+
+
+def hdawgHardwareLoopSweep(driver, points):
+    '''The amplitude sweep of two channels as a hardware loop. The whole
+    loop is uploaded once its last point is set.
+    '''
+    
+    setQuantities(driver, [('Waveform library', False)])
+    
+    for point, amplitude in enumerate(np.linspace(0.05, 1.0, points)):
+        yield lambda point = point, amplitude = amplitude: \
+            setHardwareLoopPoint(driver, [ \
+                ('Channel 1 - Waveform', pulse(4096, amplitude)), \
+                ('Channel 2 - Waveform', pulse(4096, -amplitude))], \
+                point, points)
+
+
+def uhfqaScopeSweep(driver, points):
+    '''Sweep the amplitude of a loaded vector, reading the averaged scope
+    trace at every point.
+    '''
+
+    def point(amplitude):
+        setQuantities(driver, [('LoadedVector1', pulse(2048, amplitude))])
+        getQuantity(driver, 'ScopedVector1')
+
+    for amplitude in np.linspace(0.05, 1.0, points):
+        yield lambda amplitude = amplitude: point(amplitude)
+
+
+def runSweep(simulator, sweep):
+    '''Run every point of sweep, and return the latencies (in seconds) and
+    the amount of API calls of every point, and the peak memory allocated.
+    '''
+
+    latencies = []
+    calls = []
+
+    tracemalloc.start()
+    for point in sweep:
+        calls_before = simulator.totalCalls()
+        start = time.perf_counter()
+        point()
+        latencies.append(time.perf_counter() - start)
+        calls.append(simulator.totalCalls() - calls_before)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return np.array(latencies), np.array(calls), peak_memory
+
+
+def report(name, latencies, calls, peak_memory):
+    print('{:<34}{:>8}{:>12.2f}{:>12.2f}{:>10.1f}{:>12.1f}'.format( \
+        name, len(latencies), np.mean(latencies) * 1e3, \
+        np.percentile(latencies, 95) * 1e3, np.mean(calls), \
+        peak_memory / 2.0**20))
+
+
+def benchmarkHdawg(settings, points):
+
+    simulator = SimulatedZi(settings)
+    try:
+        # The drivers report to the standard output, keep the table clean.
+        with contextlib.redirect_stdout(io.StringIO()):
+            driver = openDriver(loadDriverModule('HDAWG', simulator), 'HDAWG')
+
+        for name, sweep in [ \
+            ('HDAWG waveform amplitude', hdawgAmplitudeSweep), \
+            ('HDAWG channel offset', hdawgOffsetSweep), \
+            ('HDAWG waveform length', hdawgLengthSweep), \
+            ('HDAWG waveform library', hdawgLibrarySweep), \
+            ('HDAWG hardware loop', hdawgHardwareLoopSweep)]:
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = runSweep(simulator, sweep(driver, points))
+            report(name, *results)
+    finally:
+        simulator.cleanUp()
+
+
+def benchmarkUhfqa(settings, points):
+
+    settings.device_type = 'UHFQA'
+    settings.device_options = ['AWG']
+
+    simulator = SimulatedZi(settings)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            driver = openDriver(loadDriverModule('UHFQA', simulator), 'UHFQA')
+            setQuantities(driver, [('ScopedVector1Enabled', True), \
+                ('RecordAmountToAverage', 100)])
+
+        for stream in [False, True]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                setQuantities(driver, [('Stream scope records', stream)])
+                results = runSweep(simulator, uhfqaScopeSweep(driver, points))
+            report('UHFQA scope, %s' % \
+                ('streamed average' if stream else 'read average'), *results)
+    finally:
+        simulator.cleanUp()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type = int, default = 40, \
+        help = 'Amount of points of every sweep.')
+    parser.add_argument('--latency', type = float, default = 0.0, \
+        help = 'Latency added to every simulated API call, in microseconds.')
+    arguments = parser.parse_args()
+
+    print('{:<34}{:>8}{:>12}{:>12}{:>10}{:>12}'.format('Sweep', 'Points', \
+        'Mean [ms]', 'p95 [ms]', 'Calls', 'Peak [MiB]'))
+
+    benchmarkHdawg(SimulatorSettings( \
+        call_latency = arguments.latency * 1e-6), arguments.points)
+    benchmarkUhfqa(SimulatorSettings( \
+        call_latency = arguments.latency * 1e-6), arguments.points)
@@ -0,0 +1,96 @@
+#   @title      Pipelined waveform upload benchmark
+#   @other      Updates all eight channels of a simulated HDAWG8 at every
+#               sweep point, with the waveform uploads either pipelined
+#               (the next AWG core is encoded while the previous one is
+#               transferred) or sequential, as the former upload loop did.
+#               The simulated API transfers vectors at a fixed rate.
+#
+
+from __future__ import print_function
+
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from driver_loader import getQuantity, loadDriverModule, openDriver, \
+    setQuantities
+from simulated_zi import SimulatedZi, SimulatorSettings
+
+# Transfer rate of the simulated instrument link, in bytes per second.
+TRANSFER_RATE = 100e6
+
+# Sweep points per measurement.
+POINTS = 10
+
+
+def eightChannelUpdate(samples, amplitude):
+    '''Waveforms for all eight channels, every one of them changed by a
+    new amplitude.
+    '''
+
+    time_axis = np.linspace(-1.0, 1.0, samples)
+    envelope = amplitude * np.exp(-8 * time_axis**2)
+    return [('Channel %d - Waveform' % (channel + 1), \
+        envelope * np.sin((channel + 1) * 10 * np.pi * time_axis)) \
+            for channel in range(0, 8)]
+
+
+def timeUpdates(samples, pipelined):
+    '''Return the mean wall time (in seconds) of an eight-channel update,
+    the mean duration of its waveform upload phase, and the amount of bytes
+    uploaded per update.
+    '''
+
+    simulator = SimulatedZi(SimulatorSettings( \
+        device_type = 'HDAWG8', vector_transfer_rate = TRANSFER_RATE))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            driver = openDriver( \
+                loadDriverModule('HDAWG', simulator), 'HDAWG')
+            setQuantities(driver, \
+                [('Pipeline waveform uploads', pipelined), \
+                 ('Internal trigger period', 1.0)] + \
+                eightChannelUpdate(samples, 0.1))
+            setQuantities(driver, [('Reset timing', True), \
+                ('Timing phase', 'Waveform upload')])
+
+            durations = []
+            uploaded_bytes = []
+            for amplitude in np.linspace(0.2, 1.0, POINTS):
+                start = time.perf_counter()
+                setQuantities(driver, eightChannelUpdate(samples, amplitude))
+                durations.append(time.perf_counter() - start)
+                uploaded_bytes.append(driver.getValue('Waveform bytes uploaded'))
+
+            upload_phase = getQuantity(driver, 'Timing mean duration')
+            driver.performClose()
+    finally:
+        simulator.cleanUp()
+
+    return np.mean(durations), upload_phase, np.mean(uploaded_bytes)
+
+
+if __name__ == '__main__':
+
+    print('Wall time per eight-channel update, and of its upload phase, ' + \
+        'at %.0f MB/s.' % (TRANSFER_RATE / 1e6))
+    print('{:<18}{:>14}{:>22}{:>22}{:>10}'.format('Samples/channel', \
+        'Uploaded [MB]', 'Sequential [ms]', 'Pipelined [ms]', 'Upload'))
+
+    for samples in [16384, 131072, 1048576]:
+
+        sequential, sequential_upload, sequential_bytes = \
+            timeUpdates(samples, False)
+        pipelined, pipelined_upload, pipelined_bytes = \
+            timeUpdates(samples, True)
+
+        # Both upload paths must transfer the same data.
+        assert sequential_bytes == pipelined_bytes
+
+        print('{:<18}{:>14.1f}{:>12.1f} ({:>6.1f}){:>12.1f} ({:>6.1f}){:>9.2f}x' \
+            .format(samples, pipelined_bytes / 1e6, \
+            sequential * 1e3, sequential_upload * 1e3, \
+            pipelined * 1e3, pipelined_upload * 1e3, \
+            sequential_upload / pipelined_upload))
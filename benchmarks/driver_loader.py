@@ -0,0 +1,325 @@
+#   @title      Driver loader for offline benchmarks
+#   @other      Loads the Labber drivers of this repository without Labber,
+#               LabOne or an instrument being present.
+#
+
+#######################################################
+""" Load the drivers using stand-in dependencies. """
+#######################################################
+
+from __future__ import print_function
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+import importlib.util
+import os
+import sys
+import types
+
+import numpy as np
+
+# Location of the drivers, relative to this file.
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Quantity(object):
+    '''Minimal stand-in for a Labber quantity, as declared by a section of
+    the instruction (.ini) file of a driver.
+    '''
+    
+    # Datatype indices, as used by Labber.
+    DATATYPES = ['DOUBLE', 'BOOLEAN', 'COMBO', 'STRING', 'COMPLEX', \
+        'VECTOR', 'VECTOR_COMPLEX', 'PATH', 'BUTTON']
+    
+    def __init__(self, name, section):
+        self.name     = name
+        self.datatype = self.DATATYPES.index(section.get('datatype').upper())
+        self.set_cmd  = section.get('set_cmd', '')
+        self.get_cmd  = section.get('get_cmd', '')
+        
+        # Combo labels and their command strings, in order of declaration.
+        self.combo_defs = []
+        self.cmd_defs   = []
+        index = 1
+        while ('combo_def_%d' % index) in section:
+            label = section.get('combo_def_%d' % index)
+            self.combo_defs.append(label)
+            self.cmd_defs.append(section.get('cmd_def_%d' % index, label))
+            index += 1
+        
+        self.default_value = self.parseValue(section.get('def_value'))
+    
+    def parseValue(self, text):
+        '''Return the value of a quantity given as text in the instruction
+        file, or its default value if text is None.
+        '''
+        
+        datatype = self.DATATYPES[self.datatype]
+        if datatype in ['DOUBLE', 'COMPLEX']:
+            return 0.0 if text is None else float(text)
+        elif datatype in ['BOOLEAN', 'BUTTON']:
+            return (text is not None) and (text.strip().lower() == 'true')
+        elif datatype == 'COMBO':
+            if text is None:
+                return self.combo_defs[0] if self.combo_defs else ''
+            return text
+        elif datatype in ['VECTOR', 'VECTOR_COMPLEX']:
+            return np.array([])
+        return '' if text is None else text
+    
+    def coerceValue(self, value):
+        '''Labber accepts combo values given by their index.'''
+        
+        if (self.DATATYPES[self.datatype] == 'COMBO') and \
+            not (value in self.combo_defs) and \
+            isinstance(value, (int, np.integer)) and \
+            (0 <= value < len(self.combo_defs)):
+            return self.combo_defs[value]
+        return value
+    
+    def getValueIndex(self, value):
+        return self.combo_defs.index(self.coerceValue(value))
+    
+    def getCmdStringFromValue(self, value):
+        if self.DATATYPES[self.datatype] == 'COMBO':
+            return self.cmd_defs[self.getValueIndex(value)]
+        return value
+    
+    def getValueFromCmdString(self, cmd_string):
+        datatype = self.DATATYPES[self.datatype]
+        if datatype == 'COMBO':
+            for label, cmd_def in zip(self.combo_defs, self.cmd_defs):
+                if str(cmd_def) == str(cmd_string):
+                    return label
+                try:
+                    if float(cmd_def) == float(cmd_string):
+                        return label
+                except ValueError:
+                    pass
+            raise ValueError("'%s' is not a command string of '%s'." % \
+                (cmd_string, self.name))
+        elif datatype == 'BOOLEAN':
+            return bool(float(cmd_string))
+        elif datatype == 'DOUBLE':
+            return float(cmd_string)
+        return cmd_string
+    
+    def getTraceDict(self, value, t0=0.0, dt=1.0):
+        return {'y': np.asarray(value), 't0': t0, 'dt': dt}
+
+
+def loadQuantities(instrument):
+    '''Return the quantities declared by the instruction file of the
+    instrument, as an ordered dictionary of Quantity objects by name.
+    '''
+    
+    parser = configparser.RawConfigParser(strict = False)
+    parser.optionxform = str
+    path = os.path.join(REPOSITORY_DIR, 'Zurich Instruments %s.ini' % instrument)
+    with open(path) as instruction_file:
+        parser.read_file(instruction_file)
+    
+    quantities = {}
+    for name in parser.sections():
+        if parser.has_option(name, 'datatype'):
+            quantities[name] = Quantity(name, dict(parser.items(name)))
+    
+    return quantities
+
+
+class LabberDriver(object):
+    '''Minimal stand-in for BaseDriver.LabberDriver.
+    
+    Values are kept in a plain dictionary, and every call is treated as both
+    the first and the final call unless the options state otherwise. When
+    quantities are given, values default to those of the instruction file,
+    combo values are handled as Labber does, and setting an unknown quantity
+    raises an error.
+    '''
+    
+    def __init__(self, values=None, quantities=None):
+        self.quantities = quantities or {}
+        self.values = {name: quantity.default_value \
+            for name, quantity in self.quantities.items()}
+        self.values.update(values or {})
+        self.log_messages = []
+    
+    def getValue(self, name):
+        return self.values.get(name)
+    
+    def setValue(self, name, value):
+        if self.quantities:
+            if not name in self.quantities:
+                raise KeyError("Unknown quantity: '%s'" % name)
+            value = self.quantities[name].coerceValue(value)
+        self.values[name] = value
+        return value
+    
+    def getValueArray(self, name):
+        value = self.values.get(name)
+        return np.array([]) if value is None else np.asarray(value)
+    
+    def getValueIndex(self, name):
+        if name in self.quantities:
+            return self.quantities[name].getValueIndex(self.values[name])
+        return self.values.get(name + ' index', 0)
+    
+    def getCmdStringFromValue(self, name):
+        if name in self.quantities:
+            return self.quantities[name].getCmdStringFromValue( \
+                self.values[name])
+        return self.values.get(name + ' cmd', self.values.get(name))
+    
+    def log(self, message, level=20):
+        self.log_messages.append((level, message))
+    
+    def isFirstCall(self, options={}):
+        return options.get('first', True)
+    
+    def isFinalCall(self, options={}):
+        return options.get('final', True)
+    
+    def isHardwareLoop(self, options={}):
+        return options.get('hw_loop', False)
+    
+    def getHardwareLoopIndex(self, options={}):
+        return (options.get('seq_no', 0), options.get('n_seq', 1))
+    
+    def isStopped(self):
+        return False
+
+
+def installStandInModules():
+    '''Register stand-in modules for BaseDriver, zhinst and (if missing)
+    psutil, so that the driver files may be imported.
+    '''
+    
+    base_driver = types.ModuleType('BaseDriver')
+    base_driver.LabberDriver = LabberDriver
+    base_driver.Error        = Exception
+    base_driver.IdError      = Exception
+    sys.modules['BaseDriver'] = base_driver
+    
+    if not 'zhinst' in sys.modules:
+        zhinst       = types.ModuleType('zhinst')
+        zhinst_utils = types.ModuleType('zhinst.utils')
+        zhinst_utils.convert_awg_waveform = convert_awg_waveform
+        zhinst.ziPython = types.ModuleType('zhinst.ziPython')
+        zhinst.utils    = zhinst_utils
+        sys.modules['zhinst']          = zhinst
+        sys.modules['zhinst.ziPython'] = zhinst.ziPython
+        sys.modules['zhinst.utils']    = zhinst_utils
+    
+    try:
+        import psutil
+    except ImportError:
+        sys.modules['psutil'] = types.ModuleType('psutil')
+
+
+def convert_awg_waveform(wave1, wave2=None, markers=None):
+    '''Stand-in for zhinst.utils.convert_awg_waveform, producing the native
+    interleaved AWG format with markers in the two least significant bits.
+    '''
+    
+    def uint16_waveform(wave):
+        return np.asarray( \
+            (2**15 - 1) * np.asarray(wave), dtype = np.int16).view(np.uint16)
+    
+    mask = 0xFFFF if markers is None else 0xFFFC
+    wave1_uint = np.bitwise_and(uint16_waveform(wave1), mask)
+    if markers is not None:
+        marker_uint = np.asarray(markers, dtype = np.uint16)
+        wave1_uint  = np.bitwise_or(wave1_uint, marker_uint & 0b0011)
+    
+    if wave2 is None:
+        return wave1_uint
+    
+    wave2_uint = np.bitwise_and(uint16_waveform(wave2), mask)
+    if markers is not None:
+        wave2_uint = np.bitwise_or(wave2_uint, (marker_uint & 0b1100) >> 2)
+    
+    return np.vstack((wave1_uint, wave2_uint)).reshape((-2,), order = 'F')
+
+
+def loadDriverModule(instrument, simulator=None):
+    '''Import 'Zurich Instruments <instrument>.py' as a module, where
+    instrument is either 'HDAWG' or 'UHFQA'. If a simulator is given (see
+    simulated_zi.py), the driver uses the simulated API.
+    '''
+    
+    if simulator is not None:
+        simulator.installModules()
+    installStandInModules()
+    
+    path = os.path.join(REPOSITORY_DIR, 'Zurich Instruments %s.py' % instrument)
+    spec = importlib.util.spec_from_file_location( \
+        'zurich_instruments_' + instrument.lower(), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    
+    return module
+
+
+def createBareDriver(module, values=None):
+    '''Instantiate a Driver of the given driver module without opening any
+    instrument connection.
+    '''
+    
+    driver = module.Driver.__new__(module.Driver)
+    LabberDriver.__init__(driver, values)
+    
+    return driver
+
+
+def openDriver(module, instrument, address='dev8000', values=None):
+    '''Instantiate a Driver of the given driver module, with the quantities
+    of its instruction file, and open it as the Instrument Server would.
+    '''
+    
+    driver = module.Driver.__new__(module.Driver)
+    LabberDriver.__init__(driver, values, loadQuantities(instrument))
+    driver.comCfg = types.SimpleNamespace(address = address)
+    driver.performOpen()
+    
+    return driver
+
+
+def setQuantities(driver, writes, loop_options=None):
+    '''Set the (name, value) pairs of writes as one sweep point, the way
+    the Instrument Server does: only the first and the last call are flagged
+    as such. The values are stored before the final call, where the drivers
+    fetch them, and are then replaced by the values returned. loop_options
+    are added to the options of every call, see setHardwareLoopPoint.
+    '''
+    
+    for name, value in writes:
+        driver.values[name] = driver.quantities[name].coerceValue(value)
+    
+    for index, (name, value) in enumerate(writes):
+        options = {'first': index == 0, 'final': index == len(writes) - 1}
+        options.update(loop_options or {})
+        driver.values[name] = driver.performSetValue( \
+            driver.quantities[name], driver.values[name], 0.0, options)
+
+
+def setHardwareLoopPoint(driver, writes, index, n_points):
+    '''Set the writes of point index of a hardware loop of n_points, and
+    arm the driver once the last point is set.
+    '''
+    
+    setQuantities(driver, writes, \
+        {'hw_loop': True, 'seq_no': index, 'n_seq': n_points})
+    
+    if index == n_points - 1:
+        driver.performArm([name for name, value in writes], {})
+
+
+def getQuantity(driver, name):
+    '''Get the value of a quantity the way the Instrument Server does.'''
+    
+    value = driver.performGetValue(driver.quantities[name], {})
+    driver.values[name] = value
+    
+    return value
@@ -0,0 +1,416 @@
+#   @title      Simulated Zurich Instruments API
+#   @other      An in-process stand-in for ziDAQServer, its AWG and scope
+#               modules, zhinst.utils and psutil, so that the drivers of this
+#               repository may be opened and swept without LabOne or an
+#               instrument being present.
+#
+#               The simulator keeps a node tree, counts every API call, and
+#               models the compiler, the ELF upload and the scope records in
+#               wall-clock time. An optional latency is added to every call.
+#
+
+from __future__ import print_function
+
+import collections
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+from driver_loader import convert_awg_waveform
+
+
+class SimulatorSettings(object):
+    '''Timing and device parameters of the simulator. All durations are
+    in seconds.
+    '''
+
+    def __init__(self, **settings):
+
+        # Latency added to every API call.
+        self.call_latency = 0.0
+
+        # Compile time: a fixed part, and a part per kilobyte of source.
+        self.compile_time = 0.020
+        self.compile_time_per_kB = 0.001
+
+        # Upload time of an ELF file, once compiled or requested.
+        self.upload_time = 0.010
+
+        # Transfer rate of vector writes, in bytes per second. Zero means
+        # that vectors are transferred instantly.
+        self.vector_transfer_rate = 0.0
+
+        # Waveform memory of the sequencer, in samples. The memory usage
+        # node reports the share declared by the compiled program.
+        self.waveform_memory = 2**24
+
+        # Scope records: trigger rate, samples per record, and the amount of
+        # records kept in the history of the scope module.
+        self.record_rate = 10000.0
+        self.record_length = 4096
+        self.history_length = 100
+
+        # The device reported by the simulated API.
+        self.device_type = 'HDAWG8'
+        self.device_options = ['MF', 'ME']
+        self.labone_version = '20.01'
+
+        for name in settings:
+            if not hasattr(self, name):
+                raise AttributeError("Unknown simulator setting: " + name)
+            setattr(self, name, settings[name])
+
+
+class SimulatedZi(object):
+    '''The simulated API, owning one ziDAQServer and its modules.
+
+    installModules registers stand-ins for zhinst.ziPython, zhinst.utils and
+    psutil, which hand out the simulated objects of this instance. Drivers
+    loaded afterwards use this simulator.
+    '''
+
+    def __init__(self, settings=None):
+        self.settings = settings or SimulatorSettings()
+        self.awg_data_dir = tempfile.mkdtemp(prefix = 'simulated_zi_')
+        os.makedirs(os.path.join(self.awg_data_dir, 'awg', 'waves'))
+        os.makedirs(os.path.join(self.awg_data_dir, 'awg', 'elf'))
+
+        self.calls = collections.Counter()
+        self.daq = SimulatedDaq(self)
+        self.awg_module = SimulatedAwgModule(self)
+        self.scope_module = SimulatedScopeModule(self)
+
+    def call(self, name):
+        '''Count an API call and apply the call latency.'''
+
+        self.calls[name] += 1
+        if self.settings.call_latency > 0:
+            time.sleep(self.settings.call_latency)
+
+    def totalCalls(self):
+        return sum(self.calls.values())
+
+    def cleanUp(self):
+        '''Remove the simulated AWG data directory.'''
+
+        shutil.rmtree(self.awg_data_dir, ignore_errors = True)
+
+    def installModules(self):
+        '''Register the stand-in modules in sys.modules.'''
+
+        simulator = self
+
+        zi_python = types.ModuleType('zhinst.ziPython')
+        zi_python.ziDAQServer = lambda *arguments: simulator.daq
+        zi_python.ziDiscovery = SimulatedDiscovery
+
+        zi_utils = types.ModuleType('zhinst.utils')
+        zi_utils.ZIAPINotFoundException = type( \
+            'ZIAPINotFoundException', (Exception,), {})
+        zi_utils.api_server_version_check = lambda daq: None
+        zi_utils.autoConnect = lambda api_level = 6: simulator.daq
+        zi_utils.autoDetect  = lambda daq: 'dev8000'
+        zi_utils.disable_everything = \
+            lambda daq, device: daq.set([['/%s/*/enable' % device, 0]])
+        zi_utils.convert_awg_waveform = convert_awg_waveform
+
+        def createApiSession(address, api_level, required_devtype = '.*', \
+            required_options = None, required_err_msg = ''):
+            return simulator.daq, address.lower(), { \
+                'devicetype': simulator.settings.device_type, \
+                'options': list(simulator.settings.device_options)}
+        zi_utils.create_api_session = createApiSession
+
+        zhinst = types.ModuleType('zhinst')
+        zhinst.ziPython = zi_python
+        zhinst.utils    = zi_utils
+
+        process = types.SimpleNamespace(name = lambda: 'ziService.exe')
+        psutil = types.ModuleType('psutil')
+        psutil.pids    = lambda: [0]
+        psutil.Process = lambda process_id: process
+
+        sys.modules['zhinst']          = zhinst
+        sys.modules['zhinst.ziPython'] = zi_python
+        sys.modules['zhinst.utils']    = zi_utils
+        sys.modules['psutil']          = psutil
+
+
+class SimulatedDiscovery(object):
+    '''Stand-in for ziDiscovery, finding every device on localhost.'''
+
+    def find(self, device):
+        return device
+
+    def get(self, device):
+        return {'deviceid': device, 'serveraddress': 'localhost', \
+            'serverport': 8004, 'apilevel': 6, 'interfaces': ['1GbE']}
+
+
+class SimulatedDaq(object):
+    '''Stand-in for ziDAQServer, keeping the node values in a dictionary.
+    Nodes never written read as zero.
+    '''
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.nodes = {}
+        self.vector_bytes = 0
+
+    def version(self):
+        self.simulator.call('version')
+        return self.simulator.settings.labone_version
+
+    def connectDevice(self, device, interface):
+        self.simulator.call('connectDevice')
+
+    def awgModule(self):
+        self.simulator.call('awgModule')
+        return self.simulator.awg_module
+
+    def scopeModule(self):
+        self.simulator.call('scopeModule')
+        return self.simulator.scope_module
+
+    def sync(self):
+        self.simulator.call('sync')
+
+    def set(self, node_writes):
+        self.simulator.call('set')
+        for path, value in node_writes:
+            self.nodes[path.lower()] = value
+
+    def setInt(self, path, value):
+        self.simulator.call('setInt')
+        self.nodes[path.lower()] = int(value)
+
+    def setDouble(self, path, value):
+        self.simulator.call('setDouble')
+        self.nodes[path.lower()] = float(value)
+
+    def setString(self, path, value):
+        self.simulator.call('setString')
+        self.nodes[path.lower()] = str(value)
+
+    def setVector(self, path, vector):
+        self.simulator.call('setVector')
+        vector_bytes = np.asarray(vector).nbytes
+        self.vector_bytes += vector_bytes
+        if self.simulator.settings.vector_transfer_rate > 0:
+            time.sleep(vector_bytes / \
+                self.simulator.settings.vector_transfer_rate)
+
+    def getInt(self, path):
+        self.simulator.call('getInt')
+        return int(self.nodes.get(path.lower(), 0))
+
+    def getDouble(self, path):
+        self.simulator.call('getDouble')
+        return float(self.nodes.get(path.lower(), 0.0))
+
+    def getString(self, path):
+        self.simulator.call('getString')
+        return str(self.nodes.get(path.lower(), ''))
+
+    def getByte(self, path):
+        self.simulator.call('getByte')
+        if path.endswith('/features/devtype'):
+            return self.simulator.settings.device_type
+        if path.endswith('/features/options'):
+            return '\n'.join(self.simulator.settings.device_options)
+        return str(self.nodes.get(path.lower(), ''))
+
+
+class SimulatedAwgModule(object):
+    '''Stand-in for the AWG module. Setting a source string starts a
+    compilation, which is followed by an upload of the compiled ELF file.
+    Both finish after the durations given by the simulator settings.
+    '''
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.nodes = { \
+            'awgModule/directory': simulator.awg_data_dir, \
+            'awgModule/compiler/status': 0, \
+            'awgModule/compiler/statusstring': '', \
+            'awgModule/elf/file': '', \
+            'awgModule/elf/status': 0, \
+            'awgModule/progress': 1.0, \
+            'awgModule/awg/enable': 0}
+        self.compile_end = 0.0
+        self.upload_start = 0.0
+        self.upload_end = 0.0
+        self.compilations = 0
+        self.uploads = 0
+
+    def execute(self):
+        self.simulator.call('awgModule.execute')
+
+    def finish(self):
+        self.simulator.call('awgModule.finish')
+
+    def set(self, path, value):
+        self.simulator.call('awgModule.set')
+        self.nodes[path] = value
+        simulator = self.simulator
+        settings = simulator.settings
+
+        if path == 'awgModule/compiler/sourcestring':
+            self.compilations += 1
+            now = time.monotonic()
+            self.compile_end = now + settings.compile_time + \
+                settings.compile_time_per_kB * len(value) / 1000.0
+            self.startUpload(self.compile_end)
+
+            # Write the ELF file that the compiler would produce.
+            elf_file = '%s_awg_default.elf' % self.nodes.get( \
+                'awgModule/device', 'dev')
+            with open(os.path.join(self.simulator.awg_data_dir, 'awg', \
+                'elf', elf_file), 'w') as elf:
+                elf.write(value)
+            self.nodes['awgModule/elf/file'] = elf_file
+            self.reportMemoryUsage(value)
+
+        elif (path == 'awgModule/elf/upload') and value:
+            self.startUpload(time.monotonic())
+
+            # The simulated ELF files hold their source program.
+            elf_file = os.path.join(simulator.awg_data_dir, 'awg', 'elf', \
+                self.nodes.get('awgModule/elf/file', ''))
+            if os.path.isfile(elf_file):
+                with open(elf_file) as elf:
+                    self.reportMemoryUsage(elf.read())
+
+    def reportMemoryUsage(self, source):
+        '''Report the share of waveform memory declared by a program.'''
+
+        declared_samples = sum(int(samples) for samples in re.findall( \
+            r'(?:zeros|randomUniform)\((\d+)', source))
+        self.simulator.daq.nodes['/%s/awgs/0/waveform/memoryusage' % \
+            self.nodes.get('awgModule/device', 'dev').lower()] = \
+            declared_samples / float(self.simulator.settings.waveform_memory)
+
+    def startUpload(self, start):
+        self.uploads += 1
+        self.upload_start = start
+        self.upload_end = start + self.simulator.settings.upload_time
+
+    def modelledValue(self, path):
+        '''Return the value of path, with the compiler and upload nodes
+        following the progress model.
+        '''
+
+        now = time.monotonic()
+        if path == 'awgModule/compiler/status':
+            return -1 if now < self.compile_end else 0
+        if path == 'awgModule/progress':
+            if now >= self.upload_end:
+                return 1.0
+            return max(0.0, (now - self.upload_start) / \
+                (self.upload_end - self.upload_start))
+        if path == 'awgModule/elf/status':
+            return 2 if now < self.upload_end else 0
+        return self.nodes.get(path, 0)
+
+    def get(self, path):
+        '''Return the value of path nested as the AWG module does, for
+        instance {'awg': {'enable': [0]}} for 'awgModule/awg/enable'.
+        '''
+
+        self.simulator.call('awgModule.get')
+        nested = [self.modelledValue(path)]
+        for key in reversed(path.split('/')[1:]):
+            nested = {key: nested}
+        return nested
+
+    def getInt(self, path):
+        self.simulator.call('awgModule.getInt')
+        return int(self.modelledValue(path))
+
+    def getDouble(self, path):
+        self.simulator.call('awgModule.getDouble')
+        return float(self.modelledValue(path))
+
+    def getString(self, path):
+        self.simulator.call('awgModule.getString')
+        return str(self.modelledValue(path))
+
+
+class SimulatedScopeModule(object):
+    '''Stand-in for the scope module. Once executed, two-channel records
+    arrive at the record rate of the simulator settings. A read returns the
+    most recent records, up to the history length.
+    '''
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.nodes = {}
+        self.subscribed = []
+        self.start = None
+        self.stop = None
+
+        # Records reuse a small pool of waves, keeping the simulator cheap.
+        settings = simulator.settings
+        random = np.random.RandomState(313)
+        time_axis = np.linspace(0, 8 * np.pi, settings.record_length)
+        self.wave_pool = [np.vstack((np.sin(time_axis), \
+            np.cos(time_axis))) * 0.1 + \
+            random.normal(0.0, 0.01, (2, settings.record_length)) \
+                for wave in range(0, 16)]
+
+    def set(self, path, value):
+        self.simulator.call('scopeModule.set')
+        self.nodes[path] = value
+        if path == 'scopeModule/clearhistory':
+            self.start = None
+
+    def subscribe(self, path):
+        self.simulator.call('scopeModule.subscribe')
+        self.subscribed.append(path)
+
+    def execute(self):
+        self.simulator.call('scopeModule.execute')
+        self.start = time.monotonic()
+        self.stop = None
+
+    def finish(self):
+        self.simulator.call('scopeModule.finish')
+        self.stop = time.monotonic()
+
+    def records(self):
+        '''The amount of records acquired since the last execute.'''
+
+        if self.start is None:
+            return 0
+        end = self.stop if self.stop is not None else time.monotonic()
+        return int((end - self.start) * self.simulator.settings.record_rate)
+
+    def getInt(self, path):
+        self.simulator.call('scopeModule.getInt')
+        if path == 'scopeModule/records':
+            return self.records()
+        return int(self.nodes.get(path, 0))
+
+    def progress(self):
+        self.simulator.call('scopeModule.progress')
+        return [1.0 if self.records() > 0 else 0.0]
+
+    def read(self, flat = False):
+        self.simulator.call('scopeModule.read')
+        records = self.records()
+        if records == 0:
+            return {}
+
+        first = max(0, records - self.simulator.settings.history_length)
+        history = [[{'timestamp': record, \
+            'wave': self.wave_pool[record % len(self.wave_pool)]}] \
+                for record in range(first, records)]
+
+        return {path: history for path in self.subscribed}
+
@@ -0,0 +1,83 @@
+#   @title      Sequencer program digest tests
+#   @other      Checks against the simulated ZI API of simulated_zi.py that
+#               the HDAWG driver recompiles its sequencer program whenever
+#               the compiled form of the program changes, also when the
+#               program text itself does not. Run with
+#               python -m unittest test_sequencer_program_digest
+#
+
+import contextlib
+import io
+import unittest
+
+import numpy as np
+
+from driver_loader import loadDriverModule, openDriver, setQuantities
+from simulated_zi import SimulatedZi, SimulatorSettings
+
+
+class ChannelGroupingTest(unittest.TestCase):
+    '''Toggling the oscillator-based repetition delay switches the channel
+    grouping between 1x8 and 4x2, leaving the program text as is.
+    '''
+
+    def setUp(self):
+        self.simulator = SimulatedZi(SimulatorSettings(device_type = 'HDAWG8'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.driver = openDriver( \
+                loadDriverModule('HDAWG', self.simulator), 'HDAWG')
+
+            # Every program is compiled, rather than taken from the cache.
+            setQuantities(self.driver, [('Compiled program cache size', 0), \
+                ('Run mode', 'External trigger'), \
+                ('Channel 1 - Waveform', 0.5 * np.ones(1024))])
+
+    def tearDown(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.driver.performClose()
+        self.simulator.cleanUp()
+
+    def toggleRepetitionDelay(self, value):
+        '''Return the amount of compilations and program uploads made when
+        setting the oscillator-based repetition delay to value.
+        '''
+
+        awg_module = self.simulator.awg_module
+        compilations, uploads = awg_module.compilations, awg_module.uploads
+        with contextlib.redirect_stdout(io.StringIO()):
+            setQuantities(self.driver, \
+                [('Use oscillator-based repetition delay', value)])
+        return awg_module.compilations - compilations, \
+            awg_module.uploads - uploads
+
+    def testGroupingChangeRecompiles(self):
+
+        # The simulated instrument starts out in 4x2 grouping.
+        for value, grouping in [(False, 2), (True, 0), (False, 2)]:
+            skipped = self.driver.getValue('Skipped sequencer recompilations')
+
+            compilations, uploads = self.toggleRepetitionDelay(value)
+
+            self.assertEqual(self.simulator.daq.getInt( \
+                '/dev8000/system/awg/channelgrouping'), grouping)
+            self.assertEqual(compilations, 1)
+            self.assertEqual(uploads, 1)
+            self.assertEqual(self.driver.getValue( \
+                'Skipped sequencer recompilations'), skipped)
+
+    def testCachedProgramMatchesGrouping(self):
+        setQuantities(self.driver, [('Compiled program cache size', 16)])
+
+        # A program compiled under one grouping is never uploaded from the
+        # cache under another, but is once the grouping is restored.
+        for value, expected_compilations in \
+            [(False, 1), (True, 1), (False, 0), (True, 0)]:
+
+            compilations, uploads = self.toggleRepetitionDelay(value)
+
+            self.assertEqual(compilations, expected_compilations)
+            self.assertEqual(uploads, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()